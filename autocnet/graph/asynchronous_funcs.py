@@ -1,187 +1,547 @@
+"""
+Writers that drain the point insert and measure update redis queues into the
+database.
+
+Cluster jobs RPUSH JSON encoded points (see spatial.overlap) or measures (see
+matcher.subpixel) onto a queue and INCR a counter by the number of pushed
+messages. A writer blocks on the queue (BLPOP) until a message is pushed, pops
+up to batch_size messages in one round trip (see lpop_batch), DECRBYs the
+counter by the number of messages read, and writes the whole batch: points and
+their measures are streamed with COPY, measures are updated with one batched
+UPDATE. The queue depth, the write latency and the throughput of each queue are
+kept in a redis hash next to the queue, see writer_metrics.
+
+The writers run as threads (watch_insert_queue and watch_update_queue with a
+threading.Event), as separate processes (start_writer_process) or as asyncio
+tasks (watch_queue_async).
+"""
+import asyncio
+import functools
 import json
+import multiprocessing
 import time
 
-from sqlalchemy import insert
+import numpy as np
+import pandas as pd
+from redis import StrictRedis
+from redis.exceptions import ResponseError
+from sqlalchemy import text
 from sqlalchemy.sql.expression import bindparam
 
+from autocnet.io.db.connection import new_connection
+from autocnet.io.db.controlnetwork import upsert_dataframe
 from autocnet.io.db.model import Points, Measures
 from autocnet.utils.serializers import object_hook
 from autocnet.transformation.spatial import reproject, og2oc
 
-def watch_insert_queue(queue, queue_name, counter_name, engine, stop_event, sleep_time=5):
+def metrics_key(queue_name):
+    """
+    The name of the redis hash with the metrics of the writer of a queue.
+    """
+    return queue_name + ':metrics'
+
+def failed_key(queue_name):
+    """
+    The name of the redis list that the messages of failed writes are pushed to.
+    """
+    return queue_name + ':failed'
+
+def lpop_batch(queue, queue_name, count):
+    """
+    Pop up to count messages from the left side of a redis list.
+
+    LPOP with a count requires redis-py >= 4 and a redis server >= 6.2. With
+    older versions the messages are read with LRANGE and removed with LTRIM in
+    a single MULTI/EXEC transaction instead.
+
+    Returns
+    -------
+    : list
+      Of the (encoded) messages, empty if the queue is empty
+    """
+    try:
+        return queue.lpop(queue_name, count) or []
+    except (TypeError, ResponseError):
+        pipe = queue.pipeline(transaction=True)
+        pipe.lrange(queue_name, 0, count - 1)
+        pipe.ltrim(queue_name, count, -1)
+        msgs, _ = pipe.execute()
+        return msgs
+
+def pop_messages(queue, queue_name, counter_name, batch_size=10000, timeout=5):
+    """
+    Pop a batch of messages from the left side of a redis list.
+
+    If the queue is empty this blocks (BLPOP) for up to timeout seconds until
+    a message is pushed, instead of polling. The counter is decremented by the
+    number of messages read.
+
+    Parameters
+    ----------
+    queue : obj
+            A Redis or StrictRedis connection instance
+
+    queue_name : str
+                 The name of the queue to pop from
+
+    counter_name : str
+                   The name of the counter that producers INCR by the number
+                   of pushed messages
+
+    batch_size : int
+                 The maximum number of messages to pop
+
+    timeout : int
+              The maximum number of seconds to wait for a message. Must be
+              greater than 0, redis blocks forever with a timeout of 0.
+
+    Returns
+    -------
+    msgs : list
+           Of the (encoded) messages, empty if no message was pushed before
+           the timeout
+    """
+    msgs = lpop_batch(queue, queue_name, batch_size)
+    if not msgs:
+        msg = queue.blpop(queue_name, timeout=timeout)
+        if msg is None:
+            return []
+        msgs = [msg[1]]
+        if batch_size > 1:
+            msgs.extend(lpop_batch(queue, queue_name, batch_size - 1))
+    # The messages were read, so atomically decrement the counter
+    queue.decrby(counter_name, len(msgs))
+    return msgs
+
+def record_metrics(queue, queue_name, nrows, latency, failed=0):
+    """
+    Add a written batch to the metrics of a queue. Counts and times are
+    accumulated in redis, so the metrics of several writers of a queue add up.
+    """
+    key = metrics_key(queue_name)
+    pipe = queue.pipeline(transaction=False)
+    pipe.hincrby(key, 'batches', 1)
+    pipe.hincrby(key, 'rows', nrows)
+    pipe.hincrby(key, 'failed', failed)
+    pipe.hincrbyfloat(key, 'write_seconds', latency)
+    pipe.hset(key, mapping={'last_rows':nrows,
+                            'last_latency':latency,
+                            'updated':time.time()})
+    pipe.execute()
+
+def writer_metrics(queue, queue_name):
+    """
+    The metrics of the writer(s) of a queue.
+
+    Parameters
+    ----------
+    queue : obj
+            A Redis or StrictRedis connection instance
+
+    queue_name : str
+                 The name of the watched queue
+
+    Returns
+    -------
+    metrics : dict
+              With the current queue 'depth', the number of written 'batches'
+              and 'rows', the number of 'failed' rows, the total 'write_seconds',
+              the 'rows_per_second' written, and the number of rows
+              ('last_rows') and the write latency ('last_latency') of the last
+              batch
+    """
+    values = {k.decode() if isinstance(k, bytes) else k:float(v)
+              for k, v in queue.hgetall(metrics_key(queue_name)).items()}
+    metrics = {'depth':queue.llen(queue_name)}
+    for k in ['batches', 'rows', 'failed', 'last_rows']:
+        metrics[k] = int(values.get(k, 0))
+    metrics['write_seconds'] = values.get('write_seconds', 0.0)
+    metrics['last_latency'] = values.get('last_latency', 0.0)
+    metrics['rows_per_second'] = metrics['rows'] / metrics['write_seconds'] if metrics['write_seconds'] else 0.0
+    return metrics
+
+def column_names(model):
+    """
+    A dict mapping the attribute names of a model, as used by to_dict, to
+    the names of their columns in the table, e.g., 'ignore' to 'pointIgnore'.
+    """
+    return {prop.key.lstrip('_'):prop.columns[0].name for prop in model.__mapper__.column_attrs}
+
+def insert_defaults(df, table):
+    """
+    Add the scalar column defaults of a table for the columns missing from a
+    dataframe. COPY does not apply the defaults that an insert through
+    sqlalchemy would.
+    """
+    for column in table.c:
+        if column.name not in df.columns and column.default is not None and column.default.is_scalar:
+            df[column.name] = column.default.arg
+    return df
+
+def point_rows(msgs):
+    """
+    The rows of the points and of the measures tables for decoded point
+    messages.
+
+    Parameters
+    ----------
+    msgs : list
+           Of point dicts, with their measures as a list of dicts under 'measures'
+
+    Returns
+    -------
+    points : pd.DataFrame
+             With a row per point, the geometries are EWKT strings
+
+    measures : pd.DataFrame
+               With a row per measure and the index of its point in points
+               in the point_index column
+    """
+    rect_srid = Points.rectangular_srid
+    lat_srid = Points.latitudinal_srid
+
+    point_measures = []
+    for i, msg in enumerate(msgs):
+        for measure in msg.pop('measures', None) or []:
+            measure['point_index'] = i
+            point_measures.append(measure)
+
+    # Since this avoids the ORM, need to map the table names manually
+    points = pd.DataFrame(msgs).rename(columns=column_names(Points))
+    adjusted = points['adjusted'].tolist()
+    x, y, z = np.array([[g.x, g.y, g.z] for g in adjusted], dtype=float).reshape(-1, 3).T
+    lon_og, lat_og, _ = reproject([x, y, z],
+                                  Points.semimajor_rad, Points.semiminor_rad,
+                                  'geocent', 'latlon')
+    lon, lat = og2oc(lon_og, lat_og, Points.semimajor_rad, Points.semiminor_rad)
+
+    # Geometries go in as EWKT
+    points['adjusted'] = [f'SRID={rect_srid};' + g.wkt for g in adjusted]
+    points['apriori'] = points['adjusted']
+    points['geom'] = [f'SRID={lat_srid};Point({lo} {la})' for lo, la in zip(np.atleast_1d(lon), np.atleast_1d(lat))]
+    insert_defaults(points, Points.__table__)
+
+    measures = pd.DataFrame(point_measures, columns=None if point_measures else ['point_index'])
+    measures = measures.rename(columns=column_names(Measures))
+    # Measure ids are assigned by the database
+    measures = measures.drop(columns='id', errors='ignore')
+    insert_defaults(measures, Measures.__table__)
+    return points, measures
+
+def reserve_ids(connection, table, n):
+    """
+    Reserve n ids from the sequence of the id column of a table with a
+    single query.
+    """
+    if n == 0:
+        return []
+    stmt = text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)")
+    return connection.execute(stmt, {'table':table.fullname, 'n':n}).scalars().all()
+
+def write_points(points, measures, connection):
+    """
+    Write points and their measures. The ids of the new points are reserved
+    with one query and set on the measures (pointid), then the points and the
+    measures are each streamed with a COPY.
+
+    Parameters
+    ----------
+    points : pd.DataFrame
+             The rows of the points table, see point_rows
+
+    measures : pd.DataFrame
+               The rows of the measures table with the index of their point
+               in points in the point_index column
+
+    connection : object
+                 An SQLAlchemy connection, e.g., from engine.begin()
+
+    Returns
+    -------
+    pointids : list
+               The ids of the points
+    """
+    points = points.copy()
+    if 'id' not in points.columns:
+        points['id'] = None
+    # A NULL id is not allowable, so reserve the ids of the points without one
+    missing = points['id'].isnull().values
+    pointids = np.array(points['id'], dtype=object)
+    pointids[missing] = reserve_ids(connection, Points.__table__, int(missing.sum()))
+    points['id'] = pointids.astype(np.int64)
+    upsert_dataframe(points, Points, connection)
+
+    if len(measures):
+        measures = measures.copy()
+        measures['pointid'] = points['id'].values[measures.pop('point_index').values.astype(int)]
+        upsert_dataframe(measures, Measures, connection)
+    return points['id'].tolist()
+
+def update_rows(msgs):
+    """
+    The parameters of the batched measure UPDATE for decoded measure messages.
+    """
+    keys = ['weight', 'ignore', 'template_metric', 'template_shift', 'line', 'sample', 'choosername']
+    # id is reserved by sqlalchemy on insert/update, remapped below
+    return [dict({k:msg.get(k) for k in keys}, _id=msg.get('id')) for msg in msgs]
+
+def write_measure_updates(measures, connection):
+    """
+    Update measures with a single batched UPDATE statement.
+
+    Parameters
+    ----------
+    measures : list
+               Of dicts, see update_rows
+
+    connection : object
+                 An SQLAlchemy connection, e.g., from engine.begin()
+    """
+    stmt = Measures.__table__.update().\
+                where(Measures.__table__.c.id == bindparam('_id')).\
+                values({'weight':bindparam('weight'),
+                        'measureIgnore':bindparam('ignore'),
+                        'templateMetric':bindparam('template_metric'),
+                        'templateShift':bindparam('template_shift'),
+                        'line': bindparam('line'),
+                        'sample':bindparam('sample'),
+                        'ChooserName':bindparam('choosername')})
+    connection.execute(stmt, measures)
+
+def _decode(msgs):
+    msgs = [json.loads(msg, object_hook=object_hook) for msg in msgs]
+    return [msg for msg in msgs if isinstance(msg, dict)]
+
+def drain_insert_queue(queue, queue_name, counter_name, engine, batch_size=10000, timeout=5):
+    """
+    Pop a batch of point messages from a queue and write the points and their
+    measures, see pop_messages and write_points.
+
+    If the write fails, the messages are pushed to the failed_key list of the
+    queue and the error is printed.
+
+    Returns
+    -------
+     : int
+       The number of points written
+    """
+    msgs = pop_messages(queue, queue_name, counter_name, batch_size=batch_size, timeout=timeout)
+    if not msgs:
+        return 0
+    t1 = time.time()
+    try:
+        points = _decode(msgs)
+        if points:
+            points, measures = point_rows(points)
+            with engine.begin() as conn:
+                write_points(points, measures, conn)
+    except Exception as e:
+        print(f'Writing {len(msgs)} messages from {queue_name} failed with exception -> {e}')
+        queue.rpush(failed_key(queue_name), *msgs)
+        record_metrics(queue, queue_name, 0, time.time() - t1, failed=len(msgs))
+        return 0
+    record_metrics(queue, queue_name, len(points), time.time() - t1)
+    return len(points)
+
+def drain_update_queue(queue, queue_name, counter_name, engine, batch_size=10000, timeout=5):
+    """
+    Pop a batch of measure messages from a queue and update the measures, see
+    pop_messages and write_measure_updates.
+
+    If the write fails, the messages are pushed to the failed_key list of the
+    queue and the error is printed.
+
+    Returns
+    -------
+     : int
+       The number of measures updated
     """
-    A worker process to be launched in a thread that will asynchronously insert or update 
-    objects in the Session using dicts pulled from a redis queue. Using this queuing approach
+    msgs = pop_messages(queue, queue_name, counter_name, batch_size=batch_size, timeout=timeout)
+    if not msgs:
+        return 0
+    t1 = time.time()
+    try:
+        measures = update_rows(_decode(msgs))
+        if measures:
+            with engine.begin() as conn:
+                write_measure_updates(measures, conn)
+    except Exception as e:
+        print(f'Writing {len(msgs)} messages from {queue_name} failed with exception -> {e}')
+        queue.rpush(failed_key(queue_name), *msgs)
+        record_metrics(queue, queue_name, 0, time.time() - t1, failed=len(msgs))
+        return 0
+    record_metrics(queue, queue_name, len(measures), time.time() - t1)
+    return len(measures)
+
+def watch_insert_queue(queue, queue_name, counter_name, engine, stop_event, sleep_time=5, batch_size=10000):
+    """
+    A worker to be launched in a thread (or process) that will asynchronously insert
+    points, and their measures, pulled from a redis queue. Using this queuing approach
     many cluster jobs are able to push to the redis queue rapidly and then a single writer
     process can push the data back to the database.
-    
-    This function requires that the function called by the asynchronous cluster job INCR
-    (increment) the counter_name key in the redis cache. This counter is INCR (incremented) 
-    by cluster jobs to track how many messages have been pushed to the queue (queue_name). 
-    This func then reads that many messages and DECR (de-increments) the counter by that
-    many messages. This way this function only reads when data is present and reads can occur 
-    asynchronously. This works becase the cluster job pushes to the right side of the redis
-    list and this function reads n-messages from the left side.
-    
-    This method uses the sqlalchemy core interface for performance reasons. Therefore, some
-    mundging of column names is used to ensure that the model to be processed matches the
-    database column names.
-    
+
+    Cluster jobs push JSON encoded points to the right side of the redis list and INCR
+    (increment) the counter_name key by the number of pushed messages. This function
+    blocks until messages are present, reads up to batch_size messages at a time from the
+    left side of the list and DECR (de-increments) the counter by that many messages.
+    The points are written with COPY, see drain_insert_queue.
+
     Parameters
     ----------
     queue : obj
             A Redis or StrictRedis connection instance
-    
+
     queue_name : str
                  The name of the queue to watch
-                 
+
     counter_name : str
-                   The name of the incrementing counter to watch. 
-                   
-    operation : str
-                either 'insert' or 'update'. If 'insert', the sqlalchemy
-                bulk_insert_mappings func is used to add new rows. If 'update', 
-                the sqlalchemy bulks_update_mappings func is used.
-    
+                   The name of the incrementing counter to watch.
+
     engine : obj
-              A sqlalchemy engine. 
-              
+              A sqlalchemy engine.
+
     stop_event : obj
-                 A threading.Event object with set and is_set members. This is the
-                 poison pill that can be set to terminate the thread.
+                 A threading.Event (or multiprocessing.Event) object with set and is_set
+                 members. This is the poison pill that can be set to terminate the thread.
+
+    sleep_time : int
+                 The maximum number of seconds to block waiting for a message before
+                 the stop_event is checked again
+
+    batch_size : int
+                 The maximum number of points written at once
     """
     while not stop_event.is_set():
-        # Determine the read length of objects to pull from the cache
-        read_length = int(queue.get(counter_name))
-        # Pull the objects from the cache
-        points = []
-        measures = []
-        
-        # Pull the SRID dynamically from the model (database)
-        rect_srid = Points.rectangular_srid
-        lat_srid = Points.latitudinal_srid
-
-        for i in range(0, read_length):
-            msg = json.loads(queue.lpop(queue_name), object_hook=object_hook)
-            if isinstance(msg, dict):
-                # A NULL id is not allowable, so pop if a NULL ID exists
-                if msg['id'] == None:
-                    msg.pop('id', None)
-
-                # Since this avoids the ORM, need to map the table names manually
-                msg['pointType'] = msg['pointtype']  
-                adjusted = msg['adjusted']
-            
-                msg['adjusted'] = f'SRID={rect_srid};' + adjusted.wkt  # Geometries go in as EWKT
-                msg['apriori'] = f'SRID={rect_srid};' + adjusted.wkt
-
-                lon_og, lat_og, _ = reproject([adjusted.x, adjusted.y, adjusted.z],
-                                    Points.semimajor_rad, Points.semiminor_rad,
-                                    'geocent', 'latlon')
-                lon, lat = og2oc(lon_og, lat_og, Points.semimajor_rad, Points.semiminor_rad)
-                msg['geom'] = f'SRID={lat_srid};Point({lon} {lat})' 
-
-                # Measures are removed and manually added later
-                point_measures = msg.pop('measures', [])
-                if point_measures:
-                    measures.append(point_measures)
-                
-                points.append(msg)
-            # The message was successfully read, so atomically deincrement the counter
-            queue.decr(counter_name)
-            
-        if points:
-            # Write the cached objects into the database 
-            with engine.connect() as conn:
-                resp = conn.execute(
-                    insert(Points.__table__).returning(Points.__table__.c.id),points
-                )
-                pointids = [i[0] for i in resp.all()]
-
-                # Measures are a list of lists. Associate each list with a pointid and then flatten the list
-                for i, measure_set in enumerate(measures):
-                    for measure in measure_set:
-                        measure['pointid'] = pointids[i]
-                        measure.pop('id', None)  # As above, remove the NULL id
-                        # Remap field names because the ORM is NOT being used
-                        measure['serialnumber'] = measure.pop('serial', None)
-                        measure['measureType'] = measure.pop('measuretype')
-                measures = [measure for sublist in measures for measure in sublist]
-                conn.execute(
-                    insert(Measures.__table__), measures)
-        time.sleep(sleep_time)
-
-def watch_update_queue(queue, queue_name, counter_name, engine, stop_event, sleep_time=5):
-    """
-    A worker process to be launched in a thread that will asynchronously insert or update 
-    objects in the Session using dicts pulled from a redis queue. Using this queuing approach
+        drain_insert_queue(queue, queue_name, counter_name, engine,
+                           batch_size=batch_size, timeout=sleep_time)
+
+def watch_update_queue(queue, queue_name, counter_name, engine, stop_event, sleep_time=5, batch_size=10000):
+    """
+    A worker to be launched in a thread (or process) that will asynchronously update
+    measures using dicts pulled from a redis queue. Using this queuing approach
     many cluster jobs are able to push to the redis queue rapidly and then a single writer
     process can push the data back to the database.
-    
-    This function requires that the function called by the asynchronous cluster job INCR
-    (increment) the counter_name key in the redis cache. This counter is INCR (incremented) 
-    by cluster jobs to track how many messages have been pushed to the queue (queue_name). 
-    This func then reads that many messages and DECR (de-increments) the counter by that
-    many messages. This way this function only reads when data is present and reads can occur 
-    asynchronously. This works becase the cluster job pushes to the right side of the redis
-    list and this function reads n-messages from the left side.
-    
-    This method uses the sqlalchemy core interface for performance reasons. Therefore, some
-    mundging of column names is used to ensure that the model to be processed matches the
-    database column names.
-    
+
+    Cluster jobs push JSON encoded measures to the right side of the redis list and INCR
+    (increment) the counter_name key by the number of pushed messages. This function
+    blocks until messages are present, reads up to batch_size messages at a time from the
+    left side of the list and DECR (de-increments) the counter by that many messages.
+    The measures are updated with a single batched UPDATE, see drain_update_queue.
+
     Parameters
     ----------
     queue : obj
             A Redis or StrictRedis connection instance
-    
+
     queue_name : str
                  The name of the queue to watch
-                 
+
     counter_name : str
-                   The name of the incrementing counter to watch. 
-                   
-    operation : str
-                either 'insert' or 'update'. If 'insert', the sqlalchemy
-                bulk_insert_mappings func is used to add new rows. If 'update', 
-                the sqlalchemy bulks_update_mappings func is used.
-    
+                   The name of the incrementing counter to watch.
+
     engine : obj
-              A sqlalchemy engine. 
-              
+              A sqlalchemy engine.
+
     stop_event : obj
-                 A threading.Event object with set and is_set members. This is the
-                 poison pill that can be set to terminate the thread.
+                 A threading.Event (or multiprocessing.Event) object with set and is_set
+                 members. This is the poison pill that can be set to terminate the thread.
+
+    sleep_time : int
+                 The maximum number of seconds to block waiting for a message before
+                 the stop_event is checked again
+
+    batch_size : int
+                 The maximum number of measures updated at once
     """
     while not stop_event.is_set():
-        # Determine the read length of objects to pull from the cache
-        read_length = int(queue.get(counter_name))
-        # Pull the objects from the cache
-        measures = []
-        
-        for i in range(0, read_length):
-            msg = json.loads(queue.lpop(queue_name), object_hook=object_hook)
-            if isinstance(msg, dict):
-                msg['_id'] = msg.pop('id', None)  # id is reserved by sqlalchemy on insert/update, remapped below
-                measures.append(msg)
-
-            # The message was successfully read, so atomically deincrement the counter
-            queue.decr(counter_name)
-                    
-        # Write the updated measures to the db 
-        if measures:
-            with engine.connect() as conn:
-                stmt = Measures.__table__.update().\
-                            where(Measures.__table__.c.id == bindparam('_id')).\
-                            values({'weight':bindparam('weight'),
-                                    'measureIgnore':bindparam('ignore'),
-                                    'templateMetric':bindparam('template_metric'),
-                                    'templateShift':bindparam('template_shift'),
-                                    'line': bindparam('line'),
-                                    'sample':bindparam('sample'),
-                                    'ChooserName':bindparam('choosername')})
-                resp = conn.execute(
-                    stmt, measures
-                )
-
-    time.sleep(sleep_time)
+        drain_update_queue(queue, queue_name, counter_name, engine,
+                           batch_size=batch_size, timeout=sleep_time)
+
+def _run_writer(watch_func, config, queue_name, counter_name, stop_event, kwargs):
+    """
+    Connect to redis and to the database from a config and run a watcher,
+    the entry point of writer processes.
+    """
+    conf = config['redis']
+    queue = StrictRedis(host=conf['host'], port=conf['port'], db=0)
+    _, engine = new_connection(config['database'])
+
+    # Set the SRIDs and the body radii used to compute the point geometries
+    spatial = config['spatial']
+    Points.rectangular_srid = spatial['rectangular_srid']
+    Points.latitudinal_srid = spatial['latitudinal_srid']
+    Points.semimajor_rad = spatial['semimajor_rad']
+    Points.semiminor_rad = spatial['semiminor_rad']
+
+    watch_func(queue, queue_name, counter_name, engine, stop_event, **kwargs)
+
+def start_writer_process(watch_func, config, queue_name, counter_name, **kwargs):
+    """
+    Start a watcher, e.g., watch_insert_queue, in a separate process with its
+    own redis and database connections.
+
+    Parameters
+    ----------
+    watch_func : callable
+                 watch_insert_queue or watch_update_queue
+
+    config : dict
+             An autocnet config with the redis, database and spatial sections
+
+    queue_name : str
+                 The name of the queue to watch
+
+    counter_name : str
+                   The name of the incrementing counter to watch
+
+    kwargs : dict
+             Of keyword arguments passed to watch_func, e.g., batch_size
+
+    Returns
+    -------
+    process : obj
+              The started multiprocessing.Process
+
+    stop_event : obj
+                 A multiprocessing.Event, set it to stop the process
+    """
+    stop_event = multiprocessing.Event()
+    process = multiprocessing.Process(target=_run_writer,
+                                      args=(watch_func, config, queue_name, counter_name, stop_event, kwargs),
+                                      daemon=True)
+    process.start()
+    return process, stop_event
+
+async def watch_queue_async(drain_func, queue, queue_name, counter_name, engine, stop_event,
+                            sleep_time=5, batch_size=10000, executor=None):
+    """
+    Run a writer as an asyncio task. The blocking pops and database writes
+    of drain_func run in an executor, so the event loop is not blocked.
+
+    Parameters
+    ----------
+    drain_func : callable
+                 drain_insert_queue or drain_update_queue
+
+    stop_event : obj
+                 An asyncio.Event (or threading.Event); the task returns once
+                 it is set
+
+    executor : obj
+               A concurrent.futures executor, None (default) uses the default
+               executor of the event loop
+
+    See watch_insert_queue for the remaining parameters.
+
+    Returns
+    -------
+    nrows : int
+            The number of rows written
+    """
+    loop = asyncio.get_running_loop()
+    drain = functools.partial(drain_func, queue, queue_name, counter_name, engine,
+                              batch_size=batch_size, timeout=sleep_time)
+    nrows = 0
+    while not stop_event.is_set():
+        nrows += await loop.run_in_executor(executor, drain)
+    return nrows
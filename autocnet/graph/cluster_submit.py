@@ -2,24 +2,38 @@
 
 import argparse
 import copy
+import hashlib
 import os
 import json
 import sys
+import time
 import warnings
 
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from io import StringIO 
 from contextlib import redirect_stdout
 
 from redis import StrictRedis
+from redis.exceptions import WatchError
 
 from autocnet.graph.network import NetworkCandidateGraph
 from autocnet.graph.node import NetworkNode
 from autocnet.graph.edge import NetworkEdge
 from autocnet.io.db.model import Points, Measures, Overlay
 from autocnet.utils.utils import import_func
-from autocnet.utils.serializers import JsonEncoder, object_hook
+from autocnet.utils.serializers import JsonEncoder, decode_message
 from autocnet.io.db.model import JobsHistory
 
+# The default visibility timeout, in seconds, of a claimed message
+DEFAULT_TIMEOUT = 3600
+
+# The default number of times a message is run before it is dead lettered
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Seconds a message may sit in the claim list before it is adopted by
+# requeue_expired_messages, see transfer_message_to_work_queue
+CLAIM_GRACE = 60
+
 def parse_args():  # pragma: no cover
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', '--host', help='The host URL for the redis queue to to pull messages from.')
@@ -27,6 +41,9 @@ def parse_args():  # pragma: no cover
     parser.add_argument('-q', '--queue', default=False, action='store_true',
                         help='If passed, run in queue mode, where this job runs until either \
                               walltime is hit or the queue that is being processed is empty.')
+    parser.add_argument('-t', '--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='The visibility timeout in seconds. A message that is not finalized \
+                              within this time is returned to the processing queue.')
     parser.add_argument('processing_queue', help='The name of the processing queue to draw messages from.')
     parser.add_argument('working_queue', help='The name of the queue to push messages to while they process.')
 
@@ -63,22 +80,142 @@ def _instantiate_row(msg, ncg):
         session.expunge_all() # Disconnect the object from the session
     return res
 
-def process(msg):
+def config_hash(config):
+    """
+    Compute a stable content hash for a configuration dict.
+
+    Parameters
+    ----------
+    config : dict
+             The NetworkCandidateGraph configuration
+
+    Returns
+    -------
+     : str
+       The hex digest of the sorted, JSON serialized config
+    """
+    serialized = json.dumps(config, sort_keys=True, cls=JsonEncoder)
+    return hashlib.sha1(serialized.encode()).hexdigest()
+
+def _get_ncg(config, ncg_cache=None):
+    """
+    Get a configured NetworkCandidateGraph for the given config.
+
+    When an ncg_cache is passed, the configured NetworkCandidateGraph (and with it the
+    redis connection, the SQLAlchemy engine and connection pool, and the DEM) is
+    kept in the cache and reused for all messages with the same config. The
+    cache holds a single entry; a change in config disposes of the previous
+    engine and builds a new NetworkCandidateGraph.
+
+    Parameters
+    ----------
+    config : dict
+             The NetworkCandidateGraph configuration
+
+    ncg_cache : dict
+                A mutable mapping of config hash to configured NetworkCandidateGraph.
+                If None (default), a new NetworkCandidateGraph is created.
+
+    Returns
+    -------
+    ncg : obj
+          A configured NetworkCandidateGraph
+    """
+    if ncg_cache is None:
+        ncg = NetworkCandidateGraph()
+        ncg.config_from_dict(config)
+        return ncg
+
+    key = config_hash(config)
+    if key not in ncg_cache:
+        for stale in ncg_cache.values():
+            engine = getattr(stale, 'engine', None)
+            if engine is not None:
+                engine.dispose()
+        ncg_cache.clear()
+
+        ncg = NetworkCandidateGraph()
+        ncg.config_from_dict(config)
+        ncg_cache[key] = ncg
+    return ncg_cache[key]
+
+def load_message(msg, queue, job_cache=None):
+    """
+    Decode a message and merge in the shared job specification it references.
+
+    Messages pushed by NetworkCandidateGraph.apply only carry the id of the
+    object to process and the key of a job specification (func, args, kwargs,
+    walltime, and config) that is stored once on the queue. Self contained
+    messages, without a job key, are returned as decoded.
+
+    Parameters
+    ----------
+    msg : bytes / str
+          The encoded message
+
+    queue : obj
+            A py-Redis queue object, or any mapping with a get method, to read
+            the job specification from
+
+    job_cache : dict
+                Optional cache of decoded job specifications keyed by job key.
+                The cache holds a single entry.
+
+    Returns
+    -------
+    msgdict : dict
+              The full message
+    """
+    msgdict = decode_message(msg)
+    job_key = msgdict.pop('job_spec', None)
+    if job_key is None:
+        return msgdict
+
+    if job_cache is not None and job_key in job_cache:
+        job = job_cache[job_key]
+    else:
+        encoded = queue.get(job_key)
+        if encoded is None:
+            raise KeyError(f'The job specification {job_key} referenced by the message does not exist.')
+        job = decode_message(encoded)
+        if job_cache is not None:
+            job_cache.clear()
+            job_cache[job_key] = job
+
+    msgdict = {**job, **msgdict}
+    # process mutates the args and kwargs; do not leak those changes into the cache
+    msgdict['args'] = list(job['args'])
+    msgdict['kwargs'] = dict(job['kwargs'])
+    return msgdict
+
+def process(msg, ncg_cache=None):
     """
     Given a message, instantiate the necessary processing objects and
     apply some generic function or method.
 
+    The time spent setting up (configuring the NetworkCandidateGraph and
+    instantiating the processing object) and the time spent in the applied
+    function are added to the message as 'setup_time' and 'compute_time'.
+
     Parameters
     ----------
     msg : dict
           The message that parametrizes the job.
+
+    ncg_cache : dict
+                Optional cache used to reuse a configured NetworkCandidateGraph
+                across messages, see _get_ncg.
     """
-    ncg = NetworkCandidateGraph()
-    ncg.config_from_dict(msg['config'])
+    t1 = time.time()
+    ncg = _get_ncg(msg['config'], ncg_cache=ncg_cache)
     if msg['along'] in ['node', 'edge']:
         obj = _instantiate_obj(msg, ncg)
     elif msg['along'] in ['candidategroundpoints', 'points', 'measures', 'overlaps', 'images']:
-        obj = _instantiate_row(msg, ncg)
+        if isinstance(msg.get('id'), list):
+            # A batch of row ids; the applied func loads the rows itself
+            obj = msg['id']
+        else:
+            obj = _instantiate_row(msg, ncg)
     else:
         obj = msg['along']
 
@@ -103,17 +240,116 @@ def process(msg):
         msg['kwargs']['Session'] = ncg.Session
 
     # Now run the function.
+    t2 = time.time()
     res = func(*msg['args'], **msg['kwargs'])
+    t3 = time.time()
 
     # Update the message with the True/False
     msg['results'] = res
+    msg['setup_time'] = t2 - t1
+    msg['compute_time'] = t3 - t2
     # Update the message with the correct callback function
 
     return msg
 
-def transfer_message_to_work_queue(queue, queue_from, queue_to):
+def walltime_seconds(walltime, default=DEFAULT_TIMEOUT):
+    """
+    The number of seconds in a Slurm time limit.
+
+    Parameters
+    ----------
+    walltime : str
+               In one of the Slurm formats 'minutes', 'minutes:seconds',
+               'hours:minutes:seconds', 'days-hours', 'days-hours:minutes' or
+               'days-hours:minutes:seconds'
+
+    default : int
+              Returned if the walltime can not be parsed
+
+    Returns
+    -------
+     : int
+       The number of seconds
+    """
+    try:
+        days, _, rest = str(walltime).rpartition('-')
+        parts = [int(p) for p in rest.split(':')]
+        if days:
+            if len(parts) > 3:
+                raise ValueError
+            hours, minutes, seconds = parts + [0] * (3 - len(parts))
+            return ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+        if len(parts) == 1:
+            return parts[0] * 60
+        if len(parts) == 2:
+            return parts[0] * 60 + parts[1]
+        if len(parts) == 3:
+            return (parts[0] * 60 + parts[1]) * 60 + parts[2]
+        raise ValueError
+    except ValueError:
+        warnings.warn(f'Unable to parse the walltime {walltime}, using {default} seconds.')
+        return default
+
+def lease_key(working_queue):
+    """
+    The name of the sorted set holding the lease deadlines of the messages
+    in the given working queue.
+    """
+    return f'{working_queue}:leases'
+
+def claim_key(working_queue):
+    """
+    The name of the list that messages pass through while they are claimed
+    into the given working queue.
+    """
+    return f'{working_queue}:claiming'
+
+def attempts_key(working_queue):
+    """
+    The name of the hash with the number of times the messages of the given
+    working queue have been requeued, keyed by message id.
+    """
+    return f'{working_queue}:attempts'
+
+def dead_letter_key(working_queue):
+    """
+    The name of the list of the messages of the given working queue that
+    were requeued too many times, see requeue_expired_messages.
+    """
+    return f'{working_queue}:dead'
+
+def message_id(msg):
+    """
+    The id of a message, the sha1 digest of the encoded message. Messages pushed
+    by NetworkCandidateGraph.apply carry a unique message number and are
+    therefore unique.
+
+    Parameters
+    ----------
+    msg : bytes / str
+          The encoded message
+
+    Returns
+    -------
+     : str
+       The message id
+    """
+    if isinstance(msg, str):
+        msg = msg.encode()
+    return hashlib.sha1(msg).hexdigest()
+
+def transfer_message_to_work_queue(queue, queue_from, queue_to, timeout=DEFAULT_TIMEOUT):
     """
-    Atomic pop/push from one redis list to another
+    Atomically claim a message from a redis list.
+
+    The message is popped from queue_from and stored in the queue_to hash, keyed
+    by its message id. A lease, that expires after timeout seconds, is added to
+    the lease sorted set of queue_to. Messages whose lease expires before they are
+    finalized (e.g., because the Slurm task running them was killed) are returned
+    to the processing queue by requeue_expired_messages. The message is popped
+    with RPOPLPUSH into the claim list of queue_to (see claim_key), so claimers
+    do not contend on the processing queue and a message is never only held by
+    the claiming process.
 
     Parameters
     ----------
@@ -124,18 +360,34 @@ def transfer_message_to_work_queue(queue, queue_from, queue_to):
                  The name of the queue to pop a message from
 
     queue_to : str
-               The name of the queue to push a message to
+               The name of the working queue (a redis hash) to claim the message in
+
+    timeout : float
+              The visibility timeout, in seconds, of the claimed message
 
     Returns
     -------
       : str
         The message from the queue
     """
-    return queue.rpoplpush(queue_from, queue_to)
+    # The pop is atomic and does not contend with other claimers. Until the
+    # lease is written the message is held in the claim list, so it is not
+    # lost if this process dies in between; requeue_expired_messages adopts
+    # messages left in the claim list.
+    msg = queue.rpoplpush(queue_from, claim_key(queue_to))
+    if msg is None:
+        return None
+    msg_id = message_id(msg)
+    pipe = queue.pipeline()
+    pipe.hset(queue_to, msg_id, msg)
+    pipe.zadd(lease_key(queue_to), {msg_id:time.time() + timeout})
+    pipe.lrem(claim_key(queue_to), 1, msg)
+    pipe.execute()
+    return msg
 
 def finalize_message_from_work_queue(queue, queue_name, remove_key):
     """
-    Remove a message from a queue
+    Remove a message from a working queue
 
     Parameters
     ----------
@@ -143,22 +395,134 @@ def finalize_message_from_work_queue(queue, queue_name, remove_key):
             PyRedis queue
 
     queue_name : str
-                 The name of the queue to remove an object from
+                 The name of the working queue to remove a message from
 
-    remove_key : obj
-                 The message to remove from the list
+    remove_key : str
+                 The id of the message to remove, see message_id
     """
-    # The operation completed. Remove this message from the working queue.
-    queue.lrem(queue_name, 0, remove_key)
+    # The operation completed. Remove this message and its lease from the working queue.
+    pipe = queue.pipeline()
+    pipe.zrem(lease_key(queue_name), remove_key)
+    pipe.hdel(queue_name, remove_key)
+    pipe.hdel(attempts_key(queue_name), remove_key)
+    pipe.execute()
+
+def requeue_expired_messages(queue, processing_queue, working_queue, now=None,
+                             max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Return messages with expired leases from the working queue to the
+    processing queue.
+
+    Each requeue of a message is counted. A message whose lease expires
+    max_attempts times (e.g., because its job always crashes) is moved to the
+    dead letter list of the working queue (see dead_letter_key) instead.
+    Messages left in the claim list by a claimer that died before writing the
+    lease (see transfer_message_to_work_queue) are given a lease of
+    CLAIM_GRACE seconds and requeued once it expires.
+
+    Parameters
+    ----------
+    queue : object
+            PyRedis queue
+
+    processing_queue : str
+                       The name of the queue to return messages to
+
+    working_queue : str
+                    The name of the working queue
+
+    now : float
+          Messages with a lease deadline before now are requeued. Defaults to the
+          current time. Pass float('inf') to requeue all in-flight messages.
+
+    max_attempts : int
+                   The number of times a message is run before it is dead lettered
+
+    Returns
+    -------
+    nrequeued : int
+                The number of messages returned to the processing queue
+    """
+    if now is None:
+        now = time.time()
+    leases = lease_key(working_queue)
+    attempts = attempts_key(working_queue)
+
+    # Adopt the messages in the claim list. A claimer that is still running
+    # overwrites the lease (ZADD without NX) and removes the message itself.
+    claims = claim_key(working_queue)
+    with queue.pipeline() as pipe:
+        for msg in queue.lrange(claims, 0, -1):
+            msg_id = message_id(msg)
+            while True:
+                try:
+                    pipe.watch(claims)
+                    # The claimer may have written the lease (and even finalized
+                    # the message) since the snapshot. Adopting it then would
+                    # resurrect a finished message.
+                    if msg not in pipe.lrange(claims, 0, -1):
+                        pipe.unwatch()
+                        break
+                    pipe.multi()
+                    pipe.hset(working_queue, msg_id, msg)
+                    pipe.zadd(leases, {msg_id:time.time() + CLAIM_GRACE}, nx=True)
+                    pipe.lrem(claims, 1, msg)
+                    pipe.execute()
+                    break
+                except WatchError:
+                    continue
+
+    nrequeued = 0
+    with queue.pipeline() as pipe:
+        for msg_id in queue.zrangebyscore(leases, '-inf', now):
+            while True:
+                try:
+                    pipe.watch(leases)
+                    # The message may have been finalized or requeued by someone else
+                    deadline = pipe.zscore(leases, msg_id)
+                    if deadline is None or deadline > now:
+                        pipe.unwatch()
+                        break
+                    msg = pipe.hget(working_queue, msg_id)
+                    nattempts = int(pipe.hget(attempts, msg_id) or 0) + 1
+                    pipe.multi()
+                    pipe.zrem(leases, msg_id)
+                    pipe.hdel(working_queue, msg_id)
+                    if msg is not None and nattempts >= max_attempts:
+                        pipe.rpush(dead_letter_key(working_queue), msg)
+                        pipe.hdel(attempts, msg_id)
+                    elif msg is not None:
+                        pipe.rpush(processing_queue, msg)
+                        pipe.hset(attempts, msg_id, nattempts)
+                    pipe.execute()
+                    if msg is not None and nattempts < max_attempts:
+                        nrequeued += 1
+                    elif msg is not None:
+                        warnings.warn(f'Message {msg_id} expired {nattempts} times and was moved to {dead_letter_key(working_queue)}.')
+                    break
+                except WatchError:
+                    # Claims and finalizations change the leases, retry until
+                    # the check and move of this message go through.
+                    continue
+    return nrequeued
 
 def manage_messages(args, queue):
     """
-    This function manages pulling a message from a redis list, atomically pushing
-    the message to another redis list, launching a generic processing job,
-    and finalizing the message by removing it from the intermediary redis list.
+    This function manages pulling a message from a redis list, atomically claiming
+    the message in the working queue, launching a generic processing job,
+    and finalizing the message by removing it, by id, from the working queue.
 
     This function is an easily testable main for the cluster_submit CLI.
 
+    Before processing, messages whose lease in the working queue has expired
+    (e.g., the job processing them was killed) are returned to the processing
+    queue so that they are picked up by this or another worker.
+
+    In queue mode a single worker processes many messages. The configured
+    NetworkCandidateGraph, database engine and DEM are built once and reused
+    for every message with the same config; they are rebuilt only when
+    the config changes.
+
     Parameters
     ----------
     args : dict
@@ -169,12 +533,21 @@ def manage_messages(args, queue):
 
     """
     processing = True
-    
+    ncg_cache = {}
+    job_cache = {}
+    nprocessed = 0
+    setup_time = 0
+    compute_time = 0
+    timeout = args.get('timeout') or DEFAULT_TIMEOUT
+
+    requeue_expired_messages(queue, args['processing_queue'], args['working_queue'])
+
     while processing:
-        # Pop the message from the left queue and push to the right queue; atomic operation
+        # Pop the message from the processing queue and claim it in the working queue; atomic operation
         msg = transfer_message_to_work_queue(queue,
                                             args['processing_queue'],
-                                            args['working_queue'])
+                                            args['working_queue'],
+                                            timeout=timeout)
         
         if msg is None:
             if args['queue'] == False:
@@ -182,24 +555,28 @@ def manage_messages(args, queue):
                 return
             elif args['queue'] == True:
                 print(f'Completed processing from queue: {queue}.')
+                print(f'Processed {nprocessed} messages with {setup_time} seconds of setup and {compute_time} seconds of compute.')
                 return
 
-        # The key to remove from the working queue is the message. Essentially, find this element
-        # in the list where the element is the JSON representation of the message. Maybe swap to a hash?
-        remove_key = msg
+        # The key to remove from the working queue is the message id
+        remove_key = message_id(msg)
         
         #Convert the message from binary into a dict
-        msgdict = json.loads(msg, object_hook=object_hook)
+        msgdict = load_message(msg, queue, job_cache=job_cache)
 
         # should replace this with some logging logic later
         # rather than redirecting std out
         stdout = StringIO()
         with redirect_stdout(stdout):
             # Apply the algorithm
-            response = process(msgdict)
+            response = process(msgdict, ncg_cache=ncg_cache)
             # Should go to a logger someday!
             print(response)
 
+        nprocessed += 1
+        setup_time += response.get('setup_time', 0)
+        compute_time += response.get('compute_time', 0)
+
         out = stdout.getvalue()
         # print to get everything on the logs in the directory
         print(out)
@@ -224,6 +601,159 @@ def manage_messages(args, queue):
             processing = False
         
 
+
+# Per-process caches used by the local executor so that each worker process
+# decodes the job specification and configures its NetworkCandidateGraph once.
+_local_ncg_cache = {}
+_local_job_cache = {}
+
+def process_local(msg, jobs=None):
+    """
+    Process a single raw message in a local worker process.
+
+    This is the unit of work submitted by manage_messages_local. The message is
+    decoded, processed with process, and a small, picklable status is returned
+    to the parent process. Exceptions are caught and reported so that a single
+    failing message does not stop the run.
+
+    Parameters
+    ----------
+    msg : str / bytes
+          The message as pulled from the redis queue
+
+    jobs : dict
+           Of encoded job specifications keyed by job key, as read from the
+           redis queue by the parent process
+
+    Returns
+    -------
+     : dict
+       With keys 'success', 'error', 'setup_time', and 'compute_time'
+    """
+    stdout = StringIO()
+    try:
+        msgdict = load_message(msg, jobs or {}, job_cache=_local_job_cache)
+        with redirect_stdout(stdout):
+            response = process(msgdict, ncg_cache=_local_ncg_cache)
+    except Exception as e:
+        return {'success':False, 'error':repr(e), 'setup_time':0, 'compute_time':0}
+    return {'success':True,
+            'error':None,
+            'setup_time':response.get('setup_time', 0),
+            'compute_time':response.get('compute_time', 0)}
+
+def manage_messages_local(args, queue, n_workers=None, executor=None, verbose=True):
+    """
+    Drain a redis processing queue using a pool of local worker processes.
+
+    This is the local counterpart to the Slurm job array launched by
+    NetworkCandidateGraph.apply. Messages are moved to the working queue with the
+    same atomic pop/push used by manage_messages, processed in parallel with
+    process_local, and removed from the working queue once they succeed. Failed
+    messages are left on the working queue and are returned to the processing
+    queue once their lease expires.
+
+    Parameters
+    ----------
+    args : dict
+           A dictionary with the 'processing_queue' and 'working_queue' names
+           and optionally the visibility 'timeout' in seconds
+
+    queue : obj
+            A py-Redis queue object
+
+    n_workers : int
+                The number of worker processes. If None (default), os.cpu_count() is used.
+
+    executor : obj
+               An optional concurrent.futures.Executor to use instead of creating a
+               ProcessPoolExecutor with n_workers processes. The caller is responsible
+               for shutting down a passed executor.
+
+    verbose : bool
+              If True (default), print progress, throughput and failure counts.
+
+    Returns
+    -------
+    summary : dict
+              With the number of messages processed ('njobs'), failed ('nfailed'),
+              the list of failure reprs ('failures'), the wall clock time ('elapsed'),
+              the throughput in messages per second ('throughput'), and the summed
+              'setup_time' and 'compute_time' reported by the workers.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+
+    timeout = args.get('timeout') or DEFAULT_TIMEOUT
+    requeue_expired_messages(queue, args['processing_queue'], args['working_queue'])
+    total = queue.llen(args['processing_queue'])
+    report_every = max(1, total // 10)
+    summary = {'njobs':0, 'nfailed':0, 'failures':[],
+               'setup_time':0, 'compute_time':0}
+    start = time.time()
+    inflight = {}
+    jobs = {}
+
+    try:
+        exhausted = False
+        while True:
+            # Keep a bounded number of messages in flight so that messages not yet
+            # being processed stay on the processing queue.
+            while not exhausted and len(inflight) < 2 * n_workers:
+                msg = transfer_message_to_work_queue(queue,
+                                                     args['processing_queue'],
+                                                     args['working_queue'],
+                                                     timeout=timeout)
+                if msg is None:
+                    exhausted = True
+                    break
+                # Pass the referenced job specification along, the workers do not
+                # have access to the queue.
+                job_key = decode_message(msg).get('job_spec')
+                if job_key is not None and job_key not in jobs:
+                    jobs[job_key] = queue.get(job_key)
+                job = {job_key:jobs[job_key]} if job_key is not None else {}
+                inflight[executor.submit(process_local, msg, job)] = msg
+
+            if not inflight:
+                break
+
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                msg = inflight.pop(future)
+                try:
+                    status = future.result()
+                except Exception as e:
+                    # The worker itself died, e.g., a BrokenProcessPool
+                    status = {'success':False, 'error':repr(e), 'setup_time':0, 'compute_time':0}
+
+                summary['njobs'] += 1
+                summary['setup_time'] += status['setup_time']
+                summary['compute_time'] += status['compute_time']
+                if status['success']:
+                    finalize_message_from_work_queue(queue, args['working_queue'], message_id(msg))
+                else:
+                    summary['nfailed'] += 1
+                    summary['failures'].append(status['error'])
+
+                if verbose and (summary['njobs'] % report_every == 0 or summary['njobs'] == total):
+                    elapsed = time.time() - start
+                    rate = summary['njobs'] / elapsed if elapsed > 0 else 0
+                    print(f'Processed {summary["njobs"]}/{total} messages ({rate:.2f} msg/s, {summary["nfailed"]} failed).')
+                    sys.stdout.flush()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    summary['elapsed'] = time.time() - start
+    summary['throughput'] = summary['njobs'] / summary['elapsed'] if summary['elapsed'] > 0 else 0
+    if verbose and summary['nfailed']:
+        print(f'{summary["nfailed"]} messages failed and remain on {args["working_queue"]}.')
+    return summary
+
 def main():  # pragma: no cover
     args = vars(parse_args())
     # Get the message
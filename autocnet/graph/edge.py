@@ -24,6 +24,7 @@ from autocnet.cg import cg
 from autocnet.io.db.model import Images, Keypoints, Matches,\
                                  Cameras, Base, Overlay, Edges,\
                                  Costs, Measures, Points, Measures
+from autocnet.io.db.controlnetwork import upsert_dataframe
 from autocnet.io.db.wrappers import DbDataFrame
 
 from plio.io.io_gdal import GeoDataset
@@ -464,6 +465,10 @@ class Edge(dict, MutableMapping):
             func = sp.subpixel_template
             nstrengths = 1
         shifts_x, shifts_y, strengths, new_x, new_y = sp._prep_subpixel(len(matches), nstrengths)
+        source_x = np.empty(len(matches))
+        source_y = np.empty(len(matches))
+        destination_x = np.empty(len(matches))
+        destination_y = np.empty(len(matches))
 
         # for each edge, calculate this for each keypoint pair
         for i, (idx, row) in enumerate(matches.iterrows()):
@@ -486,20 +491,28 @@ class Edge(dict, MutableMapping):
                 dx = d_keypoint.x
                 dy = d_keypoint.y
 
-            if method == 'phase':
-                res = sp.iterative_phase(sx, sy, dx, dy, s_img, d_img, size=template_size, **kwargs)
-                if res[0]:
-                    new_x[i] = res[0]
-                    new_y[i] = res[1]
-                    strengths[i] = res[2]
-            elif method == 'template':
+            source_x[i], source_y[i] = sx, sy
+            destination_x[i], destination_y[i] = dx, dy
+
+            if method == 'template':
                 new_x[i], new_y[i], strengths[i], _ = sp.subpixel_template(sx, sy, dx, dy, s_img, d_img,
                                                                      search_size=search_size,
                                                                      template_size=template_size, **kwargs)
 
-            # Capture the shifts
-            shifts_x[i] = new_x[i] - dx
-            shifts_y[i] = new_y[i] - dy
+        if method == 'phase':
+            # Register all of the keypoint pairs with one batched FFT per iteration
+            size = (template_size, template_size) if np.isscalar(template_size) else template_size
+            res_x, res_y, errors = sp.iterative_phase_stack(source_x, source_y,
+                                                            destination_x, destination_y,
+                                                            s_img, d_img, size=size, **kwargs)
+            converged = ~np.isnan(res_x)
+            new_x[:] = np.where(converged, res_x, destination_x)
+            new_y[:] = np.where(converged, res_y, destination_y)
+            strengths[converged] = errors[converged, None]
+
+        # Capture the shifts
+        shifts_x[:] = new_x - destination_x
+        shifts_y[:] = new_y - destination_y
 
         self.matches.loc[mask, 'shift_x'] = shifts_x
         self.matches.loc[mask, 'shift_y'] = shifts_y
@@ -954,51 +967,17 @@ class NetworkEdge(Edge):
 
     @matches.setter
     def matches(self, v):
-        to_db_add = []
-        to_db_update = []
         df = pd.DataFrame(v)
-        df.index.name = v.index.name
-        # Get the query obj
+        # Determine which rows are updates and which are the addition of new rows
+        if 'id' in df.columns:
+            ids = df['id']
+        elif v.index.name == 'id':
+            ids = df.index
+        else:
+            ids = None
         with self.parent.session_scope() as session:
-            q = session.query(Matches)
-            for idx, row in df.iterrows():
-                # Determine if this is an update or the addition of a new row
-                if hasattr(row, 'id'):
-                    res = q.filter(Matches.id == row.id).first()
-                    match_id = row.id
-                elif v.index.name == 'id':
-                    res = q.filter(Matches.id == row.name).first()
-                    match_id = row.name
-                else:
-                    res = None
-                if res:
-                    # update
-                    mapping = {}
-                    mapping['id'] = match_id
-                    for index in row.index:
-                        row_val = row[index]
-                        if isinstance(row_val, (np.int,)):
-                            row_val = int(row_val)
-                        elif isinstance(row_val, (np.float,)):
-                            row_val = float(row_val)
-                        # This should be uncommented if the matches
-                        # df is refactored to be a geodataframe
-                        #elif isinstance(row_val, WKBElement):
-                        #    continue
-                        mapping[index] = row_val
-                    to_db_update.append(mapping)
-                else:
-                    match = Matches()
-                    # Dynamically iterate over the columns and if the match has an
-                    # attribute with the column name, set it.
-                    for c in df.columns:
-                        if hasattr(match, c):
-                            setattr(match, c, row[c])
-                    to_db_add.append(match)
-            if to_db_add:
-                session.bulk_save_objects(to_db_add)
-            if to_db_update:
-                session.bulk_update_mappings(Matches, to_db_update)
+            timings = upsert_dataframe(df, Matches, session.connection(), ids=ids)
+        self.matches_write_timings = timings
 
     @matches.deleter
     def matches(self):
@@ -1,5 +1,6 @@
 from collections import defaultdict, OrderedDict
 from contextlib import contextmanager
+import hashlib
 import itertools
 import json
 import math
@@ -39,8 +40,10 @@ from plurmy import Slurm
 import autocnet
 from autocnet.config_parser import parse_config
 from autocnet.cg import cg
-from autocnet.graph.asynchronous_funcs import watch_insert_queue, watch_update_queue
+from autocnet.graph.asynchronous_funcs import (watch_insert_queue, watch_update_queue,
+                                               start_writer_process, writer_metrics, metrics_key)
 from autocnet.graph import markov_cluster
+from autocnet.graph import parallel as parallel_apply
 from autocnet.graph.edge import Edge, NetworkEdge
 from autocnet.graph.node import Node, NetworkNode
 from autocnet.io import network as io_network
@@ -49,6 +52,7 @@ from autocnet.io.db.model import (Images, Keypoints, Matches, Cameras, Points,
                                   Base, Overlay, Edges, Costs, Measures, CandidateGroundPoints,
                                   JsonEncoder, try_db_creation)
 from autocnet.io.db.connection import new_connection, Parent
+from autocnet.matcher import cpu_matcher
 from autocnet.matcher import subpixel
 from autocnet.matcher import cross_instrument_matcher as cim
 from autocnet.vis.graph_view import plot_graph, cluster_plot
@@ -57,6 +61,7 @@ from autocnet.spatial.overlap import compute_overlaps_sql
 from autocnet.spatial.isis import point_info
 from autocnet.spatial.surface import GdalDem, EllipsoidDem
 from autocnet.transformation.spatial import reproject, og2oc
+from autocnet.utils.serializers import encode_message
 
 #np.warnings.filterwarnings('ignore')
 
@@ -497,16 +502,66 @@ class CandidateGraph(nx.Graph):
             else:
                 n.load_features(in_path, **kwargs)
 
-    def match(self, *args, **kwargs):
+    def match(self, *args, joint=False, **kwargs):
         """
         For all connected edges in the graph, apply feature matching
 
+        Parameters
+        ----------
+        joint : bool
+                If True, match each node against all of its neighbors at once
+                with one index over the neighbors' descriptors and a single
+                query of the node's descriptors instead of matching edge by
+                edge (CPU only). The matches are split into the edges.
+
+        k : int
+            The number of neighbors to find (per neighbor image if joint)
+
         See Also
         ----------
         autocnet.graph.edge.Edge.match
+        autocnet.matcher.cpu_matcher.match_joint
         """
+        if joint:
+            self.match_joint(*args, **kwargs)
+            return
         self.apply_func_to_edges('match', *args, **kwargs)
 
+    def match_joint(self, k=2, **kwargs):
+        """
+        Apply feature matching to all edges by matching every node against
+        all of its neighbors at once. Every node is queried once against one
+        index over all of its neighbors, which gives the matches of each edge
+        in the direction that has the node as the query.
+
+        Parameters
+        ----------
+        k : int
+            The number of neighbors to find per neighbor image
+
+        kwargs : dict
+                 passed through to autocnet.matcher.cpu_matcher.match_joint
+
+        See Also
+        --------
+        autocnet.matcher.cpu_matcher.match_joint
+        """
+        # The matches queried by the destination and by the source of each
+        # edge, in the order of Edge.match
+        parts = defaultdict(lambda: [None, None])
+        for n, node in self.nodes_iter(data=True):
+            edges = [self.edges[n, m]['data'] for m in self.neighbors(n)]
+            if not edges:
+                continue
+            matches = cpu_matcher.match_joint(node, edges, k=k, **kwargs)
+            for edge, match in zip(edges, matches):
+                key = (edge.source['node_id'], edge.destination['node_id'])
+                parts[key][int(edge.source['node_id'] == n)] = match
+
+        for s, d, edge in self.edges_iter(data=True):
+            edge.masks = pd.DataFrame()
+            cpu_matcher._set_matches(edge, parts[edge.source['node_id'], edge.destination['node_id']])
+
     def decompose_and_match(self, *args, **kwargs):
         """
         For all edges in the graph, apply coupled decomposition followed by
@@ -588,7 +643,7 @@ class CandidateGraph(nx.Graph):
         mst = nx.minimum_spanning_tree(self)
         return self.create_edge_subgraph(mst.edges())
 
-    def apply_func_to_edges(self, function, nodes=[], *args, **kwargs):
+    def apply_func_to_edges(self, function, nodes=[], *args, parallel=False, n_workers=None, **kwargs):
         """
         Iterates over edges using an optional mask and and applies the given function.
         If func is not an attribute of Edge, raises AttributeError
@@ -600,24 +655,46 @@ class CandidateGraph(nx.Graph):
 
         graph_mask_keys : list
                           of keys in graph_masks
+
+        parallel : bool
+                   If True, call the function on the edges in a process pool
+                   and set the updated edges (e.g., matches and masks) on the
+                   graph. The function may only modify the edge. Large arrays
+                   are passed through shared memory. Default: False
+
+        n_workers : int
+                    The number of worker processes if parallel. If None
+                    (default), os.cpu_count() is used.
+
+        See Also
+        --------
+        autocnet.graph.parallel.apply
         """
         return_lis = []
         if callable(function):
             function = function.__name__
 
-        for s, d, edge in self.edges.data('data'):
-            try:
-                func = getattr(edge, function)
-            except:
-                raise AttributeError(function, ' is not an attribute of Edge')
-            else:
-                ret = func(*args, **kwargs)
-                return_lis.append(ret)
+        if parallel:
+            edges = [edge for s, d, edge in self.edges.data('data')]
+            for edge in edges:
+                if not hasattr(edge, function):
+                    raise AttributeError(function, ' is not an attribute of Edge')
+            return_lis = parallel_apply.apply(function, edges, args=args, kwargs=kwargs,
+                                              n_workers=n_workers)
+        else:
+            for s, d, edge in self.edges.data('data'):
+                try:
+                    func = getattr(edge, function)
+                except:
+                    raise AttributeError(function, ' is not an attribute of Edge')
+                else:
+                    ret = func(*args, **kwargs)
+                    return_lis.append(ret)
 
         if any(return_lis):
             return return_lis
 
-    def apply(self, function, on='edge', out=None, args=(), **kwargs):
+    def apply(self, function, on='edge', out=None, args=(), parallel=False, n_workers=None, **kwargs):
         """
         Applys a function to every node or edge, returns collected return
         values. If applying a functions to nodes, then all ignored nodes
@@ -639,8 +716,23 @@ class CandidateGraph(nx.Graph):
         args : iterable
                Some iterable of positional arguments for function.
 
+        parallel : bool
+                   If True, apply the (picklable) function in a process pool
+                   and set the updated nodes or edges (e.g., keypoints,
+                   matches and masks) on the graph. Functions applied to edges
+                   may only modify the edge. Large arrays are passed through
+                   shared memory. Default: False
+
+        n_workers : int
+                    The number of worker processes if parallel. If None
+                    (default), os.cpu_count() is used.
+
         kwargs : dict
                  keyword args to pass into function.
+
+        See Also
+        --------
+        autocnet.graph.parallel.apply
         """
         options = {
             'edge': self.edges_iter,
@@ -661,10 +753,16 @@ class CandidateGraph(nx.Graph):
         # We just want to the object, not the indices, so slice appropriately
         if options[on] == self.edges_iter:
             obj = 2
-        for elem in options[on](data=True):
-            if getattr(elem[obj], 'ignore', False):
-                continue
-            res.append(function(elem[obj], *args, **kwargs))
+        if parallel:
+            objs = [elem[obj] for elem in options[on](data=True)
+                    if not getattr(elem[obj], 'ignore', False)]
+            res = parallel_apply.apply(function, objs, args=args, kwargs=kwargs,
+                                       n_workers=n_workers)
+        else:
+            for elem in options[on](data=True):
+                if getattr(elem[obj], 'ignore', False):
+                    continue
+                res.append(function(elem[obj], *args, **kwargs))
 
         if out:
             out = res
@@ -1391,10 +1489,11 @@ class NetworkCandidateGraph(CandidateGraph):
         filepath : str
                    The path to the config file
 
-        async_watchers : bool
-                         If True the ncg will also spawn redis queue watching threads
+        async_watchers : bool or str
+                         If True (or 'thread') the ncg will also spawn redis queue watching threads
                          that manage asynchronous database inserts. This is primarily
-                         used for increased write performance.
+                         used for increased write performance. If 'process', the watchers
+                         run in separate processes with their own connections.
         """
         # The YAML library will raise any parse errors
         self.config_from_dict(parse_config(filepath), async_watchers=async_watchers)
@@ -1411,10 +1510,11 @@ class NetworkCandidateGraph(CandidateGraph):
         filepath : str
                    The path to the config file
 
-        async_watchers : bool
-                         If True the ncg will also spawn redis queue watching threads
+        async_watchers : bool or str
+                         If True (or 'thread') the ncg will also spawn redis queue watching threads
                          that manage asynchronous database inserts. This is primarily
-                         used for increased write performance.
+                         used for increased write performance. If 'process', the watchers
+                         run in separate processes with their own connections.
         """
         self.config = config_dict
         self.async_watchers = async_watchers
@@ -1425,7 +1525,7 @@ class NetworkCandidateGraph(CandidateGraph):
         self._setup_database()
 
         # Setup threaded queue watchers
-        if self.async_watchers == True:
+        if self.async_watchers:
             self._setup_asynchronous_workers()
 
         # Setup the DEM
@@ -1513,14 +1613,26 @@ class NetworkCandidateGraph(CandidateGraph):
         self.processing_queue = conf['basename'] + ':processing'
         self.completed_queue = conf['basename'] + ':completed'
         self.working_queue = conf['basename'] + ':working'
+        # Lease deadlines of the messages in the working queue, see cluster_submit.lease_key
+        self.working_leases = self.working_queue + ':leases'
+        # Messages being claimed, their requeue counts, and the messages that
+        # were requeued too often, see cluster_submit.requeue_expired_messages
+        self.working_claims = self.working_queue + ':claiming'
+        self.working_attempts = self.working_queue + ':attempts'
+        self.dead_letter_queue = self.working_queue + ':dead'
         self.point_insert_queue = conf['basename'] + ':point_insert_queue'
         self.point_insert_counter = conf['basename'] + ':point_insert_counter'
         self.measure_update_queue = conf['basename'] + ':measure_update_queue'
         self.measure_update_counter = conf['basename'] + ':measure_update_counter'
+        self.message_counter = conf['basename'] + ':message_counter'
+        # Prefix for the shared job specifications referenced by queued messages
+        self.job_prefix = conf['basename'] + ':job:'
 
-        self.queue_names = [self.processing_queue, self.completed_queue, self.working_queue,
+        self.queue_names = [self.processing_queue, self.completed_queue, self.working_queue, self.working_leases,
+                           self.working_claims, self.working_attempts, self.dead_letter_queue,
                            self.point_insert_queue, self.point_insert_counter, 
-                           self.measure_update_queue, self.measure_update_counter]
+                           self.measure_update_queue, self.measure_update_counter,
+                           metrics_key(self.point_insert_queue), metrics_key(self.measure_update_queue)]
          
     def _setup_asynchronous_workers(self):
         
@@ -1533,6 +1645,17 @@ class NetworkCandidateGraph(CandidateGraph):
             self.redis_queue.set(self.measure_update_counter, 0)
 
 
+        if self.async_watchers == 'process':
+            self.point_inserter, self.point_inserter_stop_event = start_writer_process(watch_insert_queue,
+                                                                                       self.config,
+                                                                                       self.point_insert_queue,
+                                                                                       self.point_insert_counter)
+            self.measure_updater, self.measure_updater_stop_event = start_writer_process(watch_update_queue,
+                                                                                         self.config,
+                                                                                         self.measure_update_queue,
+                                                                                         self.measure_update_counter)
+            return
+
         # Start the insert watching thread
         self.point_inserter_stop_event = threading.Event()
         self.point_inserter = threading.Thread(target=watch_insert_queue, 
@@ -1555,6 +1678,20 @@ class NetworkCandidateGraph(CandidateGraph):
         self.measure_updater.setDaemon(True)
         self.measure_updater.start()        
 
+    def writer_metrics(self):
+        """
+        The queue depth, write latency and throughput of the asynchronous
+        point insert and measure update writers, see
+        asynchronous_funcs.writer_metrics.
+
+        Returns
+        -------
+        metrics : dict
+                  With the metrics of the 'point_insert' and 'measure_update' queues
+        """
+        return {'point_insert':writer_metrics(self.redis_queue, self.point_insert_queue),
+                'measure_update':writer_metrics(self.redis_queue, self.measure_update_queue)}
+
     def clear_queues(self):
         """
         Delete all messages from the redis queue. This a convenience method.
@@ -1569,6 +1706,8 @@ class NetworkCandidateGraph(CandidateGraph):
         
         for q in self.queue_names:
             self.redis_queue.delete(q)
+        for key in self.redis_queue.scan_iter(match=self.job_prefix + '*'):
+            self.redis_queue.delete(key)
         
         self._setup_queues()
         if self.async_watchers:
@@ -1592,42 +1731,88 @@ class NetworkCandidateGraph(CandidateGraph):
         conn.execute(sql)
         conn.close()
 
+    def _push_messages(self, messages, function, walltime, args, kwargs, pipeline_size=10000):
+        """
+        Push messages to the redis processing queue.
+
+        Everything that is shared by all of the messages (the function, args,
+        kwargs, walltime, and config) is encoded once and stored under a
+        content hash key. Each message only carries what identifies the object to
+        be processed and a reference to the shared job specification. Messages are
+        msgpack encoded, numbered, and pushed in pipelined batches.
+
+        Parameters
+        ----------
+        messages : iterable
+                   Of dicts with the per message content, e.g., {'along':'points', 'id':1}
+
+        pipeline_size : int
+                        The number of messages to push per pipelined round trip
+
+        Returns
+        -------
+        njobs : int
+                The number of messages pushed
+        """
+        job = encode_message({'func':function,
+                              'args':args,
+                              'kwargs':kwargs,
+                              'walltime':walltime,
+                              'config':self.config})
+        job_key = self.job_prefix + hashlib.sha1(job).hexdigest()
+        self.redis_queue.set(job_key, job)
+
+        njobs = 0
+        messages = iter(messages)
+        pipe = self.redis_queue.pipeline(transaction=False)
+        for batch in iter(lambda: list(itertools.islice(messages, pipeline_size)), []):
+            # Number the messages so that every message, and with it its id in the
+            # working queue, is unique
+            last = self.redis_queue.incrby(self.message_counter, len(batch))
+            encoded = []
+            for i, msg in enumerate(batch, start=last - len(batch) + 1):
+                msg['job_spec'] = job_key
+                msg['mid'] = i
+                encoded.append(encode_message(msg))
+            pipe.rpush(self.processing_queue, *encoded)
+            pipe.execute()
+            njobs += len(encoded)
+        return njobs
+
     def _push_obj_messages(self, onobj, function, walltime, args, kwargs):
         """
         Push messages to the redis queue for objects e.g., Nodes and Edges
         """
+        def messages():
+            for elem in onobj.data('data'):
+                if getattr(elem[-1], 'ignore', False):
+                    continue
+                # Determine if we are working with an edge or a node
+                if len(elem) > 2:
+                    id = (elem[2].source['node_id'],
+                        elem[2].destination['node_id'])
+                    image_path = (elem[2].source['image_path'],
+                                elem[2].destination['image_path'])
+                    along = 'edge'
+                else:
+                    id = (elem[0])
+                    image_path = elem[1]['image_path']
+                    along = 'node'
 
-        for job_counter, elem in enumerate(onobj.data('data')):
-            if getattr(elem[-1], 'ignore', False):
-                continue
-            # Determine if we are working with an edge or a node
-            if len(elem) > 2:
-                id = (elem[2].source['node_id'],
-                    elem[2].destination['node_id'])
-                image_path = (elem[2].source['image_path'],
-                            elem[2].destination['image_path'])
-                along = 'edge'
-            else:
-                id = (elem[0])
-                image_path = elem[1]['image_path']
-                along = 'node'
-
-            msg = {'id':id,
-                   'along':along,
-                    'func':function,
-                    'args':args,
-                    'kwargs':kwargs,
-                    'walltime':walltime,
-                    'image_path':image_path,
-                    'param_step':1,
-                    'config':self.config}
+                yield {'id':id,
+                       'along':along,
+                       'image_path':image_path,
+                       'param_step':1}
 
-            self.redis_queue.rpush(self.processing_queue, json.dumps(msg, cls=JsonEncoder))
-        return job_counter + 1
+        return self._push_messages(messages(), function, walltime, args, kwargs)
 
-    def _push_row_messages(self, query_obj, on, function, walltime, filters, query_string, args, kwargs):
+    def _push_row_messages(self, query_obj, on, function, walltime, filters, query_string, args, kwargs, batch_size=None):
         """
         Push messages to the redis queue for DB objects e.g., Points, Measures
+
+        If batch_size is set, each message carries a list of up to batch_size
+        row ids instead of a single id. Points are ordered by overlap so that
+        each batch is spatially coherent.
         """
         if filters and query_string:
             warnings.warn('Use of filters and query_string are mutually exclusive.')
@@ -1637,43 +1822,32 @@ class NetworkCandidateGraph(CandidateGraph):
             if query_string:
                 res = session.execute(query_string).fetchall()
             else:
-                query = session.query(query_obj)
+                query = session.query(query_obj.id)
 
                 # Now apply any filters that might be passed in.
                 for attr, value in filters.items():
                     query = query.filter(getattr(query_obj, attr)==value)
 
                 # Execute the query to get the rows to be processed
+                if batch_size and hasattr(query_obj, 'overlapid'):
+                    query = query.order_by(query_obj.overlapid)
                 res = query.order_by(query_obj.id).all()
 
             if len(res) == 0:
                 raise ValueError('Query returned zero results.')
-            for row in res:
-                msg = {'along':on,
-                        'id':row.id,
-                        'func':function,
-                        'args':args,
-                        'kwargs':kwargs,
-                        'walltime':walltime}
-                msg['config'] = self.config  # Hacky for now, just passs the whole config dict
-                self.redis_queue.rpush(self.processing_queue,
-                                    json.dumps(msg, cls=JsonEncoder))
-            assert len(res) == self.queue_length
-        return len(res)
+            if batch_size:
+                ids = [row.id for row in res]
+                messages = ({'along':on, 'id':ids[i:i+batch_size]} for i in range(0, len(ids), batch_size))
+            else:
+                messages = ({'along':on, 'id':row.id} for row in res)
+            njobs = self._push_messages(messages, function, walltime, args, kwargs)
+        return njobs
 
     def _push_iterable_message(self, iterable, function, walltime, args, kwargs):
         if not iterable:  # the list is empty...
             raise ValueError('iterable is not an iterable object, e.g., a list or set')
-        for job_counter, item in enumerate(iterable):
-            msg = {'along':item,
-                    'func':function,
-                    'args':args,
-                    'kwargs':kwargs,
-                    'walltime':walltime}
-            msg['config'] = self.config
-            self.redis_queue.rpush(self.processing_queue,
-                                   json.dumps(msg, cls=JsonEncoder))
-        return job_counter + 1
+        messages = ({'along':item} for item in iterable)
+        return self._push_messages(messages, function, walltime, args, kwargs)
 
     def apply(self,
             function,
@@ -1691,6 +1865,9 @@ class NetworkCandidateGraph(CandidateGraph):
             queue=None,
             redis_queue='processing_queue',
             exclude=None,
+            executor='slurm',
+            n_workers=None,
+            batch_size=None,
             **kwargs):
         """
         A mirror of the apply function from the standard CandidateGraph object. This implementation
@@ -1700,6 +1877,11 @@ class NetworkCandidateGraph(CandidateGraph):
         This methods returns the number of jobs submitted. The job status is then asynchronously
         updated as the jobs complete.
 
+        With executor='local' the messages are pushed to the redis queue as usual, but
+        instead of submitting a Slurm job the queue is drained by a pool of local worker
+        processes (see autocnet.graph.cluster_submit.manage_messages_local). This call
+        then blocks until all messages are processed and returns a summary dict.
+
         Parameters
         ----------
 
@@ -1752,7 +1934,9 @@ class NetworkCandidateGraph(CandidateGraph):
                        any queries.
         reapply : bool
                   Flag indicating whether you want to resubmit jobs that are still on the queue
-                  after an initial apply due to an slurm launching errors.
+                  after an initial apply due to an slurm launching errors. Deprecated: messages
+                  whose lease in the working queue has expired are returned to the processing
+                  queue on every apply and by the workers.
         log_dir: str
                  absolute path of directory used to store the jobs logs, defaults to location
                  indicated in the configuration file.
@@ -1767,11 +1951,29 @@ class NetworkCandidateGraph(CandidateGraph):
         redis_queue : str
                       The redis queue to push messages to that are then pulled by the
                       cluster job this call launches. Options are: 'processing_queue' (default)
-                      or 'working_queue'
+                      or 'working_queue'. Deprecated: 'working_queue' returns all in-flight
+                      messages to the processing queue, regardless of their lease.
+
+        executor : str
+                   Where to run the jobs. Either 'slurm' (default), to submit a job to the
+                   cluster, or 'local', to process the messages in a local process pool.
+
+        n_workers : int
+                    The number of worker processes to use when executor='local'. If None
+                    (default), os.cpu_count() is used. Ignored when executor='slurm'.
+
+        batch_size : int
+                     When applying to database rows (e.g., on='points'), the number of row
+                     ids to send per message. If set, the function is called with a list of ids
+                     instead of a single row, e.g., 'matcher.subpixel.subpixel_register_points_batch'.
+                     Points are batched by overlap. If None (default), one row per message.
+
         Returns
         -------
         job_str : str
-                  The string job that is submitted to the job scheduler
+                  The string job that is submitted to the job scheduler. When
+                  executor='local', a dict summarizing the number of processed and
+                  failed messages, elapsed time, and throughput.
 
         Examples
         --------
@@ -1795,13 +1997,24 @@ class NetworkCandidateGraph(CandidateGraph):
         >>> njobs = ncg.apply('spatial.overlap.place_points_in_overlap',\
             on='overlaps', distribute_points_kwargs=distribute_points_kwargs)
         """
-        if log_dir is None:
-            log_dir=self.config['cluster']['cluster_log_dir']
-
+        if executor not in ('slurm', 'local'):
+            raise ValueError(f'executor must be either "slurm" or "local", not {executor}.')
+
+        if reapply:
+            warnings.warn('reapply is deprecated. Messages with expired leases are requeued automatically.',
+                          DeprecationWarning)
+        force = False
+        if redis_queue == 'working_queue':
+            warnings.warn("redis_queue='working_queue' is deprecated. All in-flight messages are returned to the processing queue.",
+                          DeprecationWarning)
+            force = True
+            redis_queue = 'processing_queue'
+
+        # Return messages whose lease expired, e.g., because the job processing them
+        # was killed, to the processing queue. The jobs submitted here process them.
+        nrequeued = self.requeue_expired_messages(force=force)
         job_counter = self.queue_length
 
-        # TODO: reapply uses the queue name and reapplies on that queue.
-
         if not reapply:
             # Determine which obj will be called
             if isinstance(on, str):
@@ -1817,13 +2030,15 @@ class NetworkCandidateGraph(CandidateGraph):
 
             # Dispatch to either the database object message generator or the autocnet object message generator
             if isinstance(onobj, DeclarativeMeta):
-                job_counter = self._push_row_messages(onobj, on, function, walltime, filters, query_string, args, kwargs)
+                job_counter = self._push_row_messages(onobj, on, function, walltime, filters, query_string, args, kwargs,
+                                                      batch_size=batch_size)
             elif isinstance(onobj, (list, np.ndarray)):
                 job_counter = self._push_iterable_message(onobj, function, walltime, args, kwargs)
             elif isinstance(onobj, (nx.classes.reportviews.EdgeView, nx.classes.reportviews.NodeView)):
                 job_counter = self._push_obj_messages(onobj, function, walltime, args, kwargs)
             else:
                 raise TypeError('The type of the `on` argument is not understood. Must be a database model, iterable, Node or Edge.')
+            job_counter += nrequeued
 
         # Submit the jobs
         rconf = self.config['redis']
@@ -1834,6 +2049,16 @@ class NetworkCandidateGraph(CandidateGraph):
         except AttributeError:
             print(f'Unable to find attribute {redis_queue} on this object. Valid queue names are: "processing_queue" and "working_queue".')
 
+        if executor == 'local':
+            # Imported here as cluster_submit imports this module
+            from autocnet.graph.cluster_submit import manage_messages_local
+            queue_names = {'processing_queue':processing_queue,
+                           'working_queue':self.working_queue}
+            return manage_messages_local(queue_names, self.redis_queue, n_workers=n_workers)
+
+        if log_dir is None:
+            log_dir=self.config['cluster']['cluster_log_dir']
+
         env = self.config['env']
         condaenv = env['conda']
         isisroot = env['ISISROOT']
@@ -1841,7 +2066,10 @@ class NetworkCandidateGraph(CandidateGraph):
 
         isissetup = f'export ISISROOT={isisroot} && export ISISDATA={isisdata}'
         condasetup = f'conda activate {condaenv}'
-        job = f'acn_submit -r={rhost} -p={rport} {processing_queue} {self.working_queue}'
+        # Messages not finalized within the walltime of the job are requeued
+        from autocnet.graph.cluster_submit import walltime_seconds
+        timeout = walltime_seconds(walltime)
+        job = f'acn_submit -r={rhost} -p={rport} -t={timeout} {processing_queue} {self.working_queue}'
         if ntasks > 1:
             job += ' --queue'  # Use queue mode where jobs run until the queue is empty
         command = f'{condasetup} && {isissetup} && srun {job}'
@@ -2421,6 +2649,28 @@ class NetworkCandidateGraph(CandidateGraph):
         llen = self.redis_queue.llen(self.processing_queue)
         return llen
 
+    def requeue_expired_messages(self, force=False):
+        """
+        Return messages from the working queue whose lease has expired, e.g.,
+        because the cluster job processing them was cancelled or crashed, to
+        the processing queue.
+
+        Parameters
+        ----------
+        force : bool
+                If True, return all in-flight messages, regardless of their lease.
+
+        Returns
+        -------
+         : int
+           The number of messages returned to the processing queue
+        """
+        # Imported here as cluster_submit imports this module
+        from autocnet.graph.cluster_submit import requeue_expired_messages
+        now = float('inf') if force else None
+        return requeue_expired_messages(self.redis_queue, self.processing_queue,
+                                        self.working_queue, now=now)
+
     @property
     def union(self):
         """
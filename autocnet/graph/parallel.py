@@ -0,0 +1,258 @@
+"""
+Process pool execution of per node and per edge work on an in memory
+CandidateGraph.
+
+The node or edge (with its source and destination nodes) is sent to a worker
+process, the function is applied there, and the return value and the updated
+state of the object (e.g., matches, masks or keypoints) are sent back and set
+on the object in the graph. Numpy arrays larger than SHARED_MEMORY_THRESHOLD,
+including the blocks of dataframes, are passed through shared memory blocks
+instead of being pickled (on Python >= 3.8, where multiprocessing.shared_memory
+is available).
+"""
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import copy
+import io
+import os
+import pickle
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8, the arrays are pickled
+    shared_memory = None
+
+import numpy as np
+
+# Arrays with at least this many bytes are passed through shared memory
+SHARED_MEMORY_THRESHOLD = 2**16
+
+# Attributes referencing other graph objects, these are sent along with the
+# object, but their state is not sent back
+GRAPH_ATTRIBUTES = ('source', 'destination')
+
+# Attributes that are not sent to the workers, e.g., open file handles that
+# are reopened on access
+LOCAL_ATTRIBUTES = ('_geodata',)
+
+
+class SharedMemoryPickler(pickle.Pickler):
+    """
+    A pickler that copies large numpy arrays into shared memory blocks and
+    pickles only a reference to the block.
+
+    Attributes
+    ----------
+    blocks : list
+             of the SharedMemory blocks created while pickling. The creator is
+             responsible for unlinking the blocks once they have been read.
+    """
+    def __init__(self, file, threshold=SHARED_MEMORY_THRESHOLD, **kwargs):
+        super(SharedMemoryPickler, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL, **kwargs)
+        self.threshold = threshold
+        self.blocks = []
+
+    def persistent_id(self, obj):
+        if shared_memory is None:
+            return None
+        if type(obj) is not np.ndarray or obj.dtype.hasobject or obj.nbytes < self.threshold:
+            return None
+        shm = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        view = np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)
+        view[...] = obj
+        del view
+        self.blocks.append(shm)
+        return ('shm', shm.name, obj.shape, obj.dtype)
+
+
+class SharedMemoryUnpickler(pickle.Unpickler):
+    """
+    Unpickles the output of a SharedMemoryPickler, copying the arrays out of
+    their shared memory blocks.
+
+    Parameters
+    ----------
+    unlink : bool
+             If True, unlink the blocks after reading them, i.e., when the
+             reader is responsible for the blocks
+    """
+    def __init__(self, file, unlink=False, **kwargs):
+        super(SharedMemoryUnpickler, self).__init__(file, **kwargs)
+        self.unlink = unlink
+
+    def persistent_load(self, pid):
+        _, name, shape, dtype = pid
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            arr = view.copy()
+            del view
+        finally:
+            shm.close()
+            if self.unlink:
+                shm.unlink()
+        return arr
+
+
+def dumps(obj, threshold=SHARED_MEMORY_THRESHOLD):
+    """
+    Pickle an object, passing large arrays through shared memory.
+
+    Returns
+    -------
+    data : bytes
+           The pickled object
+
+    blocks : list
+             of the created SharedMemory blocks, see release
+    """
+    f = io.BytesIO()
+    pickler = SharedMemoryPickler(f, threshold=threshold)
+    try:
+        pickler.dump(obj)
+    except Exception:
+        release(pickler.blocks)
+        raise
+    return f.getvalue(), pickler.blocks
+
+
+def loads(data, unlink=False):
+    """
+    Unpickle the output of dumps. If unlink is True, the shared memory blocks
+    are unlinked once read.
+    """
+    return SharedMemoryUnpickler(io.BytesIO(data), unlink=unlink).load()
+
+
+def release(blocks):
+    """
+    Close and unlink shared memory blocks created by dumps.
+    """
+    for shm in blocks:
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def portable(obj):
+    """
+    A shallow copy of a node or edge (and of the nodes it references) without
+    the LOCAL_ATTRIBUTES.
+    """
+    obj = copy.copy(obj)
+    for attr in LOCAL_ATTRIBUTES:
+        vars(obj).pop(attr, None)
+    for attr in GRAPH_ATTRIBUTES:
+        if attr in vars(obj):
+            setattr(obj, attr, portable(getattr(obj, attr)))
+    return obj
+
+
+def get_state(obj):
+    """
+    The items and attributes of a node or edge, without the GRAPH_ATTRIBUTES
+    and LOCAL_ATTRIBUTES.
+    """
+    attrs = {k:v for k, v in vars(obj).items()
+             if k not in GRAPH_ATTRIBUTES and k not in LOCAL_ATTRIBUTES}
+    return dict(obj), attrs
+
+
+def set_state(obj, state):
+    """
+    Set the items and attributes returned by get_state on a node or edge.
+    """
+    items, attrs = state
+    obj.clear()
+    obj.update(items)
+    vars(obj).update(attrs)
+
+
+def _apply(data):
+    """
+    Apply a function to a node or edge in a worker process and return the
+    result along with the updated state of the object.
+    """
+    function, obj, args, kwargs, threshold = loads(data)
+    if isinstance(function, str):
+        res = getattr(obj, function)(*args, **kwargs)
+    else:
+        res = function(obj, *args, **kwargs)
+    data, blocks = dumps((res, get_state(obj)), threshold=threshold)
+    # The parent reads and unlinks the blocks
+    for shm in blocks:
+        shm.close()
+    return data
+
+
+def apply(function, objs, args=(), kwargs={}, n_workers=None, threshold=SHARED_MEMORY_THRESHOLD):
+    """
+    Apply a function to nodes or edges in a process pool and set the updated
+    state of every object on the object passed in.
+
+    Functions applied to edges may only modify the edge, changes to the
+    source and destination nodes are not sent back.
+
+    Parameters
+    ----------
+    function : callable or str
+               A picklable function called as function(obj, *args, **kwargs)
+               or the name of a method of the objects
+
+    objs : list
+           of nodes or edges
+
+    args : iterable
+           of positional arguments for function
+
+    kwargs : dict
+             of keyword arguments for function
+
+    n_workers : int
+                The number of worker processes. If None (default), os.cpu_count() is used.
+
+    threshold : int
+                Arrays with at least this many bytes are passed through shared
+                memory instead of being pickled
+
+    Returns
+    -------
+    res : list
+          of the return values, in the order of objs
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    res = [None] * len(objs)
+    inflight = {}
+    pending = iter(enumerate(objs))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        try:
+            exhausted = False
+            while True:
+                # Bound the number of objects held in shared memory
+                while not exhausted and len(inflight) < 2 * n_workers:
+                    try:
+                        i, obj = next(pending)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    data, blocks = dumps((function, portable(obj), args, kwargs, threshold),
+                                         threshold=threshold)
+                    inflight[executor.submit(_apply, data)] = (i, blocks)
+
+                if not inflight:
+                    break
+
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, blocks = inflight.pop(future)
+                    release(blocks)
+                    res[i], state = loads(future.result(), unlink=True)
+                    set_state(objs[i], state)
+        finally:
+            for future, (i, blocks) in inflight.items():
+                future.cancel()
+                release(blocks)
+    return res
@@ -0,0 +1,128 @@
+import asyncio
+import json
+from unittest import mock
+
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+from autocnet.graph import asynchronous_funcs
+
+
+@pytest.fixture
+def measure_messages():
+    return [json.dumps({'id':i, 'pointid':1, 'imageid':2, 'sample':1.5, 'line':2.5,
+                        'weight':0.9, 'ignore':False, 'template_metric':0.8,
+                        'template_shift':0.1, 'choosername':'test'}) for i in range(5)]
+
+def test_pop_messages(queue):
+    queue.rpush('insert', *[str(i) for i in range(5)])
+    queue.set('counter', 5)
+    msgs = asynchronous_funcs.pop_messages(queue, 'insert', 'counter', batch_size=3, timeout=1)
+    assert msgs == [b'0', b'1', b'2']
+    assert int(queue.get('counter')) == 2
+    msgs = asynchronous_funcs.pop_messages(queue, 'insert', 'counter', batch_size=3, timeout=1)
+    assert msgs == [b'3', b'4']
+    assert int(queue.get('counter')) == 0
+    assert asynchronous_funcs.pop_messages(queue, 'insert', 'counter', timeout=1) == []
+
+def test_pop_messages_without_lpop_count(queue):
+    # redis-py < 4 and redis servers < 6.2 do not support LPOP with a count
+    queue.rpush('insert', *[str(i) for i in range(5)])
+    queue.set('counter', 5)
+    with mock.patch.object(queue, 'lpop', side_effect=TypeError):
+        msgs = asynchronous_funcs.pop_messages(queue, 'insert', 'counter', batch_size=3, timeout=1)
+        assert msgs == [b'0', b'1', b'2']
+        msgs = asynchronous_funcs.pop_messages(queue, 'insert', 'counter', batch_size=3, timeout=1)
+        assert msgs == [b'3', b'4']
+    assert queue.llen('insert') == 0
+    assert int(queue.get('counter')) == 0
+
+def test_writer_metrics(queue):
+    assert asynchronous_funcs.writer_metrics(queue, 'insert')['rows_per_second'] == 0
+    asynchronous_funcs.record_metrics(queue, 'insert', 100, 0.5)
+    asynchronous_funcs.record_metrics(queue, 'insert', 50, 0.25)
+    queue.rpush('insert', 'a', 'b')
+    metrics = asynchronous_funcs.writer_metrics(queue, 'insert')
+    assert metrics['depth'] == 2
+    assert metrics['batches'] == 2
+    assert metrics['rows'] == 150
+    assert metrics['last_rows'] == 50
+    assert metrics['write_seconds'] == pytest.approx(0.75)
+    assert metrics['rows_per_second'] == pytest.approx(200)
+
+def test_drain_update_queue(queue, measure_messages):
+    queue.rpush('update', *measure_messages)
+    queue.set('counter', 5)
+    engine = mock.MagicMock()
+    with mock.patch.object(asynchronous_funcs, 'write_measure_updates') as write:
+        assert asynchronous_funcs.drain_update_queue(queue, 'update', 'counter', engine, timeout=1) == 5
+    # The whole batch is written with a single statement
+    write.assert_called_once()
+    rows = write.call_args[0][0]
+    assert [r['_id'] for r in rows] == list(range(5))
+    assert set(rows[0]) == {'_id', 'weight', 'ignore', 'template_metric', 'template_shift',
+                            'line', 'sample', 'choosername'}
+    assert int(queue.get('counter')) == 0
+    assert asynchronous_funcs.writer_metrics(queue, 'update')['rows'] == 5
+
+def test_drain_update_queue_failure(queue, measure_messages):
+    queue.rpush('update', *measure_messages)
+    queue.set('counter', 5)
+    engine = mock.MagicMock()
+    with mock.patch.object(asynchronous_funcs, 'write_measure_updates', side_effect=ValueError('failed')):
+        assert asynchronous_funcs.drain_update_queue(queue, 'update', 'counter', engine, timeout=1) == 0
+    # The messages are kept for inspection
+    assert queue.lrange(asynchronous_funcs.failed_key('update'), 0, -1) == [m.encode() for m in measure_messages]
+    assert asynchronous_funcs.writer_metrics(queue, 'update')['failed'] == 5
+
+def test_point_rows():
+    msgs = [{'id':None, 'pointtype':2, 'identifier':None, 'overlapid':i, 'cam_type':'isis',
+             'ignore':False, 'adjusted':Point(1, 0, 0),
+             'measures':[{'id':None, 'pointid':None, 'imageid':j, 'serial':f'serial{j}',
+                          'measuretype':3, 'sample':1, 'line':2, 'ignore':False} for j in range(i)]}
+            for i in range(1, 4)]
+    points, measures = asynchronous_funcs.point_rows(msgs)
+    assert len(points) == 3
+    assert points['pointType'].tolist() == [2, 2, 2]
+    assert points['pointIgnore'].tolist() == [False] * 3
+    assert points['adjusted'][0].startswith('SRID=')
+    assert points['geom'][0].startswith('SRID=')
+    assert measures['point_index'].tolist() == [0, 1, 1, 2, 2, 2]
+    assert measures['serialnumber'].tolist() == ['serial0', 'serial0', 'serial1', 'serial0', 'serial1', 'serial2']
+    assert 'measureType' in measures
+    assert 'id' not in measures
+
+def test_write_points():
+    points = pd.DataFrame({'id':[None, 7, None], 'pointType':[2, 2, 2]})
+    measures = pd.DataFrame({'point_index':[0, 1, 1, 2], 'imageid':[1, 2, 3, 4]})
+    conn = mock.MagicMock()
+    with mock.patch.object(asynchronous_funcs, 'reserve_ids', return_value=[10, 11]) as reserve, \
+         mock.patch.object(asynchronous_funcs, 'upsert_dataframe') as upsert:
+        pointids = asynchronous_funcs.write_points(points, measures, conn)
+    assert pointids == [10, 7, 11]
+    assert reserve.call_args[0][2] == 2
+    # One COPY for the points, one for the measures
+    assert upsert.call_count == 2
+    written = upsert.call_args_list[1][0][0]
+    assert written['pointid'].tolist() == [10, 7, 7, 11]
+    assert 'point_index' not in written
+
+def test_watch_queue_async(queue, measure_messages):
+    queue.rpush('update', *measure_messages)
+    queue.set('counter', 5)
+    engine = mock.MagicMock()
+
+    async def run():
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(asynchronous_funcs.watch_queue_async(asynchronous_funcs.drain_update_queue,
+                                                                        queue, 'update', 'counter', engine,
+                                                                        stop_event, sleep_time=1, batch_size=2))
+        while queue.llen('update'):
+            await asyncio.sleep(0.01)
+        stop_event.set()
+        return await task
+
+    with mock.patch.object(asynchronous_funcs, 'write_measure_updates') as write:
+        assert asyncio.run(run()) == 5
+    assert write.call_count == 3
@@ -1,12 +1,14 @@
 import json
 import os
+import time
 from unittest import mock
 from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pytest
 
-from autocnet.utils.serializers import JsonEncoder, object_hook
+from autocnet.utils.serializers import JsonEncoder, object_hook, encode_message
 from autocnet.graph import cluster_submit
 from autocnet.graph.node import NetworkNode
 from autocnet.graph.edge import NetworkEdge
@@ -52,7 +54,7 @@ def test_manage_simple_messages(args, queue, simple_message, mocker, capfd, ncg)
     assert out.strip() == str(response_msg).strip() 
 
     # Check that the messages are finalizing
-    assert queue.llen(args['working_queue']) == 0
+    assert queue.hlen(args['working_queue']) == 0
 
 def test_manage_complex_messages(args, queue, complex_message, mocker, capfd, ncg):
     queue.rpush(args['processing_queue'], complex_message)
@@ -68,7 +70,7 @@ def test_manage_complex_messages(args, queue, complex_message, mocker, capfd, nc
     assert out.strip() == str(response_msg).strip()
 
     # Check that the messages are finalizing
-    assert queue.llen(args['working_queue']) == 0
+    assert queue.hlen(args['working_queue']) == 0
 
 
 def test_job_history(args, queue, complex_message, mocker, capfd, ncg):
@@ -92,16 +94,140 @@ def test_job_history(args, queue, complex_message, mocker, capfd, ncg):
 
 def test_transfer_message_to_work_queue(args, queue, simple_message):
     queue.rpush(args['processing_queue'], simple_message)
-    cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'])
-    msg = queue.lpop(args['working_queue'])
+    msg = cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'], timeout=60)
     assert msg.decode() == simple_message
+    assert queue.llen(args['processing_queue']) == 0
+
+    # The message is claimed by id with a lease
+    msg_id = cluster_submit.message_id(simple_message)
+    assert queue.hget(args['working_queue'], msg_id).decode() == simple_message
+    deadline = queue.zscore(cluster_submit.lease_key(args['working_queue']), msg_id)
+    assert time.time() < deadline <= time.time() + 60
+    assert queue.llen(cluster_submit.claim_key(args['working_queue'])) == 0
+
+def test_transfer_message_empty_queue(args, queue):
+    assert cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue']) is None
 
 def test_finalize_message_from_work_queue(args, queue, simple_message):
-    remove_key = simple_message
-    queue.rpush(args['working_queue'], simple_message)
+    queue.rpush(args['processing_queue'], simple_message)
+    cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'])
+    remove_key = cluster_submit.message_id(simple_message)
     cluster_submit.finalize_message_from_work_queue(queue, args['working_queue'], remove_key)
-    assert queue.llen(args['working_queue']) == 0
-    
+    assert queue.hlen(args['working_queue']) == 0
+    assert queue.zcard(cluster_submit.lease_key(args['working_queue'])) == 0
+
+def test_requeue_expired_messages(args, queue, simple_message, complex_message):
+    queue.rpush(args['processing_queue'], simple_message, complex_message)
+    cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'], timeout=-1)
+    cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'], timeout=60)
+
+    # Only the message with the expired lease is requeued
+    assert cluster_submit.requeue_expired_messages(queue, args['processing_queue'], args['working_queue']) == 1
+    assert queue.lrange(args['processing_queue'], 0, -1) == [complex_message.encode()]
+    assert queue.hlen(args['working_queue']) == 1
+
+    # Requeue everything that is in-flight
+    assert cluster_submit.requeue_expired_messages(queue, args['processing_queue'], args['working_queue'], now=float('inf')) == 1
+    assert queue.llen(args['processing_queue']) == 2
+    assert queue.hlen(args['working_queue']) == 0
+    assert queue.zcard(cluster_submit.lease_key(args['working_queue'])) == 0
+
+def test_requeue_adopts_claimed_messages(args, queue, simple_message):
+    # A claimer died after popping the message and before writing its lease
+    queue.rpush(args['processing_queue'], simple_message)
+    queue.rpoplpush(args['processing_queue'], cluster_submit.claim_key(args['working_queue']))
+
+    assert cluster_submit.requeue_expired_messages(queue, args['processing_queue'], args['working_queue']) == 0
+    assert queue.llen(cluster_submit.claim_key(args['working_queue'])) == 0
+    assert queue.hlen(args['working_queue']) == 1
+
+    # Once the grace period is over the message is requeued
+    now = time.time() + cluster_submit.CLAIM_GRACE + 1
+    assert cluster_submit.requeue_expired_messages(queue, args['processing_queue'], args['working_queue'], now=now) == 1
+    assert queue.lrange(args['processing_queue'], 0, -1) == [simple_message.encode()]
+
+def test_requeue_skips_claims_finalized_after_snapshot(args, queue, simple_message, mocker):
+    queue.rpush(args['processing_queue'], simple_message)
+    queue.rpoplpush(args['processing_queue'], cluster_submit.claim_key(args['working_queue']))
+
+    # The claimer writes its lease and finalizes the message after the
+    # reaper has read the claim list, but before it adopts the message
+    lrange = queue.lrange
+    def snapshot_then_finalize(*args_, **kwargs):
+        claimed = lrange(*args_, **kwargs)
+        msg_id = cluster_submit.message_id(simple_message)
+        pipe = queue.pipeline()
+        pipe.hset(args['working_queue'], msg_id, simple_message)
+        pipe.zadd(cluster_submit.lease_key(args['working_queue']), {msg_id:time.time() + 60})
+        pipe.lrem(cluster_submit.claim_key(args['working_queue']), 1, simple_message)
+        pipe.execute()
+        cluster_submit.finalize_message_from_work_queue(queue, args['working_queue'], msg_id)
+        return claimed
+    mocker.patch.object(queue, 'lrange', side_effect=snapshot_then_finalize)
+
+    now = time.time() + cluster_submit.CLAIM_GRACE + 1
+    assert cluster_submit.requeue_expired_messages(queue, args['processing_queue'], args['working_queue'], now=now) == 0
+    assert queue.hlen(args['working_queue']) == 0
+    assert queue.zcard(cluster_submit.lease_key(args['working_queue'])) == 0
+    assert queue.llen(args['processing_queue']) == 0
+
+def test_requeue_dead_letters_messages(args, queue, simple_message):
+    queue.rpush(args['processing_queue'], simple_message)
+    cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'], timeout=-1)
+    assert cluster_submit.requeue_expired_messages(queue, args['processing_queue'], args['working_queue'], max_attempts=2) == 1
+
+    cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'], timeout=-1)
+    with pytest.warns(UserWarning, match='expired 2 times'):
+        assert cluster_submit.requeue_expired_messages(queue, args['processing_queue'], args['working_queue'], max_attempts=2) == 0
+    assert queue.llen(args['processing_queue']) == 0
+    assert queue.lrange(cluster_submit.dead_letter_key(args['working_queue']), 0, -1) == [simple_message.encode()]
+    assert queue.hlen(cluster_submit.attempts_key(args['working_queue'])) == 0
+
+def test_requeue_retries_on_watch_error(args, queue, simple_message, mocker):
+    queue.rpush(args['processing_queue'], simple_message)
+    cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'], timeout=-1)
+
+    # Another worker changes the leases during the first attempt
+    pipeline = type(queue.pipeline())
+    execute = pipeline.execute
+    calls = []
+    def flaky_execute(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            # As redis-py does, the pipeline is reset when the transaction aborts
+            self.reset()
+            raise cluster_submit.WatchError()
+        return execute(self, *args, **kwargs)
+    mocker.patch.object(pipeline, 'execute', flaky_execute)
+
+    assert cluster_submit.requeue_expired_messages(queue, args['processing_queue'], args['working_queue']) == 1
+    assert len(calls) == 2
+    assert queue.hlen(args['working_queue']) == 0
+
+@pytest.mark.parametrize("walltime, expected", [
+    ('01:00:00', 3600),
+    ('30', 1800),
+    ('10:30', 630),
+    ('1-00:00:00', 86400),
+    ('2-03', 183600),
+    ('1-01:30', 91800)
+])
+def test_walltime_seconds(walltime, expected):
+    assert cluster_submit.walltime_seconds(walltime) == expected
+
+def test_walltime_seconds_unparsable():
+    with pytest.warns(UserWarning):
+        assert cluster_submit.walltime_seconds('1:2:3:4', default=10) == 10
+
+def test_manage_messages_requeues_expired(args, queue, simple_message, mocker):
+    queue.rpush(args['processing_queue'], simple_message)
+    cluster_submit.transfer_message_to_work_queue(queue, args['processing_queue'], args['working_queue'], timeout=-1)
+
+    mocker.patch('autocnet.graph.cluster_submit.process', return_value={'success':True})
+    cluster_submit.manage_messages(args, queue)
+    cluster_submit.process.assert_called_once()
+    assert queue.hlen(args['working_queue']) == 0
+
 def test_no_msg(args, queue):
     with pytest.warns(UserWarning, match='Expected to process a cluster job, but the message queue is empty.'):
         cluster_submit.manage_messages(args, queue)
@@ -167,6 +293,22 @@ def test_process_row(along, func, msg_additions, mocker):
     
     cluster_submit._instantiate_row.assert_called_once()
 
+def test_process_row_batch(mocker):
+    msg = {'along':'points',
+           'id':[1, 2, 3],
+           'config':{},
+           'func':_do_nothing,
+           'args':[],
+           'kwargs':{}}
+    mocker.patch('autocnet.graph.cluster_submit._instantiate_row')
+    mocker.patch('autocnet.graph.network.NetworkCandidateGraph.config_from_dict')
+    msg = cluster_submit.process(msg)
+
+    # The batch of ids is passed through to the func without loading the rows
+    assert msg['results'] == True
+    assert msg['args'][0] == [1, 2, 3]
+    assert not cluster_submit._instantiate_row.called
+
 @pytest.mark.parametrize("along, func, msg_additions",[
                         ([1,2,3,4,5], _do_nothing, {})
                         ])
@@ -190,6 +332,29 @@ def test_process_generic(along, func, msg_additions, mocker):
     # Message result should be the same as 
     assert msg['results'] == True
 
+def test_process_reuses_ncg(mocker):
+    config_from_dict = mocker.patch('autocnet.graph.network.NetworkCandidateGraph.config_from_dict')
+    ncg_cache = {}
+    for config in [{'a':1}, {'a':1}, {'a':2}]:
+        msg = {'along':[1,2,3],
+               'config':config,
+               'func':_do_nothing,
+               'args':[],
+               'kwargs':{}}
+        msg = cluster_submit.process(msg, ncg_cache=ncg_cache)
+        assert msg['results'] == True
+        assert msg['setup_time'] >= 0
+        assert msg['compute_time'] >= 0
+
+    # Built once for the first config and once more when the config changed
+    assert config_from_dict.call_count == 2
+    assert len(ncg_cache) == 1
+    assert cluster_submit.config_hash({'a':2}) in ncg_cache
+
+def test_config_hash():
+    assert cluster_submit.config_hash({'a':1, 'b':2}) == cluster_submit.config_hash({'b':2, 'a':1})
+    assert cluster_submit.config_hash({'a':1}) != cluster_submit.config_hash({'a':2})
+
 @pytest.mark.parametrize("msg, expected", [
                             ({'along':'node','id':0, 'image_path':'/foo.img'}, NetworkNode),
                             ({'along':'edge','id':(0,1), 'image_path':('/foo.img', '/foo2.img')}, NetworkEdge)
@@ -209,4 +374,85 @@ def test_instantiate_row(msg, expected, mocker):
     mock_ncg.session_scope.return_value.__enter__.return_value.query.return_value.filter.return_value.one.return_value = expected()
 
     obj = cluster_submit._instantiate_row(msg, mock_ncg)
-    assert isinstance(obj, expected)
\ No newline at end of file
+    assert isinstance(obj, expected)
+
+def _fail(*args, **kwargs):
+    raise ValueError('bad message')
+
+def test_process_local(mocker):
+    mocker.patch('autocnet.graph.network.NetworkCandidateGraph.config_from_dict')
+    msg = json.dumps({'along':[1,2,3], 'config':{}, 'func':_do_nothing,
+                      'args':[], 'kwargs':{}}, cls=JsonEncoder)
+    status = cluster_submit.process_local(msg)
+    assert status['success'] == True
+    assert status['error'] is None
+
+    msg = json.dumps({'along':[1,2,3], 'config':{}, 'func':_fail,
+                      'args':[], 'kwargs':{}}, cls=JsonEncoder)
+    status = cluster_submit.process_local(msg)
+    assert status['success'] == False
+    assert 'bad message' in status['error']
+
+def test_manage_messages_local(args, queue, mocker, capfd):
+    mocker.patch('autocnet.graph.network.NetworkCandidateGraph.config_from_dict')
+    for i in range(5):
+        func = _fail if i == 3 else _do_nothing
+        queue.rpush(args['processing_queue'],
+                    json.dumps({'along':[i], 'config':{}, 'func':func,
+                                'args':[], 'kwargs':{}}, cls=JsonEncoder))
+
+    # Threads stand in for processes so that the mocks are shared with the workers
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        summary = cluster_submit.manage_messages_local(args, queue, n_workers=2, executor=executor)
+
+    assert summary['njobs'] == 5
+    assert summary['nfailed'] == 1
+    assert summary['throughput'] > 0
+    assert queue.llen(args['processing_queue']) == 0
+    # The failed message is left on the working queue to be reapplied
+    assert queue.hlen(args['working_queue']) == 1
+
+    out, err = capfd.readouterr()
+    assert 'Processed 5/5 messages' in out
+
+def test_load_message(queue):
+    job = {'func':_do_nothing, 'args':['arg1'], 'kwargs':{'k1':'foo'},
+           'walltime':'01:00:00', 'config':{'a':1}}
+    queue.set('test:job:abc', encode_message(job))
+    msg = encode_message({'along':'points', 'id':5, 'job_spec':'test:job:abc'})
+
+    job_cache = {}
+    msgdict = cluster_submit.load_message(msg, queue, job_cache=job_cache)
+    assert msgdict['id'] == 5
+    assert msgdict['config'] == {'a':1}
+    assert msgdict['func'](None) == True
+    assert 'job_spec' not in msgdict
+    assert 'test:job:abc' in job_cache
+
+    # Changes made while processing must not leak into the cached job
+    msgdict['kwargs']['ncg'] = None
+    msgdict = cluster_submit.load_message(msg, queue, job_cache=job_cache)
+    assert msgdict['kwargs'] == {'k1':'foo'}
+
+def test_load_message_missing_job(queue):
+    msg = encode_message({'along':'points', 'id':5, 'job_spec':'test:job:missing'})
+    with pytest.raises(KeyError):
+        cluster_submit.load_message(msg, queue)
+
+def test_load_json_message(queue, simple_message):
+    msgdict = cluster_submit.load_message(simple_message, queue)
+    assert msgdict['kwargs'] == {"k1" : "foo", "k2" : "bar"}
+
+def test_manage_messages_local_with_job(args, queue, mocker):
+    mocker.patch('autocnet.graph.network.NetworkCandidateGraph.config_from_dict')
+    job = {'func':_do_nothing, 'args':[], 'kwargs':{}, 'walltime':'01:00:00', 'config':{}}
+    queue.set('test:job:abc', encode_message(job))
+    for i in range(3):
+        queue.rpush(args['processing_queue'], encode_message({'along':[i], 'job_spec':'test:job:abc'}))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        summary = cluster_submit.manage_messages_local(args, queue, n_workers=2,
+                                                       executor=executor, verbose=False)
+    assert summary['njobs'] == 3
+    assert summary['nfailed'] == 0
+    assert queue.hlen(args['working_queue']) == 0
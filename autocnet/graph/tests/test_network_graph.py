@@ -7,6 +7,7 @@ from plio.io.io_controlnetwork import IsisControlNetwork
 
 from autocnet.io.db import model
 from autocnet.graph.network import NetworkCandidateGraph
+from autocnet.utils.serializers import decode_message
 
 from unittest.mock import patch, PropertyMock, MagicMock
 
@@ -153,3 +154,28 @@ def test_cnet_to_db(ncg, cnet):
         assert key in m_df.columns, f"column \'{key}\' not in measures dataframe"
 
 # TO DO: test the clear tables functionality on ncg.place_points_from_cnet
+
+def test_push_iterable_message(queue):
+    ncg = NetworkCandidateGraph()
+    ncg.config = {'redis':{'basename':'test'}}
+    ncg.redis_queue = queue
+    ncg.processing_queue = 'test:processing'
+    ncg.job_prefix = 'test:job:'
+    ncg.message_counter = 'test:message_counter'
+
+    njobs = ncg._push_messages(({'along':i} for i in range(25)), 'foo', '01:00:00', (), {'k':1}, pipeline_size=10)
+    assert njobs == 25
+    assert queue.llen(ncg.processing_queue) == 25
+
+    # The shared job specification is stored once and referenced by every message
+    job_keys = list(queue.scan_iter(match='test:job:*'))
+    assert len(job_keys) == 1
+    msg = decode_message(queue.lindex(ncg.processing_queue, 3))
+    assert msg == {'along':3, 'job_spec':job_keys[0].decode(), 'mid':4}
+    job = decode_message(queue.get(job_keys[0]))
+    assert job['config'] == ncg.config
+    assert job['kwargs'] == {'k':1}
+
+    # Messages are numbered and therefore unique, even for identical content
+    ncg._push_messages(iter([{'along':3}]), 'foo', '01:00:00', (), {'k':1})
+    assert decode_message(queue.lindex(ncg.processing_queue, -1))['mid'] == 26
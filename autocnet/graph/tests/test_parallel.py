@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from .. import parallel
+
+
+class Item(dict):
+    def __init__(self, values):
+        self['name'] = 'item'
+        self.values = values
+
+    def scale(self, factor):
+        self.frame = pd.DataFrame({'x':self.values * factor})
+        self['scaled'] = True
+        return len(self.values)
+
+
+class Pair(dict):
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+
+    def combine(self):
+        self.combined = np.concatenate((self.source.values, self.destination.values))
+        # Changes to the nodes are not sent back
+        self.source.values = None
+
+
+def total(item, offset=0):
+    return item.values.sum() + offset
+
+
+def test_dumps_uses_shared_memory():
+    obj = {'big':np.arange(10000, dtype=np.float64),
+           'small':np.arange(3),
+           'frame':pd.DataFrame({'a':np.arange(10000.), 'b':np.arange(10000.)})}
+    data, blocks = parallel.dumps(obj)
+    try:
+        # The large array and the dataframe block are in shared memory
+        assert len(blocks) == 2
+        assert len(data) < 10000
+        res = parallel.loads(data)
+    finally:
+        parallel.release(blocks)
+    np.testing.assert_array_equal(res['big'], obj['big'])
+    np.testing.assert_array_equal(res['small'], obj['small'])
+    pd.testing.assert_frame_equal(res['frame'], obj['frame'])
+
+def test_dumps_without_shared_memory(monkeypatch):
+    monkeypatch.setattr(parallel, 'shared_memory', None)
+    obj = {'big':np.arange(10000, dtype=np.float64)}
+    data, blocks = parallel.dumps(obj)
+    assert blocks == []
+    np.testing.assert_array_equal(parallel.loads(data)['big'], obj['big'])
+
+def test_portable_drops_local_attributes():
+    item = Item(np.arange(5))
+    item._geodata = object()
+    pair = Pair(item, Item(np.arange(3)))
+    copy = parallel.portable(pair)
+    assert not hasattr(copy.source, '_geodata')
+    assert hasattr(item, '_geodata')
+    assert copy.source is not item
+
+@pytest.mark.parametrize("threshold", [0, parallel.SHARED_MEMORY_THRESHOLD])
+def test_apply_method(threshold):
+    items = [Item(np.arange(n, dtype=float)) for n in (10, 20000, 5)]
+    res = parallel.apply('scale', items, args=(2,), n_workers=2, threshold=threshold)
+    assert res == [10, 20000, 5]
+    for item in items:
+        assert item['scaled']
+        np.testing.assert_array_equal(item.frame['x'], item.values * 2)
+
+def test_apply_function():
+    items = [Item(np.arange(n)) for n in range(1, 6)]
+    res = parallel.apply(total, items, kwargs={'offset':1}, n_workers=2)
+    assert res == [total(item, offset=1) for item in items]
+
+def test_apply_edges_keep_nodes():
+    a = Item(np.arange(3))
+    b = Item(np.arange(4))
+    pair = Pair(a, b)
+    parallel.apply('combine', [pair], n_workers=1)
+    assert pair.source is a
+    assert pair.destination is b
+    assert a.values is not None
+    assert len(pair.combined) == 7
+
+def test_apply_raises():
+    with pytest.raises(AttributeError):
+        parallel.apply('missing', [Item(np.arange(3))], n_workers=1)
@@ -1,12 +1,15 @@
 from csv import (writer as csv_writer, QUOTE_MINIMAL)
 from io import StringIO
+import time
 
 import pandas as pd
 import numpy as np
 import shapely.wkb as swkb
+from sqlalchemy import Integer, select
+from sqlalchemy.sql.expression import bindparam
 from plio.io import io_controlnetwork as cnet
 from autocnet.io.db.model import Measures
-from autocnet.spatial.isis import isis2np_types
+from autocnet.spatial.isis import get_cube_info
 
 def db_to_df(engine, sql = """
 SELECT measures."pointid",
@@ -121,6 +124,92 @@ def copy_from_method(table, conn, keys, data_iter, pre_truncate=False, fatal_fai
     cur.copy_expert(sql=sql_query, file=s_buf)
     return cur.rowcount
 
+def _to_table_types(df, table):
+    """
+    Cast the columns of a dataframe to values that COPY and the DBAPI accept
+    for the columns of a table. Integer columns become nullable integers
+    (e.g., 1.0 is written as 1) and geometries become EWKT. Strings in
+    geometry columns are assumed to be (E)WKT already.
+    """
+    df = df.copy()
+    for c in df.columns:
+        column_type = table.c[c].type
+        if isinstance(column_type, Integer) and df[c].dtype.kind in 'biuf':
+            df[c] = df[c].astype('Int64')
+        elif hasattr(column_type, 'srid'):
+            srid = column_type.srid
+            df[c] = [g if isinstance(g, str) else
+                     None if g is None or not hasattr(g, 'wkt') else 'SRID={};{}'.format(srid, g.wkt)
+                     for g in df[c]]
+    return df
+
+def upsert_dataframe(df, table_obj, connection, ids=None):
+    """
+    Write the rows of a dataframe to a table. The rows whose ids are not in
+    the table are inserted with a COPY FROM (see copy_from_method) and the
+    rows whose ids are in the table are updated with a single batched UPDATE
+    statement. The existing ids are found with a single query.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+         The rows to write. Columns that are not columns of the table are
+         ignored.
+
+    table_obj : object
+                The declared table class (from db.model) with an 'id' primary key
+
+    connection : object
+                 An SQLAlchemy connection, e.g., from engine.begin()
+
+    ids : iterable
+          The id of each row. If None (default), all of the rows are
+          inserted. New rows are inserted with their id only if 'id' is a
+          column of df, otherwise the id is assigned by the database.
+
+    Returns
+    -------
+    timings : dict
+              With the number of 'inserted' and 'updated' rows and the
+              seconds spent finding the existing ids ('split'), inserting
+              ('insert') and updating ('update')
+    """
+    table = table_obj.__table__
+    columns = [c for c in df.columns if c in table.c]
+
+    t1 = time.time()
+    exists = np.zeros(len(df), dtype=bool)
+    if ids is not None:
+        ids = pd.Series(ids, index=df.index)
+        valid = ids.notnull().values
+        candidates = [int(i) for i in pd.unique(ids[valid])]
+        if candidates:
+            found = connection.execute(select(table.c.id).where(table.c.id.in_(candidates))).scalars().all()
+            exists = valid & ids.isin(found).values
+    rows = _to_table_types(df[columns], table)
+
+    t2 = time.time()
+    new = rows[~exists]
+    if len(new):
+        new.to_sql(table.name, connection, schema=table.schema, if_exists='append',
+                   index=False, method=copy_from_method)
+
+    t3 = time.time()
+    existing = rows[exists].drop(columns='id', errors='ignore')
+    if len(existing) and len(existing.columns):
+        values = {c:bindparam('b_{}'.format(c)) for c in existing.columns}
+        stmt = table.update().where(table.c.id == bindparam('b_id')).values(values)
+        params = {'b_id':[int(i) for i in ids[exists]]}
+        for c in existing.columns:
+            params['b_{}'.format(c)] = [None if v is None or v is pd.NA or v != v else v
+                                        for v in existing[c].tolist()]
+        records = [dict(zip(params, r)) for r in zip(*params.values())]
+        connection.execute(stmt, records)
+    t4 = time.time()
+
+    return {'inserted':len(new), 'updated':len(existing),
+            'split':t2 - t1, 'insert':t3 - t2, 'update':t4 - t3}
+
 def update_from_jigsaw(cnet, measures, engine, pointid_func=None):
     """
     Updates a database fields: liner, sampler, measureJigsawRejected,
@@ -187,7 +276,6 @@ def update_from_jigsaw(cnet, measures, engine, pointid_func=None):
 from scipy.stats import zscore
 from plio.io.io_gdal import GeoDataset
 from autocnet.io.db.model import Images
-import pvl
 def null_measure_ignore(point, size_x, size_y, valid_tol, verbose=False, ncg=None, **kwargs):
 
     if not ncg.Session:
@@ -215,7 +303,7 @@ def null_measure_ignore(point, size_x, size_y, valid_tol, verbose=False, ncg=Non
             stop_y = int(center_y + size_y)
 
             pixels = list(map(int, [start_x, start_y, stop_x-start_x, stop_y-start_y]))
-            dtype = isis2np_types[pvl.load(cube.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
+            dtype = get_cube_info(cube.file_name).dtype
             arr = cube.read_array(pixels=pixels, dtype=dtype)
 
             z = zscore(arr, axis=0)
@@ -1,9 +1,10 @@
 import sys
 
+import numpy as np
 import pandas as pd
 import pytest
 from autocnet.io.db import model
-from autocnet.io.db.controlnetwork import db_to_df, update_from_jigsaw
+from autocnet.io.db.controlnetwork import db_to_df, update_from_jigsaw, upsert_dataframe
 
 if sys.platform.startswith("darwin"):
     pytest.skip("skipping DB tests for MacOS", allow_module_level=True)
@@ -41,4 +42,42 @@ def test_update_from_jigsaw(session, db_controlnetwork,):
     assert (updated_measures['sampler'] == pd.Series([0.1, 0.2, -0.5, 8, 2.2, 0.25])).all()
     assert (updated_measures['liner'] == pd.Series([0.1, 0.2, -0.5, -11, 1.1, -34])).all()
     assert (updated_measures['samplesigma'] == pd.Series([0.0, 1.1, -0.2, 1.0, 1.0, 0.5])).all()
-    assert (updated_measures['linesigma'] == pd.Series([0.0, 1.0, 0.0, 0.0, 0.0, 0.5])).all()
\ No newline at end of file
+    assert (updated_measures['linesigma'] == pd.Series([0.0, 1.0, 0.0, 0.0, 0.0, 0.5])).all()
+
+
+def test_upsert_dataframe(session):
+    engine = session.get_bind()
+    matches = pd.DataFrame({'source':[0, 0, 0],
+                            'source_idx':np.float32([1, 2, 3]),
+                            'destination':[1, 1, 1],
+                            'destination_idx':np.float32([4, 5, 6]),
+                            'source_x':[0.5, np.nan, 1.5],
+                            'not_a_column':1})
+    with engine.begin() as connection:
+        timings = upsert_dataframe(matches, model.Matches, connection)
+    assert timings['inserted'] == 3
+    assert timings['updated'] == 0
+
+    inserted = pd.read_sql_table('matches', con=engine).sort_values('id')
+    assert inserted['source_idx'].tolist() == [1, 2, 3]
+    assert inserted['source_x'].isnull().tolist() == [False, True, False]
+
+    # Update two existing rows (by index) and add one
+    ids = inserted['id'].tolist()
+    updates = pd.DataFrame({'source':[0, 0, 0],
+                            'source_idx':[10, 20, 30],
+                            'destination':[1, 1, 1],
+                            'destination_idx':[4, 5, 6],
+                            'source_x':[2.5, 3.5, 4.5]},
+                           index=pd.Index([ids[0], ids[1], max(ids) + 100], name='id'))
+    with engine.begin() as connection:
+        timings = upsert_dataframe(updates, model.Matches, connection, ids=updates.index)
+    assert timings['inserted'] == 1
+    assert timings['updated'] == 2
+
+    res = pd.read_sql_table('matches', con=engine).set_index('id')
+    session.close()
+    assert len(res) == 4
+    assert res.loc[ids[0], 'source_idx'] == 10
+    assert res.loc[ids[1], 'source_x'] == 3.5
+    assert res.loc[ids[2], 'source_idx'] == 3
@@ -1,3 +1,5 @@
+from collections import namedtuple
+from functools import lru_cache
 import math
 import warnings
 from bisect import bisect_left
@@ -11,6 +13,52 @@ from scipy.ndimage.interpolation import zoom
 
 import autocnet.utils.utils as util
 
+# The maximum number of ring and radial line offset lists and of full size
+# polar coordinate grids kept in the kernel bank.
+KERNEL_CACHE_SIZE = 1024
+POLAR_CACHE_SIZE = 32
+
+KernelCacheInfo = namedtuple('KernelCacheInfo', ['hits', 'misses', 'maxsize', 'currsize', 'hit_rate'])
+
+
+def _normed_ccorr(num, t):
+    """
+    Finish a normalized cross correlation from the cross products (num) and the
+    product of the norms (t) of the two samples exactly as cv2.matchTemplate
+    does for TM_CCORR_NORMED with same sized inputs, i.e., clamp values that
+    overshoot [-1, 1] through round off and return 0 for degenerate (zero or
+    non-finite) samples. The result is rounded to float32 like the cv2 result.
+    """
+    num = np.asarray(num, dtype=np.float32).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        abs_num = np.abs(num)
+        score = np.where(abs_num < t, num / t,
+                         np.where(abs_num < t * 1.125, np.sign(num), 0))
+    return score.astype(np.float32).astype(np.float64)
+
+
+def _ring_sums(image, radii):
+    """
+    Sum an image on the circular sampling rings (see circ_mask) of each
+    radius around every pixel. Pixels outside of the image contribute 0.
+
+    Returns
+    -------
+     : ndarray
+       (rows, cols, len(radii)) ring sums
+    """
+    image = np.asarray(image, dtype=np.float64)
+    nrows, ncols = image.shape
+    rmax = int(max(radii))
+    padded = np.pad(image, rmax, mode='constant')
+    sums = np.zeros((nrows, ncols, len(radii)))
+    for k, r in enumerate(radii):
+        r = int(r)
+        dys, dxs = _circle_offsets(r)
+        for dy, dx in zip(dys, dxs):
+            sums[:, :, k] += padded[rmax+dy:rmax+dy+nrows, rmax+dx:rmax+dx+ncols]
+    return sums
+
 
 def cifi(template, search_image, thresh=90, use_percentile=True,
          radii=list(range(1,12)), scales=[0.5, 0.57, 0.66,  0.76, 0.87, 1.0], verbose=False):
@@ -94,72 +142,58 @@ def cifi(template, search_image, thresh=90, use_percentile=True,
 
     for i, s in enumerate(scales):
 
-        scaled_img = rescale(template, s, preserve_range=True, multichannel=False)
+        scaled_img = rescale(template, s, preserve_range=True)
+        a, b = (int(scaled_img.shape[0] / 2),
+                int(scaled_img.shape[1] / 2))
         for j, r in enumerate(radii):
-            # Handle case where image shape is too small
-            try:
-                a, b = (int(scaled_img.shape[0] / 2),
-                        int(scaled_img.shape[1] / 2))
-            except:
-                template_result[i, j] = -math.inf
-                continue
-
             # if radius is bigger than extents, force sum to -1
             if r > b or r > a:
                 template_result[i, j] = -math.inf
                 continue
 
-            # generate a circular mask
-            mask = circ_mask(scaled_img.shape, (a, b), r)
+            # sample the ring around the center of the scaled template
+            dys, dxs = _circle_offsets(r)
+            ys, xs = a + dys, b + dxs
+            inside = (ys < scaled_img.shape[0]) & (xs < scaled_img.shape[1])
 
             inv_area = 1 / (2 * math.pi * r)
-            s = np.sum(scaled_img[mask]) * inv_area
+            s = np.sum(scaled_img[ys[inside], xs[inside]]) * inv_area
             if s == 0:
                 s = -1
             template_result[i, j] = s
 
-    # Cifi2 -- Circular Sample on Target Image
-    search_result = np.empty((search_image.shape[0], search_image.shape[1], len(radii)))
+    # Cifi2 -- Circular Sample on Target Image, all pixels and radii at once
+    inv_areas = 1 / (2 * math.pi * radii)
+    search_result = _ring_sums(search_image, radii) * inv_areas
 
-    for i, y in enumerate(range(search_image.shape[0])):
-        for j, x in enumerate(range(search_image.shape[1])):
-            for k, r in enumerate(radii):
-                inv_area = 1 / (2 * math.pi * r)
-
-                mask = circ_mask(search_image.shape, (i,j), r)
-                s = np.sum(search_image[mask]) * inv_area
-
-                if s == 0 or y < r or x < r or y+r > search_image.shape[0] or x+r > search_image.shape[1]:
-                    s = -1
-                search_result[i, j, k] = s
+    y, x = np.ogrid[:search_image.shape[0], :search_image.shape[1]]
+    y = y[:, :, np.newaxis]
+    x = x[:, :, np.newaxis]
+    invalid = (search_result == 0) | (y < radii) | (x < radii) |\
+              (y + radii > search_image.shape[0]) | (x + radii > search_image.shape[1])
+    search_result[invalid] = -1
 
     # Perform Normalized Cross-Correlation between template and target image
-    coeffs = np.empty((search_result.shape[0], search_result.shape[1]))
-    best_scales = np.empty((search_result.shape[0], search_result.shape[1]))
-
-    for y in range(search_result.shape[0]):
-        for x in range(search_result.shape[1]):
-            scale = 0
-            max_coeff = -math.inf
-            for i in range(template_result.shape[0]):
-
-                result = cv2.matchTemplate(template_result[i].astype(np.float32),
-                                           search_result[y, x].astype(np.float32), method=cv2.TM_CCORR_NORMED)
-                score = np.average(result)
-
-                if score > max_coeff:
-                    max_coeff = score
-                    scale = i
-
-            coeffs[y, x] = max_coeff
-            best_scales[y, x] = scales[scale]
+    # for every pixel and scale at once
+    template_samples = template_result.astype(np.float32).astype(np.float64)
+    search_samples = search_result.astype(np.float32).astype(np.float64)
+    with np.errstate(invalid='ignore', over='ignore'):
+        num = search_samples @ template_samples.T
+        template_norm = np.sqrt(np.sum(template_samples**2, axis=1))
+    search_norm = np.sqrt(np.sum(search_samples**2, axis=2))
+    scores = _normed_ccorr(num, search_norm[:, :, np.newaxis] * template_norm)
+
+    # The first scale with the highest correlation is the best fit
+    best_scale_idx = np.argmax(scores, axis=2)
+    coeffs = np.take_along_axis(scores, best_scale_idx[:, :, np.newaxis], axis=2)[:, :, 0]
+    best_scales = scales[best_scale_idx].astype(np.float64)
 
     # get first grade candidate points
 
     if use_percentile:
         thresh = np.percentile(coeffs, thresh)
 
-    fg_candidate_pixels = np.array([(y, x) for (y, x), coeff in np.ndenumerate(coeffs) if coeff >= thresh])
+    fg_candidate_pixels = np.argwhere(coeffs >= thresh)
 
     if fg_candidate_pixels.size == 0:
         warnings.warn('Cifi returned empty set.')
@@ -305,55 +339,57 @@ def rafi(template, search_image, candidate_pixels, best_scales, thresh=95,
     # Rafi 2 -- Get Radial Samples of the Search Image for all First Grade Candidate Points
     rafi_alpha_means = np.zeros((len(candidate_pixels), len(alpha_list)))
 
+    # The scaled windows are grouped by shape so that the radial line masks
+    # are built once per shape and applied to all windows as a single product
+    windows = {}
     for i in range(len(candidate_pixels)):
         y, x = candidate_pixels[i]
 
         rad = radius if min(y, x) > radius else min(y, x)
         cropped_search = search_image[y-rad:y+rad+1, x-rad:x+rad+1]
-        scaled_img = rescale(cropped_search, best_scales[y, x], preserve_range=True, multichannel=False)
+        scaled_img = rescale(cropped_search, best_scales[y, x], preserve_range=True)
 
-        # Will except if image size too small after scaling
-        try:
-            scaled_center_y, scaled_center_x = (math.floor(scaled_img.shape[0]/2),
-                                                math.floor(scaled_img.shape[1]/2))
-        except:
+        if not scaled_img.size:
             warnings.warn('{}\' window is to small to use for scale {} at resulting size'
                           .format((y, x), best_scales[y, x], scaled_img.shape))
             rafi_alpha_means[i] = np.negative(np.ones(len(alpha_list)))
             continue
 
-        for j in range(len(alpha_list)):
-            # Create Radial Mask
-            mask = radial_line_mask(scaled_img.shape, (scaled_center_y, scaled_center_x),
-                                         scaled_center_y, alpha=alpha_list[j])
-            rafi_alpha_means[i, j] = np.sum(scaled_img[mask])/radius
-
-    best_rotation = np.zeros(len(candidate_pixels))
-    rafi_coeffs = np.zeros(len(candidate_pixels))
+        windows.setdefault(scaled_img.shape, ([], []))
+        windows[scaled_img.shape][0].append(i)
+        windows[scaled_img.shape][1].append(scaled_img.ravel())
+
+    for shape, (idx, scaled_imgs) in windows.items():
+        # Create Radial Masks
+        scaled_center_y, scaled_center_x = (math.floor(shape[0]/2),
+                                            math.floor(shape[1]/2))
+        masks = np.zeros((len(alpha_list), shape[0] * shape[1]))
+        for j, a in enumerate(alpha_list):
+            ys, xs = _clip_offsets(shape, (scaled_center_y, scaled_center_x),
+                                   _radial_line_offsets(scaled_center_y, a, .01))
+            masks[j, ys * shape[1] + xs] = 1
+        rafi_alpha_means[idx] = (np.asarray(scaled_imgs) @ masks.T)/radius
 
     if verbose: # pragma: no cover
         image_pixels = np.zeros((search_image.shape[0], search_image.shape[1]))
 
     # Perform Normalized Cross-Correlation between template and target image
-    for i in range(len(candidate_pixels)):
-        maxcoeff = -math.inf
-        maxrotate = 0
-        y, x = candidate_pixels[i]
-        for j in range(len(alpha_list)):
-            # perform circular shifting of template sums
-            shifted_template_angle_sums = np.roll(template_alpha_samples, j)
-            result = cv2.matchTemplate(shifted_template_angle_sums.astype(np.float32),
-                                       rafi_alpha_means[i].astype(np.float32), method=cv2.TM_CCORR_NORMED)
-            score = np.average(result)
-
-            if score > maxcoeff:
-                maxcoeff = score
-                maxrotate = j
-
-        rafi_coeffs[i] = maxcoeff
-        best_rotation[i] = alpha_list[maxrotate]
-        if verbose: # pragma: no cover
-            image_pixels[y, x] = maxcoeff
+    # for all candidates and circular shifts of the template sums at once
+    shifted_template_angle_sums = np.array([np.roll(template_alpha_samples, j)
+                                            for j in range(len(alpha_list))])
+    shifted_template_angle_sums = shifted_template_angle_sums.astype(np.float32).astype(np.float64)
+    search_angle_means = rafi_alpha_means.astype(np.float32).astype(np.float64)
+    num = search_angle_means @ shifted_template_angle_sums.T
+    t = np.sqrt(np.sum(search_angle_means**2, axis=1))[:, np.newaxis] *\
+        np.sqrt(np.sum(shifted_template_angle_sums**2, axis=1))
+    scores = _normed_ccorr(num, t)
+
+    maxrotate = np.argmax(scores, axis=1)
+    rafi_coeffs = scores[np.arange(len(candidate_pixels)), maxrotate]
+    best_rotation = alpha_list[maxrotate]
+
+    if verbose: # pragma: no cover
+        image_pixels[candidate_pixels[:, 0], candidate_pixels[:, 1]] = rafi_coeffs
 
     # Get second grade candidate points and best rotation
 
@@ -484,11 +520,17 @@ def tefi(template, search_image, candidate_pixels, best_scales, best_angles,
     if upsampling > 1:
         u_template = zoom(template, upsampling, order=3)
         u_search_image = zoom(search_image, upsampling, order=3)
+    else:
+        u_template = template
+        u_search_image = search_image
 
     alpha_list = np.arange(0, 2*math.pi, alpha)
-    candidate_pixels *= int(upsampling)
+    candidate_pixels = candidate_pixels * int(upsampling)
 
     # Tefi -- Template Matching Filter
+    # Gather the candidates that are matched with each (scale, rotation) pair
+    # so that every transformed template is computed once.
+    pairs = {}
     for i in range(len(candidate_pixels)):
         y, x = candidate_pixels[i]
 
@@ -502,32 +544,43 @@ def tefi(template, search_image, candidate_pixels, best_scales, best_angles,
         tefi_scales = np.array(scales).take(range(best_scale_idx-1, best_scale_idx+2), mode='wrap')
         tefi_alphas = alpha_list.take(range(best_alpha_idx-1, best_alpha_idx+2), mode='wrap')
 
-        scalesxalphas = util.cartesian([tefi_scales, tefi_alphas])
-
-        max_coeff = -math.inf
-        for j in range(scalesxalphas.shape[0]):
-            transformed_template = rescale(u_template, scalesxalphas[j][0],preserve_range=True, multichannel=False)
-            transformed_template = rotate(transformed_template, scalesxalphas[j][1])
+        tefi_coeffs[i] = -math.inf
+        for scale, angle in util.cartesian([tefi_scales, tefi_alphas]):
+            pairs.setdefault((scale, angle), []).append(i)
+
+    for (scale, angle), idx in pairs.items():
+        transformed_template = rescale(u_template, scale, preserve_range=True)
+        transformed_template = rotate(transformed_template, angle)
+        transformed_template = transformed_template.astype(np.float32).astype(np.float64)
+
+        y_window, x_window = (math.floor(transformed_template.shape[0]/2),
+                              math.floor(transformed_template.shape[1]/2))
+
+        idx = np.asarray(idx)
+        ys = candidate_pixels[idx, 0]
+        xs = candidate_pixels[idx, 1]
+        # The (2*window+1) sized crop has to fit in the search image and match
+        # the template shape, i.e., even sized templates never match
+        valid = (ys >= y_window) & (xs >= x_window) &\
+                (ys + y_window + 1 <= u_search_image.shape[0]) &\
+                (xs + x_window + 1 <= u_search_image.shape[1]) &\
+                (2 * y_window + 1 == transformed_template.shape[0]) &\
+                (2 * x_window + 1 == transformed_template.shape[1])
+
+        scores = np.full(len(idx), -1.)
+        if valid.any():
+            windows = util.sliding_window_view(u_search_image, transformed_template.shape)
+            cropped_searches = windows[ys[valid] - y_window, xs[valid] - x_window]
+            cropped_searches = cropped_searches.astype(np.float32).astype(np.float64)
+            num = np.einsum('nij,ij->n', cropped_searches, transformed_template)
+            t = np.sqrt(np.einsum('nij,nij->n', cropped_searches, cropped_searches)) *\
+                np.sqrt(np.sum(transformed_template**2))
+            scores[valid] = _normed_ccorr(num, t)
+
+        tefi_coeffs[idx] = np.maximum(tefi_coeffs[idx], scores)
 
-            y_window, x_window = (math.floor(transformed_template.shape[0]/2),
-                                  math.floor(transformed_template.shape[1]/2))
-
-            cropped_search = u_search_image[y-y_window:y+y_window+1, x-x_window:x+x_window+1]
-
-            if(y < y_window or x < x_window or cropped_search.shape < transformed_template.shape or
-               cropped_search.shape != transformed_template.shape):
-                score = -1
-            else:
-                result = cv2.matchTemplate(transformed_template.astype(np.float32), cropped_search.astype(np.float32), method=cv2.TM_CCORR_NORMED)
-                score = np.average(result)
-
-            if score > max_coeff:
-                max_coeff = score
-
-        tefi_coeffs[i] = max_coeff
-
-        if verbose: # pragma: no cover
-            image_pixels[y//upsampling, x//upsampling] = max_coeff
+    if verbose: # pragma: no cover
+        image_pixels[candidate_pixels[:, 0]//upsampling, candidate_pixels[:, 1]//upsampling] = tefi_coeffs
 
     if use_percentile:
         thresh = np.percentile(tefi_coeffs, int(thresh))
@@ -627,10 +680,109 @@ def ciratefi(template, search_image, upsampling=1, cifi_thresh=95, rafi_thresh=9
     return results
 
 
+def _readonly(*arrays):
+    """
+    Mark arrays that are shared through the kernel bank as read only.
+    """
+    for arr in arrays:
+        arr.setflags(write=False)
+    return arrays
+
+
+@lru_cache(maxsize=POLAR_CACHE_SIZE)
+def _polar_grid(shape, center):
+    y, x = np.ogrid[:shape[0], :shape[1]]
+    cy, cx = center
+    tmin, tmax = (0, 2*math.pi)
+
+    # ensure stop angle > start angle
+    if tmax < tmin:
+        tmax += 2*np.pi
+
+    # convert cartesian --> polar coordinates
+    r2 = (x-cx)*(x-cx) + (y-cy)*(y-cy)
+    theta = np.arctan2(x-cx, y-cy) - tmin
+
+    # wrap angles between 0 and 2*pi
+    theta %= (2*np.pi)
+
+    return _readonly(r2, theta)
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _circle_offsets(radius):
+    """
+    The (dy, dx) offsets, in row major order, of the pixels on the circular
+    sampling ring of the given radius around a center pixel.
+    """
+    extent = int(math.floor(abs(radius)))
+    dy, dx = np.mgrid[-extent:extent+1, -extent:extent+1]
+    on_ring = dy*dy + dx*dx == radius*radius
+    return _readonly(dy[on_ring], dx[on_ring])
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _radial_line_offsets(radius, alpha, atol):
+    """
+    The (dy, dx) offsets, in row major order, of the pixels on the radial line
+    with the given radius and angle around a center pixel.
+    """
+    extent = int(math.floor(abs(radius)))
+    dy, dx = np.mgrid[-extent:extent+1, -extent:extent+1]
+    theta = np.arctan2(dx, dy) % (2*np.pi)
+    on_line = (dy*dy + dx*dx <= radius**2) & np.isclose(theta, [alpha], atol=atol)
+    return _readonly(dy[on_line], dx[on_line])
+
+
+def _clip_offsets(shape, center, offsets):
+    """
+    The (y, x) indices of the offsets around center that fall inside shape.
+    """
+    ys = offsets[0] + center[0]
+    xs = offsets[1] + center[1]
+    inside = (ys >= 0) & (ys < shape[0]) & (xs >= 0) & (xs < shape[1])
+    return ys[inside], xs[inside]
+
+
+def _offsets_mask(shape, center, offsets):
+    mask = np.zeros(shape, dtype=bool)
+    mask[_clip_offsets(shape, center, offsets)] = True
+    return mask
+
+
+def _is_pixel(center):
+    return all(float(c).is_integer() for c in center)
+
+
+def kernel_cache_info():
+    """
+    Returns the (hits, misses, maxsize, currsize, hit_rate) statistics of the
+    circular ring ('circle'), radial line ('radial_line') and polar coordinate
+    grid ('polar') caches of the kernel bank used by the Ciratefi stages.
+    """
+    info = {}
+    for name, func in (('circle', _circle_offsets),
+                       ('radial_line', _radial_line_offsets),
+                       ('polar', _polar_grid)):
+        stats = func.cache_info()
+        ncalls = stats.hits + stats.misses
+        info[name] = KernelCacheInfo(*stats, stats.hits / ncalls if ncalls else 0.0)
+    return info
+
+
+def clear_kernel_cache():
+    """
+    Empty the kernel bank and reset its statistics.
+    """
+    for func in (_circle_offsets, _radial_line_offsets, _polar_grid):
+        func.cache_clear()
+
+
 def to_polar_coord(shape, center):
     """
     Generate a polar coordinate grid from a shape given
-    a center.
+    a center. The grids are memoized per (shape, center) and
+    returned read only.
 
     parameters
     ----------
@@ -650,28 +802,13 @@ def to_polar_coord(shape, center):
     theta : ndarray
             grid of angles from the center
     """
-
-    y, x = np.ogrid[:shape[0], :shape[1]]
-    cy, cx = center
-    tmin, tmax = (0, 2*math.pi)
-
-    # ensure stop angle > start angle
-    if tmax < tmin:
-        tmax += 2*np.pi
-
-    # convert cartesian --> polar coordinates
-    r2 = (x-cx)*(x-cx) + (y-cy)*(y-cy)
-    theta = np.arctan2(x-cx, y-cy) - tmin
-
-    # wrap angles between 0 and 2*pi
-    theta %= (2*np.pi)
-
-    return r2, theta
+    return _polar_grid(tuple(shape), tuple(center))
 
 
 def circ_mask(shape, center, radius):
     """
-    Generates a circular mask
+    Generates a circular mask. The ring is taken from the
+    memoized offsets for radius and placed at center.
 
     parameters
     ----------
@@ -692,6 +829,8 @@ def circ_mask(shape, center, radius):
     mask : ndarray
            circular mask of bools
     """
+    if _is_pixel(center):
+        return _offsets_mask(shape, tuple(map(int, center)), _circle_offsets(radius))
 
     r, theta = to_polar_coord(shape, center)
 
@@ -703,7 +842,9 @@ def circ_mask(shape, center, radius):
 
 def radial_line_mask(shape, center, radius, alpha=0.19460421, atol=.01):
     """
-    Generates a linear mask from center at angle alpha.
+    Generates a linear mask from center at angle alpha. The
+    line is taken from the memoized offsets for (radius, alpha, atol)
+    and placed at center.
 
     parameters
     ----------
@@ -731,6 +872,9 @@ def radial_line_mask(shape, center, radius, alpha=0.19460421, atol=.01):
     mask : ndarray
            linear mask of bools
     """
+    if _is_pixel(center):
+        return _offsets_mask(shape, tuple(map(int, center)),
+                             _radial_line_offsets(radius, float(alpha), atol))
 
     r, theta = to_polar_coord(shape, center)
 
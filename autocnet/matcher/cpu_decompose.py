@@ -3,6 +3,7 @@ from scipy.spatial.distance import cdist
 
 from autocnet.matcher.cpu_matcher import FlannMatcher
 from autocnet.matcher.cpu_matcher import match
+from autocnet.matcher.cpu_outlier_detector import lowe_ratio_mask
 from autocnet.transformation.decompose import coupled_decomposition
 
 
@@ -50,15 +51,6 @@ def decompose_and_match(self, k=2, maxiteration=3, size=18, buf_dist=3, **kwargs
                partioning point.  The smaller the distance, the more likely
                percision errors can results in erroneous partitions.
     """
-    def func(group):
-        ratio = 0.8
-        res = [False] * len(group)
-        if len(res) == 1:
-            return [False]
-        if group.iloc[0] < group.iloc[1] * ratio:
-            res[0] = True
-        return res
-
     # Grab the original image arrays
     sdata = self.source.get_array()
     ddata = self.destination.get_array()
@@ -121,7 +113,8 @@ def decompose_and_match(self, k=2, maxiteration=3, size=18, buf_dist=3, **kwargs
                 matches = fl.query(candidates, self.source['node_id'], k=3, index=candidate_idx)
 
                 # Apply Lowe's ratio test to try to find a 'good' starting point
-                mask = matches.groupby('source_idx')['distance'].transform(func).astype('bool')
+                mask = lowe_ratio_mask(matches['source_idx'].values, matches['distance'].values,
+                                       ratio=0.8, single=False)
                 candidate_matches = matches[mask]
                 match_idx = candidate_matches['source_idx'].astype(np.int)
 
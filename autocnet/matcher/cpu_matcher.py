@@ -1,3 +1,7 @@
+from collections import namedtuple, OrderedDict
+import hashlib
+import os
+import threading
 import warnings
 
 import numpy as np
@@ -7,8 +11,17 @@ import cv2
 
 FLANN_INDEX_KDTREE = 1  # Algorithm to set centers,
 DEFAULT_FLANN_PARAMETERS = dict(algorithm=FLANN_INDEX_KDTREE, trees=3)
+MATCH_COLUMNS = ['source_image', 'source_idx', 'destination_image', 'destination_idx', 'distance']
 
-def match(edge, k=2, **kwargs):
+# The memory budget of the default per node FLANN index cache in bytes
+FLANN_INDEX_CACHE_BYTES = 2**30
+
+FlannIndexCacheInfo = namedtuple('FlannIndexCacheInfo', ['hits', 'misses', 'loads', 'evictions',
+                                                         'currsize', 'nbytes', 'max_bytes'])
+
+_FlannIndexEntry = namedtuple('_FlannIndexEntry', ['index', 'descriptors', 'search_idx', 'nbytes'])
+
+def match(edge, k=2, index_cache=True, **kwargs):
     """
     Given two sets of descriptors, utilize a FLANN (Approximate Nearest
     Neighbor KDTree) matcher to find the k nearest matches.  Nearness is
@@ -20,25 +33,14 @@ def match(edge, k=2, **kwargs):
     ----------
     k : int
 	The number of neighbors to find
-    """
 
-    def _add_matches(matches):
-        """
-        Given a dataframe of matches, either append to an existing
-        matches edge attribute or initially populate said attribute.
-
-        Parameters
-        ----------
-        matches : dataframe
-                  A dataframe of matches
-        """
-        if edge.matches.empty:
-            edge.matches = matches
-        else:
-            df = edge.matches
-            edge.matches = df.append(matches,
-                                     ignore_index=True,
-                                     verify_integrity=True)
+    index_cache : bool or FlannIndexCache
+                  If True (default), the trained index of each node is taken
+                  from (and added to) the module level FLANN_INDEX_CACHE so
+                  that it is reused by every edge incident to the node. A
+                  FlannIndexCache instance uses that cache instead. If False,
+                  a new matcher is trained for both directions of this edge.
+    """
 
     def mono_matches(a, b, aidx=None, bidx=None):
         """
@@ -57,7 +59,15 @@ def match(edge, k=2, **kwargs):
 
     	bidx : iterable
     		An index for the descriptors to subset
+
+        Returns
+        -------
+        : dict
+          of match arrays, see FlannMatcher.query_arrays
     	"""
+        if cache is not None:
+            return cache.query_arrays(a, b, k, aidx=aidx, bidx=bidx)
+
     	# Subset if requested
         if aidx is not None:
             ad = a.descriptors[aidx]
@@ -72,20 +82,50 @@ def match(edge, k=2, **kwargs):
         # Load, train, and match
         fl.add(ad, a['node_id'], index=aidx)
         fl.train()
-        matches = fl.query(bd, b['node_id'], k, index=bidx)
-        _add_matches(matches)
+        matches = fl.query_arrays(bd, b['node_id'], k, index=bidx)
         fl.clear()
-
+        return matches
+
+    if index_cache is True:
+        cache = FLANN_INDEX_CACHE
+    elif index_cache is False:
+        cache = None
+    else:
+        cache = index_cache
     fl = FlannMatcher()
 
     # Get the correct descriptors
     aidx = kwargs.pop('aidx', None)
     bidx = kwargs.pop('bidx', None)
 
-    mono_matches(edge.source, edge.destination, aidx=aidx, bidx=bidx)
+    forward = mono_matches(edge.source, edge.destination, aidx=aidx, bidx=bidx)
     # Swap the indices since mono_matches is generic and source/destin are
     # swapped
-    mono_matches(edge.destination, edge.source, aidx=bidx, bidx=aidx)
+    backward = mono_matches(edge.destination, edge.source, aidx=bidx, bidx=aidx)
+
+    _set_matches(edge, (forward, backward))
+
+
+def _set_matches(edge, parts):
+    """
+    Build the matches dataframe of an edge once from the match arrays of
+    both directions, add it to the edge matches and join the keypoint
+    coordinates.
+
+    Parameters
+    ----------
+    edge : Edge
+           The edge to set the matches of
+
+    parts : iterable
+            of dicts of match arrays keyed by MATCH_COLUMNS
+    """
+    matches = pd.DataFrame({c:np.concatenate([p[c] for p in parts]) for c in MATCH_COLUMNS},
+                           columns=MATCH_COLUMNS).astype(np.float32)
+    if edge.matches.empty:
+        edge.matches = matches
+    else:
+        edge.matches = pd.concat((edge.matches, matches), ignore_index=True)
 
     source_keypoints = edge.source.keypoints[['x', 'y']]
     source_keypoints.rename(columns={'x': 'source_x', 'y': 'source_y'}, inplace=True)
@@ -97,6 +137,102 @@ def match(edge, k=2, **kwargs):
     edge.matches.sort_values(by=['distance'])
 
 
+def match_joint(node, edges, k=2, flann_parameters=DEFAULT_FLANN_PARAMETERS):
+    """
+    Match the descriptors of a node against all of its neighbors at once.
+    One index is trained over the descriptors of all the neighbors (in the
+    overlap with the node) and the descriptors of the node are queried once.
+    The k * len(edges) nearest neighbors are searched and the k nearest in
+    each neighbor are kept, so the matches are the edge by edge matches with
+    the node as the query unless the nearest neighbors concentrate in other
+    images.
+
+    Parameters
+    ----------
+    node : Node
+           The query node
+
+    edges : list
+            of the edges between the node and its neighbors
+
+    k : int
+        The number of neighbors to find per neighbor image
+
+    flann_parameters : dict
+                       The FLANN index parameters
+
+    Returns
+    -------
+    matches : list
+              of dicts of match arrays keyed by MATCH_COLUMNS, one per edge
+              in edges
+    """
+    nid = node['node_id']
+    fl = FlannMatcher(flann_parameters)
+    query_overlaps = []
+    for edge in edges:
+        other = edge.destination if edge.source['node_id'] == nid else edge.source
+        idx = np.asarray(edge.get_keypoints(other, overlap=True).index)
+        fl.add(other.descriptors[idx], other['node_id'], index=idx)
+        query_overlaps.append(np.asarray(edge.get_keypoints(node, overlap=True).index))
+    fl.train()
+
+    # Query the union of the overlaps of the node once
+    qindex = np.unique(np.concatenate(query_overlaps))
+    query_idx, train_idx, img_idx, distance = fl.knn_arrays(node.descriptors[qindex], k=k * len(edges))
+    qid = qindex[query_idx]
+    tid = fl._train_observations(train_idx, img_idx)
+
+    # The rank of each match among the matches of its query descriptor in the
+    # same image. The matches of a query descriptor are ordered by distance.
+    order = np.lexsort((np.arange(len(img_idx)), query_idx, img_idx))
+    keys = img_idx[order] * len(qindex) + query_idx[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    rank = np.empty(len(keys), dtype=int)
+    rank[order] = np.arange(len(keys)) - np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+    nearest = rank < k
+
+    matches = []
+    for i, query_overlap in enumerate(query_overlaps):
+        sel = nearest & (img_idx == i) & np.isin(qid, query_overlap)
+        matches.append(_orient_matches(nid, qid[sel], fl.nid_lookup[i], tid[sel], distance[sel]))
+    return matches
+
+
+def _orient_matches(query_image, qid, train_image, tid, distance):
+    """
+    Order the matches so that the smaller image id is always the source.
+
+    Parameters
+    ----------
+    query_image : int
+                  The image id of the query descriptors
+
+    qid : ndarray
+          (n,) the observation index of the query descriptor of each match
+
+    train_image : int or ndarray
+                  The image id(s) of the matched descriptors
+
+    tid : ndarray
+          (n,) the observation index of the matched descriptor of each match
+
+    distance : ndarray
+               (n,) the descriptor distance
+
+    Returns
+    -------
+    matched : dict
+              of (n,) arrays keyed by MATCH_COLUMNS
+    """
+    train_image = np.broadcast_to(train_image, np.shape(qid))
+    swap = query_image > train_image
+    return {'source_image':np.where(swap, train_image, query_image),
+            'source_idx':np.where(swap, tid, qid),
+            'destination_image':np.where(swap, query_image, train_image),
+            'destination_idx':np.where(swap, qid, tid),
+            'distance':distance}
+
 
 class FlannMatcher(object):
     """
@@ -114,12 +250,21 @@ class FlannMatcher(object):
 
     image_index_counter : int
                           The current number of images loaded into the matcher
+
+    search_idx : ndarray
+                 The observation index of each of the most recently added
+                 descriptors
+
+    image_search_idx : list
+                       of the observation index arrays of every added image,
+                       in image counter order
     """
 
     def __init__(self, flann_parameters=DEFAULT_FLANN_PARAMETERS):
         self._flann_matcher = cv2.FlannBasedMatcher(flann_parameters, {})
         self.nid_lookup = {}
-        self.search_idx = {}
+        self.search_idx = np.empty(0, dtype=int)
+        self.image_search_idx = []
         self.node_counter = 0
 
     def add(self, descriptor, nid, index=None):
@@ -139,9 +284,10 @@ class FlannMatcher(object):
         self.nid_lookup[self.node_counter] = nid
         self.node_counter += 1
         if index is not None:
-            self.search_idx = dict((i, j) for i, j in enumerate(index))
+            self.search_idx = np.asarray(index)
         else:
-            self.search_idx = dict((i,i) for i in range(len(descriptor)))
+            self.search_idx = np.arange(len(descriptor))
+        self.image_search_idx.append(self.search_idx)
 
     def clear(self):
         """
@@ -151,7 +297,8 @@ class FlannMatcher(object):
         self._flann_matcher.clear()
         self.nid_lookup = {}
         self.node_counter = 0
-        self.search_idx = {}
+        self.search_idx = np.empty(0, dtype=int)
+        self.image_search_idx = []
 
     def train(self):
         """
@@ -159,6 +306,85 @@ class FlannMatcher(object):
         """
         self._flann_matcher.train()
 
+    def knn_arrays(self, descriptor, k=3):
+        """
+        Search for the k nearest neighbors of each descriptor and return the
+        raw results as arrays.
+
+        Parameters
+        ----------
+        descriptor : ndarray
+                     The query descriptors to search for
+
+        k : int
+            The number of nearest neighbors to search for
+
+        Returns
+        -------
+        query_idx : ndarray
+                    (n,) the row of the query descriptor of each match
+
+        train_idx : ndarray
+                    (n,) the row of the matched descriptor in its image
+
+        img_idx : ndarray
+                  (n,) the image counter of the matched descriptor
+
+        distance : ndarray
+                   (n,) the descriptor distance
+        """
+        matches = self._flann_matcher.knnMatch(descriptor, k=k)
+        nmatches = sum(map(len, matches))
+        dtype = [('query_idx', np.int64), ('train_idx', np.int64),
+                 ('img_idx', np.int64), ('distance', np.float32)]
+        # A single pass over the DMatch objects into a preallocated record array
+        arr = np.fromiter(((m.queryIdx, m.trainIdx, m.imgIdx, m.distance) for row in matches for m in row),
+                          dtype=dtype, count=nmatches)
+        return arr['query_idx'], arr['train_idx'], arr['img_idx'], arr['distance']
+
+    def _train_observations(self, train_idx, img_idx):
+        """
+        Map the (image counter, row) pairs of matched descriptors to the
+        observation indices of the added images.
+        """
+        if len(self.image_search_idx) < 2:
+            return self.search_idx[train_idx]
+        offsets = np.cumsum([0] + [len(i) for i in self.image_search_idx[:-1]])
+        return np.concatenate(self.image_search_idx)[offsets[img_idx] + train_idx]
+
+    def query_arrays(self, descriptor, query_image, k=3, index=None):
+        """
+        Array version of query. The query and train indices are remapped and
+        the matches are ordered so that the smaller image id is the source
+        with array operations.
+
+        Parameters
+        ----------
+        See query
+
+        Returns
+        -------
+        matched : dict
+                  of (n,) arrays keyed by the column names of the matches
+                  dataframe (MATCH_COLUMNS)
+        """
+        query_idx, train_idx, img_idx, distance = self.knn_arrays(descriptor, k=k)
+
+        if index is not None:
+            qid = np.asarray(index)[query_idx]
+        else:
+            qid = query_idx
+        tid = self._train_observations(train_idx, img_idx)
+        nids = np.array([self.nid_lookup[i] for i in range(self.node_counter)])
+        destination = nids[img_idx]
+
+        self_neighbors = destination == query_image
+        if self_neighbors.any():
+            warnings.warn('Likely self neighbor in query!')
+            keep = ~self_neighbors
+            qid, tid, destination, distance = qid[keep], tid[keep], destination[keep], distance[keep]
+        return _orient_matches(query_image, qid, destination, tid, distance)
+
     def query(self, descriptor, query_image, k=3, index=None):
         """
 
@@ -183,32 +409,226 @@ class FlannMatcher(object):
                   containing matched points with columns containing:
                   matched image name, query index, train index, and
                   descriptor distance
+
+        See Also
+        --------
+        query_arrays : the same matches as arrays
         """
+        matched = self.query_arrays(descriptor, query_image, k=k, index=index)
+        return pd.DataFrame(matched, columns=MATCH_COLUMNS).astype(np.float32)
 
-        matches = self._flann_matcher.knnMatch(descriptor, k=k)
-        matched = []
-        for i, m in enumerate(matches):
-            for j in m:
-                if index is not None:
-                    qid = index[i]
-                else:
-                    qid = j.queryIdx
-                source = query_image
-                destination = self.nid_lookup[j.imgIdx]
-                if source < destination:
-                    matched.append((query_image,
-                                    qid,
-                                    destination,
-                                    self.search_idx[j.trainIdx],
-                                    j.distance))
-                elif source > destination:
-                    matched.append((destination,
-                                    self.search_idx[j.trainIdx],
-                                    query_image,
-                                    qid,
-                                    j.distance))
-                else:
-                    warnings.warn('Likely self neighbor in query!')
-        return pd.DataFrame(matched, columns=['source_image', 'source_idx',
-                                              'destination_image', 'destination_idx',
-                                              'distance']).astype(np.float32)
+
+class FlannIndexCache(object):
+    """
+    A least recently used cache of trained, single node FLANN indices. The
+    index of a node is trained once and then searched by every edge incident
+    to that node instead of being rebuilt for every edge and direction.
+
+    Entries are keyed on the node id and a digest of the indexed descriptors
+    (and observation indices), so re-extracted features or a different subset
+    of the descriptors (e.g., the keypoints in an edge overlap) get their own
+    index. When the estimated size of all cached indices exceeds max_bytes,
+    the least recently used indices are dropped.
+
+    Attributes
+    ----------
+    max_bytes : int
+                The memory budget of the cache in bytes. The size of an index
+                is estimated from the size of its descriptors and trees.
+
+    persist : bool
+              If True, indices are written next to the keypoint file of the
+              node (Node.keypoint_file) when trained and read from there
+              instead of being trained again, e.g., by a later process.
+              Nodes without a keypoint file are only cached in memory.
+
+    flann_parameters : dict
+                       The FLANN index parameters
+    """
+
+    def __init__(self, max_bytes=FLANN_INDEX_CACHE_BYTES, persist=False,
+                 flann_parameters=DEFAULT_FLANN_PARAMETERS):
+        self.max_bytes = max_bytes
+        self.persist = persist
+        self.flann_parameters = dict(flann_parameters)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def info(self):
+        """
+        Returns
+        -------
+        : FlannIndexCacheInfo
+          The hits, misses, indices read from disk, evictions, number and
+          estimated size of the cached indices, and the memory budget
+        """
+        return FlannIndexCacheInfo(self.hits, self.misses, self.loads, self.evictions,
+                                   len(self._entries), self._nbytes, self.max_bytes)
+
+    def clear(self):
+        """
+        Drop all cached indices and reset the counters. Persisted indices
+        are not removed.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = self.misses = self.loads = self.evictions = 0
+
+    def _digest(self, descriptors, index):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((descriptors.shape, descriptors.dtype.str, sorted(self.flann_parameters.items()))).encode())
+        h.update(descriptors.data)
+        if index is not None:
+            h.update(np.ascontiguousarray(index).data)
+        return h.hexdigest()
+
+    @staticmethod
+    def index_path(node, digest):
+        """
+        The path of the persisted index of a node, alongside its keypoint
+        file, or None if the node does not have a keypoint file.
+        """
+        keypoint_file = getattr(node, 'keypoint_file', None)
+        if not keypoint_file:
+            return
+        return '{}_{}.flann'.format(os.path.splitext(keypoint_file)[0], digest)
+
+    def get(self, node, index=None):
+        """
+        Get the trained index of the node's descriptors, training (or reading)
+        and caching it if it is not cached.
+
+        Parameters
+        ----------
+        node : Node
+               The node whose descriptors are indexed
+
+        index : iterable
+                An optional subset of the descriptors (observation indices)
+                to index
+
+        Returns
+        -------
+        entry : _FlannIndexEntry
+                with the cv2.flann_Index, the indexed descriptors, and the
+                observation index of each indexed descriptor
+        """
+        descriptors = node.descriptors
+        if index is not None:
+            index = np.asarray(index)
+            descriptors = descriptors[index]
+        descriptors = np.ascontiguousarray(descriptors)
+        key = (node['node_id'], self._digest(descriptors, index))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._build(node, key[1], descriptors, index)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._nbytes += entry.nbytes
+            # Always keep the newest index, even if it alone exceeds the budget
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    def _build(self, node, digest, descriptors, index):
+        path = self.index_path(node, digest) if self.persist else None
+        flann_index = None
+        if path and os.path.exists(path):
+            flann_index = cv2.flann_Index()
+            if flann_index.load(descriptors, path):
+                with self._lock:
+                    self.loads += 1
+            else:
+                warnings.warn('Unable to read the FLANN index {}, retraining.'.format(path))
+                flann_index = None
+
+        if flann_index is None:
+            flann_index = cv2.flann_Index(descriptors, self.flann_parameters)
+            if path:
+                try:
+                    flann_index.save(path)
+                except cv2.error as e:
+                    warnings.warn('Unable to write the FLANN index {}.\n{}'.format(path, e))
+
+        if index is None:
+            search_idx = np.arange(len(descriptors))
+        else:
+            search_idx = index
+        # The index holds the descriptors and, per tree, a node and a point index per descriptor
+        nbytes = descriptors.nbytes + len(descriptors) * self.flann_parameters.get('trees', 1) * 40
+        return _FlannIndexEntry(flann_index, descriptors, search_idx, nbytes)
+
+    def query_arrays(self, a, b, k=2, aidx=None, bidx=None):
+        """
+        Match the descriptors of node b against the cached index of node a.
+
+        Parameters
+        ----------
+        a : Node
+            The node whose (cached) index is searched
+
+        b : Node
+            The node whose descriptors are the queries
+
+        k : int
+            The number of nearest neighbors to search for
+
+        aidx : iterable
+               An index for the descriptors of a to subset
+
+        bidx : iterable
+               An index for the descriptors of b to subset
+
+        Returns
+        -------
+        matched : dict
+                  of (n,) arrays keyed by MATCH_COLUMNS, see
+                  FlannMatcher.query_arrays
+        """
+        entry = self.get(a, index=aidx)
+        query = b.descriptors
+        if bidx is not None:
+            query = query[np.asarray(bidx)]
+
+        k = min(k, len(entry.descriptors))
+        if k == 0 or len(query) == 0:
+            empty = np.empty(0)
+            return {c:empty for c in MATCH_COLUMNS}
+        train_idx, distance = entry.index.knnSearch(np.ascontiguousarray(query), k, params={})
+
+        query_idx = np.repeat(np.arange(len(query)), k)
+        train_idx = train_idx.ravel()
+        # FLANN returns squared euclidean distances
+        distance = np.sqrt(distance.ravel())
+        found = train_idx >= 0
+        query_idx, train_idx, distance = query_idx[found], train_idx[found], distance[found]
+
+        if bidx is not None:
+            qid = np.asarray(bidx)[query_idx]
+        else:
+            qid = query_idx
+        tid = entry.search_idx[train_idx]
+        return _orient_matches(b['node_id'], qid, a['node_id'], tid, distance)
+
+
+FLANN_INDEX_CACHE = FlannIndexCache()
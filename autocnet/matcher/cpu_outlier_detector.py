@@ -6,6 +6,86 @@ import numpy as np
 import pandas as pd
 
 
+def lowe_ratio_mask(keys, distances, ratio=0.8, single=False):
+    """
+    Lowe's ratio test for k-NN matches grouped by keypoint. Within each group
+    of rows sharing a key, taken in row order (i.e., sorted by distance as
+    returned by the k-NN query), the first row passes if its distance is less
+    than ratio times the distance of the second row. All other rows fail.
+
+    Parameters
+    ----------
+    keys : ndarray
+           (n,) the keypoint index of each match, e.g., the source_idx
+
+    distances : ndarray
+                (n,) the descriptor distance of each match
+
+    ratio : float
+            the ratio between the first and second-best match distances
+
+    single : bool
+             The result for keys that only have a single match
+
+    Returns
+    -------
+    mask : ndarray
+           (n,) boolean mask with the rows passing the ratio test set to True
+    """
+    keys = np.asarray(keys)
+    distances = np.asarray(distances)
+    mask = np.zeros(len(keys), dtype=bool)
+    if not len(keys):
+        return mask
+
+    # A stable sort keeps the rows of each group in their original order
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(keys)])
+
+    first = order[starts]
+    multiple = sizes > 1
+    second = order[starts[multiple] + 1]
+    mask[first[multiple]] = distances[first[multiple]] < distances[second] * ratio
+    mask[first[~multiple]] = single
+    return mask
+
+
+def distance_ratio_mask(source_idx, destination_idx, distances, ratio=0.8, single=False):
+    """
+    Lowe's ratio test (see distance_ratio) on the arrays of k-NN matches,
+    e.g., as returned by FlannMatcher.query, without a dataframe.
+
+    Parameters
+    ----------
+    source_idx : ndarray
+                 (n,) the source keypoint index of each match
+
+    destination_idx : ndarray
+                      (n,) the destination keypoint index of each match
+
+    distances : ndarray
+                (n,) the descriptor distance of each match
+
+    ratio : float
+            the ratio between the first and second-best match distances
+
+    single : bool
+             If True, source keypoints with a single match pass the source
+             side of the test. Destination keypoints with a single match
+             always pass.
+
+    Returns
+    -------
+    mask : ndarray
+           (n,) boolean mask with the matches failing the ratio test set to False
+    """
+    mask_s = lowe_ratio_mask(source_idx, distances, ratio=ratio, single=single)
+    mask_d = lowe_ratio_mask(destination_idx, distances, ratio=ratio, single=True)
+    return mask_s & mask_d
+
+
 def distance_ratio(edge, matches, ratio=0.8, single=False):
     """
     Compute and return a mask for a matches dataframe
@@ -28,21 +108,47 @@ def distance_ratio(edge, matches, ratio=0.8, single=False):
     mask : pd.dataframe
            A Pandas DataFrame mask for the matches with those failing the
            ratio test set to False.
+
+    See Also
+    --------
+    distance_ratio_mask : the same test on the match arrays
     """
-    def func(group):
-        res = [False] * len(group)
-        if len(res) == 1:
-            return [single]
-        if group.iloc[0] < group.iloc[1] * ratio:
-            res[0] = True
-        return res
-
-    mask_s = matches.groupby('source_idx')['distance'].transform(func).astype('bool')
-    single = True
-    mask_d = matches.groupby('destination_idx')['distance'].transform(func).astype('bool')
-    mask = mask_s & mask_d
+    mask = distance_ratio_mask(matches['source_idx'].values,
+                               matches['destination_idx'].values,
+                               matches['distance'].values,
+                               ratio=ratio, single=single)
+    return pd.Series(mask, index=matches.index)
 
-    return mask
+
+def _first_occupants(x, y, minx, maxx, miny, maxy, n_x_cells, n_y_cells):
+    """
+    Bin points into a n_y_cells by n_x_cells grid over the domain and return
+    the index of the first point that falls into each occupied cell. Points
+    are binned with np.digitize; points left of (below) the first edge wrap
+    into the last column (row) as when indexing a grid with -1.
+
+    Parameters
+    ----------
+    x : ndarray
+        (n,) x coordinates, ordered from the best to the worst point
+
+    y : ndarray
+        (n,) y coordinates, ordered from the best to the worst point
+
+    Returns
+    -------
+     : ndarray
+       The sorted indices of the first point in each occupied cell
+    """
+    x_edges = np.linspace(minx, maxx, n_x_cells)
+    y_edges = np.linspace(miny, maxy, n_y_cells)
+    x_cells = (np.digitize(x, bins=x_edges) - 1) % n_x_cells
+    y_cells = (np.digitize(y, bins=y_edges) - 1) % n_y_cells
+    cells = y_cells.astype(np.int64) * n_x_cells + x_cells
+
+    # np.unique uses a stable sort, so the first index of each cell is the best point
+    _, first = np.unique(cells, return_index=True)
+    return np.sort(first)
 
 
 def spatial_suppression(df, bounds, xkey='x', ykey='y', k=60, error_k=0.05, nsteps=250):
@@ -50,6 +156,10 @@ def spatial_suppression(df, bounds, xkey='x', ykey='y', k=60, error_k=0.05, nste
     Apply the spatial suppression algorithm over an arbitrary domain for all of the spatial
     data in the provided data frame.
 
+    The cell size is found with a binary search. For each cell size the domain
+    is gridded and the best (lowest strength) point in each cell is kept, which
+    is computed for all of the points at once with a grid hash.
+
     Parameters
     ----------
 
@@ -98,15 +208,14 @@ def spatial_suppression(df, bounds, xkey='x', ykey='y', k=60, error_k=0.05, nste
     min_idx = 0
     max_idx = len(search_space) - 1
 
-    # Setup flags to watch for looping
-    prev_min = None
-    prev_max = None
-
     # Sort the dataframe (hard coded to ascending as lower strength (cost) is better)
     df = df.sort_values(by=['strength'], ascending=True).copy()
     df = df.reset_index(drop=True)
     mask = pd.Series(False, index=df.index)
+    x = df[xkey].values
+    y = df[ykey].values
 
+    result = np.empty(0, dtype=np.int64)
     process = True
     while process:
         # Binary search
@@ -114,9 +223,10 @@ def spatial_suppression(df, bounds, xkey='x', ykey='y', k=60, error_k=0.05, nste
         if min_idx == mid_idx or mid_idx == max_idx:
             warnings.warn('Unable to optimally solve.')
             process = False
+            # The final, non-optimal, step adds to the previous result
+            previous = result
         else:
-            # Setup to store results
-            result = []
+            previous = np.empty(0, dtype=np.int64)
 
         # Get the current cell size and grid the domain
         cell_size = cell_sizes[mid_idx]
@@ -128,27 +238,9 @@ def spatial_suppression(df, bounds, xkey='x', ykey='y', k=60, error_k=0.05, nste
         if n_y_cells <= 0:
             n_y_cells = 1
 
-        grid = np.zeros((n_y_cells, n_x_cells), dtype=bool)
-        # Assign all points to bins
-        x_edges = np.linspace(minx, maxx, n_x_cells)
-        y_edges = np.linspace(miny, maxy, n_y_cells)
-        xbins = np.digitize(df[xkey], bins=x_edges)
-        ybins = np.digitize(df[ykey], bins=y_edges)
-
-        # Starting with the best point, start assigning points to grid cells
-        for i, (idx, p) in enumerate(df.iterrows()):
-            x_center = xbins[i] - 1
-            y_center = ybins[i] - 1
-            cell = grid[y_center, x_center]
-
-            if cell == False:
-                result.append(idx)
-                # Set the cell to True
-                grid[y_center, x_center] = True
-
-            # If everything is already 'covered' break from the list
-            if grid.all() == False:
-                continue
+        # Assign all points to cells and keep the best point in each cell
+        result = np.concatenate((previous, _first_occupants(x, y, minx, maxx, miny, maxy,
+                                                            n_x_cells, n_y_cells)))
 
         # Check to see if the algorithm is completed, or if the grid size needs to be larger or smaller
         if k - k * error_k <= len(result) <= k + k * error_k:
@@ -166,7 +258,7 @@ def spatial_suppression(df, bounds, xkey='x', ykey='y', k=60, error_k=0.05, nste
         elif len(result) > k + k * error_k:
             # Too many points, break
             min_idx = mid_idx
-    mask.loc[list(result)] = True
+    mask.iloc[result] = True
     return mask, len(result)
 
 
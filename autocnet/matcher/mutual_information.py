@@ -1,9 +1,14 @@
 from math import floor
+from numbers import Integral
 
 import numpy as np
-
 from scipy.ndimage.measurements import center_of_mass
 
+from autocnet.utils.utils import sliding_window_view
+
+# The maximum number of window pixels quantized at once by mutual_information_map
+MI_CHUNK_SIZE = 2**22
+
 def mutual_information(t1, t2, **kwargs):
     """
     Computes the correlation coefficient between two images using a histogram
@@ -50,6 +55,130 @@ def mutual_information(t1, t2, **kwargs):
     nzs = pxy > 0 # Only non-zero pxy values contribute to the sum
     return np.sum(pxy[nzs] * np.log(pxy[nzs] / px_py[nzs]))
 
+def _histogram_edges(vmin, vmax, bins, dtype):
+    """
+    The first edge and the bin width of numpy.histogram2d for samples in the
+    range [vmin, vmax] (arrays, e.g., one per window) of the given dtype.
+    """
+    edge_dtype = np.result_type(dtype, 0.5)
+    start = np.asarray(vmin).astype(edge_dtype)
+    stop = np.asarray(vmax).astype(edge_dtype)
+    # As numpy, widen an empty range
+    empty = start == stop
+    start = np.where(empty, start - edge_dtype.type(0.5), start)
+    stop = np.where(empty, stop + edge_dtype.type(0.5), stop)
+    step = (stop - start) / bins
+    return start, stop, step
+
+def _histogram_bins(values, start, stop, step, bins):
+    """
+    The 0 based numpy.histogram2d bin of each value, where start, stop and step
+    (see _histogram_edges) broadcast against values. The bin is estimated from
+    the bin width and then checked against the edges as numpy.linspace computes
+    them, so that values on (or next to) an edge are binned as numpy bins them.
+    """
+    values = values.astype(start.dtype, copy=False)
+    edge = lambda b: b.astype(start.dtype) * step + start
+    b = np.clip(np.floor((values - start) / step), 0, bins - 1).astype(np.intp)
+    b -= edge(b) > values
+    b += (b < bins - 1) & (edge(b + 1) <= values)
+    # The last edge is the maximum and values on it are in the last bin
+    b[values == stop] = bins - 1
+    return b
+
+def _window_bins(image, windows, bins, dtype):
+    """
+    The histogram bin of every pixel of the (rows, columns, height, width)
+    sliding windows of the image, each window quantized with the edges of its
+    own range. Windows with the same range share their edges, so when there
+    are few distinct ranges the image is quantized once per range and the
+    windows are gathered from it.
+    """
+    r, nx, th, tw = windows.shape
+    vmin = windows.min(axis=(2, 3))
+    vmax = windows.max(axis=(2, 3))
+    ranges, group = np.unique(np.stack((vmin.ravel(), vmax.ravel())), axis=1, return_inverse=True)
+    if ranges.shape[1] * image.size < windows.size:
+        start, stop, step = _histogram_edges(ranges[0], ranges[1], bins, dtype)
+        quantized = _histogram_bins(image, start[:, None, None], stop[:, None, None],
+                                    step[:, None, None], bins)
+        views = sliding_window_view(quantized, (th, tw), axis=(1, 2))
+        return views[group.reshape(r, nx), np.arange(r)[:, None], np.arange(nx)]
+
+    start, stop, step = _histogram_edges(vmin, vmax, bins, dtype)
+    return _histogram_bins(windows, start[..., None, None], stop[..., None, None],
+                           step[..., None, None], bins)
+
+def mutual_information_map(d_template, s_image, bins=10):
+    """
+    Computes the mutual information (see mutual_information) between the
+    template and every template sized window of the search image.
+
+    The template is quantized once. Each window is quantized with the bin edges
+    of its own range, as numpy.histogram2d bins it, i.e., the search image is
+    quantized once per distinct window range, and the joint histograms of all
+    windows are built with a single bincount over a sliding window view
+    (chunked to MI_CHUNK_SIZE window pixels). The result is identical to
+    calling mutual_information on each window.
+
+    Parameters
+    ----------
+    d_template : ndarray
+                 The template
+
+    s_image : ndarray
+              The search image, at least as large as the template
+
+    bins : int
+           The number of histogram bins along each axis
+
+    Returns
+    -------
+    corr_map : ndarray
+               (y, x) map of the mutual information of the window with its
+               upper left corner at (x, y) and the template
+    """
+    dtype = np.result_type(s_image, d_template)
+    s_image = np.asarray(s_image, dtype=dtype)
+    d_template = np.asarray(d_template, dtype=dtype)
+    th, tw = d_template.shape
+    npixels = th * tw
+    nbins = bins * bins
+
+    start, stop, step = _histogram_edges(d_template.min(), d_template.max(), bins, dtype)
+    template_bins = _histogram_bins(d_template, start, stop, step, bins)
+
+    windows = sliding_window_view(s_image, (th, tw))
+    ny, nx = windows.shape[:2]
+    rows = max(1, MI_CHUNK_SIZE // (nx * npixels))
+    hgram = np.empty((ny * nx, bins, bins))
+    for i in range(0, ny, rows):
+        chunk = windows[i:i+rows]
+        m = chunk.shape[0] * nx
+        window_bins = _window_bins(s_image[i:i+chunk.shape[0]+th-1], chunk, bins, dtype)
+        # Joint bin (window, template) of every pixel, offset by the window
+        joint = window_bins * bins + template_bins
+        joint += (np.arange(m) * nbins).reshape(chunk.shape[0], nx, 1, 1)
+        hgram[i*nx:i*nx+m] = np.bincount(joint.ravel(), minlength=m * nbins).reshape(m, bins, bins)
+
+    # As mutual_information, for all windows at once
+    pxy = hgram / float(npixels)
+    px = np.sum(pxy, axis=2)
+    py = np.sum(pxy, axis=1)
+    px_py = px[:, :, None] * py[:, None, :]
+    nzs = pxy > 0
+    terms = pxy[nzs] * np.log(pxy[nzs] / px_py[nzs])
+
+    # Sum the non-zero terms of each window, grouped by their number so that
+    # the terms are summed as np.sum sums them for a single window
+    counts = nzs.sum(axis=(1, 2))
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    corr = np.empty(len(counts))
+    for n in np.unique(counts):
+        windows_n = np.flatnonzero(counts == n)
+        corr[windows_n] = np.sum(terms[offsets[windows_n, None] + np.arange(n)], axis=1)
+    return corr.reshape(ny, nx)
+
 def mutual_information_match(d_template, s_image, subpixel_size=3,
                              func=None, **kwargs):
     """
@@ -71,7 +200,11 @@ def mutual_information_match(d_template, s_image, subpixel_size=3,
                     calculation
 
     func : function
-           Function object to be used to compute the histogram comparison
+           Function object to be used to compute the histogram comparison. If
+           None (default), the mutual information of all windows is computed
+           at once with mutual_information_map (for the kwargs of
+           mutual_information other than bins, the windows are compared one at
+           a time)
 
     Returns
     -------
@@ -89,29 +222,31 @@ def mutual_information_match(d_template, s_image, subpixel_size=3,
                locations within the search area
     """
 
-    if func == None:
-        func = mutual_information
-
     image_size = s_image.shape
     template_size = d_template.shape
 
     y_diff = image_size[0] - template_size[0]
     x_diff = image_size[1] - template_size[1]
 
-    max_corr = -np.inf
-    corr_map = np.zeros((y_diff+1, x_diff+1))
-    max_i = -1  # y
-    max_j = -1  # x
-    for i in range(y_diff+1):
-        for j in range(x_diff+1):
-            sub_image = s_image[i:i+template_size[1],  # y
-                                j:j+template_size[0]]  # x
-            corr = func(sub_image, d_template, **kwargs)
-            if corr > max_corr:
-                max_corr = corr
-                max_i = i
-                max_j = j
-            corr_map[i, j] = corr
+    bins = kwargs.get('bins', 10)
+    if func is None and set(kwargs) <= {'bins'} and isinstance(bins, Integral) and \
+       not (np.isnan(s_image).any() or np.isnan(d_template).any()):
+        corr_map = mutual_information_map(d_template, s_image, bins=bins)
+        max_corr = corr_map.max()
+    else:
+        if func is None:
+            func = mutual_information
+
+        max_corr = -np.inf
+        corr_map = np.zeros((y_diff+1, x_diff+1))
+        for i in range(y_diff+1):
+            for j in range(x_diff+1):
+                sub_image = s_image[i:i+template_size[0],  # y
+                                    j:j+template_size[1]]  # x
+                corr = func(sub_image, d_template, **kwargs)
+                if corr > max_corr:
+                    max_corr = corr
+                corr_map[i, j] = corr
 
     y, x = np.unravel_index(np.argmax(corr_map, axis=None), corr_map.shape)
 
@@ -140,3 +140,128 @@ def pattern_match(template, image, upsampling=16, metric=cv2.TM_CCOEFF_NORMED, e
     x = (x - ideal_x) / upsampling
     y = (y - ideal_y) / upsampling
     return x, y, max_corr, result
+
+def _quadratic_peak_offset(a, b, c):
+    """
+    The offset of the vertex of the parabola through (-1, a), (0, b), and (1, c)
+    from 0 and the value at the vertex.
+    """
+    denom = a - 2 * b + c
+    if denom == 0:
+        return 0, b
+    offset = 0.5 * (a - c) / denom
+    return offset, b - 0.25 * (a - c) * offset
+
+def pattern_match_fft(template, image, upsampling=16, metric=cv2.TM_CCOEFF_NORMED, refine='quadratic', margin=2,
+                      result=None):
+    """
+    Pattern match the template in the image at native resolution and then refine
+    the best match to subpixel precision locally.
+
+    In contrast to pattern_match, the full image is not upsampled. The correlation
+    surface is computed at native resolution (cv2.matchTemplate uses a DFT based
+    correlation for all but small templates) and only the neighborhood of the
+    integer peak is refined, either by fitting a quadratic through the peak and
+    its neighbors or by upsampling the template and a small window around the peak.
+
+    Parameters
+    ----------
+    template : ndarray
+               The input search template used to 'query' the destination
+               image
+    image : ndarray
+            The image or sub-image to be searched
+    upsampling : int
+                 The multiplier to upsample the template and the window around the
+                 peak when refine='upsample'
+    metric : object
+             The function to be used to perform the template based matching
+             Options: {cv2.TM_CCORR_NORMED, cv2.TM_CCOEFF_NORMED, cv2.TM_SQDIFF_NORMED}
+    refine : str
+             The subpixel refinement. 'quadratic' (default) fits a quadratic through
+             the peak of the correlation surface and its neighbors in x and y, 'upsample'
+             matches the upsampled template in the upsampled window around the peak,
+             and None returns the integer peak.
+    margin : int
+             The number of pixels around the integer peak that are searched when
+             refine='upsample'
+    result : ndarray
+             A precomputed (float32) correlation surface of the template in the
+             image with the given metric, e.g., computed from integral images
+             that are shared between templates. If None (default), the surface
+             is computed with cv2.matchTemplate.
+
+    Returns
+    -------
+    x : float
+        The x offset
+    y : float
+        The y offset
+    strength : float
+               The strength of the correlation in the range [-1, 1].
+    result : ndarray
+             The native resolution correlation surface
+
+    See Also
+    --------
+    pattern_match : the matcher that upsamples the full template and image
+    """
+    if upsampling < 1:
+        raise ValueError
+    if refine not in ('quadratic', 'upsample', None):
+        raise ValueError(f'refine must be one of "quadratic", "upsample", or None, not {refine}.')
+
+    if result is None:
+        result = cv2.matchTemplate(image, template, method=metric)
+    min_corr, max_corr, min_loc, max_loc = cv2.minMaxLoc(result)
+
+    if metric == cv2.TM_SQDIFF or metric == cv2.TM_SQDIFF_NORMED:
+        x, y = min_loc
+        strength = min_corr
+        use_min = True
+    else:
+        x, y = max_loc
+        strength = max_corr
+        use_min = False
+
+    template_y, template_x = template.shape[:2]
+
+    if refine == 'quadratic':
+        # The peak can only be refined if it has neighbors on both sides
+        dx = dy = 0
+        if 0 < x < result.shape[1] - 1:
+            dx, strength_x = _quadratic_peak_offset(*result[y, x-1:x+2])
+        else:
+            strength_x = strength
+        if 0 < y < result.shape[0] - 1:
+            dy, strength_y = _quadratic_peak_offset(*result[y-1:y+2, x])
+        else:
+            strength_y = strength
+        x += dx
+        y += dy
+        # Both fits pass through the peak, combine their corrections
+        strength = strength_x + strength_y - strength
+    elif refine == 'upsample' and upsampling != 1:
+        # Upsample only the window that contains the template at +/- margin pixels
+        ystart = max(y - margin, 0)
+        ystop = min(y + margin + template_y, image.shape[0])
+        xstart = max(x - margin, 0)
+        xstop = min(x + margin + template_x, image.shape[1])
+
+        u_template = zoom(template, upsampling, order=3)
+        u_window = zoom(image[ystart:ystop, xstart:xstop], upsampling, order=3)
+
+        local = cv2.matchTemplate(u_window, u_template, method=metric)
+        local_min, local_max, local_min_loc, local_max_loc = cv2.minMaxLoc(local)
+        if use_min:
+            (ux, uy), strength = local_min_loc, local_min
+        else:
+            (ux, uy), strength = local_max_loc, local_max
+        x = xstart + ux / upsampling
+        y = ystart + uy / upsampling
+
+    # Compute the shift from the template upper left to the template center
+    # relative to the idealized shift (image center)
+    x += template_x / 2 - image.shape[1] / 2
+    y += template_y / 2 - image.shape[0] / 2
+    return x, y, strength, result
@@ -1,4 +1,6 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import json
 from math import modf, floor
 import time
@@ -10,6 +12,7 @@ from subprocess import CalledProcessError
 import numbers
 
 import sys
+import threading
 
 import cv2
 
@@ -23,12 +26,10 @@ from matplotlib import pyplot as plt
 
 from plio.io.io_gdal import GeoDataset
 
-import pvl
-
 import PIL
 from PIL import Image
 
-from autocnet.matcher.naive_template import pattern_match, pattern_match_autoreg
+from autocnet.matcher.naive_template import pattern_match, pattern_match_autoreg, pattern_match_fft
 from autocnet.matcher.mutual_information import mutual_information_match
 from autocnet.matcher import ciratefi
 from autocnet.matcher.mutual_information import mutual_information
@@ -274,6 +275,281 @@ def subpixel_phase(sx, sy, dx, dy,
 
     return dx, dy, error, None
 
+@lru_cache(maxsize=32)
+def _phase_window(window, shape):
+    """
+    Cached 2D window function used to taper the chips passed to the
+    stacked phase matcher. Returned arrays are read only as they are shared.
+    """
+    w = filters.window(window, shape)
+    w.setflags(write=False)
+    return w
+
+def _upsampled_dft_stack(data, upsampled_region_size, upsample_factor, axis_offsets):
+    """
+    Batched version of the matrix multiply DFT used by skimage to upsample
+    the cross correlation in a small region around each peak.
+
+    Parameters
+    ----------
+    data : ndarray
+           (N, rows, cols) complex cross power spectra
+
+    upsampled_region_size : int
+                            The size of the region to be sampled
+
+    upsample_factor : int
+                      The upsampling factor
+
+    axis_offsets : ndarray
+                   (N, 2) offsets, in upsampled pixels, of the region to
+                   be sampled in the form (row, col)
+
+    Returns
+    -------
+    : ndarray
+      (N, upsampled_region_size, upsampled_region_size) upsampled cross
+      correlation
+    """
+    nrows, ncols = data.shape[1:]
+    region = np.arange(upsampled_region_size)
+    im2pi = 1j * 2 * np.pi
+
+    col_kernel = np.exp(-im2pi * (region[None, :, None] - axis_offsets[:, 1, None, None]) *
+                        fftpack.fftfreq(ncols, upsample_factor)[None, None, :])
+    row_kernel = np.exp(-im2pi * (region[None, :, None] - axis_offsets[:, 0, None, None]) *
+                        fftpack.fftfreq(nrows, upsample_factor)[None, None, :])
+
+    data = np.einsum('nrc,nuc->nru', data, col_kernel)
+    return np.einsum('nru,nvr->nvu', data, row_kernel)
+
+def phase_cross_correlation_stack(reference_images, moving_images,
+                                  upsample_factor=1, normalization='phase',
+                                  window=None):
+    """
+    Phase cross correlation of a stack of image pairs. This is a batched
+    version of skimage.registration.phase_cross_correlation; the forward
+    and inverse FFTs of all pairs are computed with a single call each so
+    the FFT plan is shared across the stack.
+
+    Parameters
+    ----------
+    reference_images : ndarray
+                       (N, rows, cols) stack of reference images
+
+    moving_images : ndarray
+                    (N, rows, cols) stack of images to register against
+                    the reference images
+
+    upsample_factor : int
+                      Images are registered to within 1 / upsample_factor of
+                      a pixel.
+
+    normalization : {'phase', None}
+                    The normalization applied to the cross power spectrum.
+
+    window : str or tuple
+             Any window accepted by skimage.filters.window applied to both
+             stacks before the transform. The window is cached per
+             (window, shape). Default None, no window.
+
+    Returns
+    -------
+    shifts : ndarray
+             (N, 2) shifts in the form (y, x) required to register the
+             moving images with the reference images
+
+    errors : ndarray
+             (N,) translation invariant normalized RMS error
+
+    phasediffs : ndarray
+                 (N,) global phase differences
+
+    See Also
+    --------
+    skimage.registration.phase_cross_correlation : the single pair implementation
+    """
+    reference_images = np.asarray(reference_images)
+    moving_images = np.asarray(moving_images)
+    if reference_images.ndim == 2:
+        reference_images = reference_images[np.newaxis]
+    if moving_images.ndim == 2:
+        moving_images = moving_images[np.newaxis]
+    if reference_images.shape != moving_images.shape:
+        raise ValueError('reference_images and moving_images must have the same shape.')
+    if normalization not in ('phase', None):
+        raise ValueError("normalization must be either 'phase' or None.")
+
+    nimages = reference_images.shape[0]
+    shape = reference_images.shape[1:]
+    if window is not None:
+        w = _phase_window(window, shape)
+        reference_images = reference_images * w
+        moving_images = moving_images * w
+
+    src_freq = fftpack.fft2(reference_images, axes=(-2, -1))
+    target_freq = fftpack.fft2(moving_images, axes=(-2, -1))
+
+    image_product = src_freq * target_freq.conj()
+    if normalization == 'phase':
+        eps = np.finfo(image_product.real.dtype).eps
+        image_product /= np.maximum(np.abs(image_product), 100 * eps)
+    cross_correlation = fftpack.ifft2(image_product, axes=(-2, -1))
+
+    flat_idx = np.argmax(np.abs(cross_correlation).reshape(nimages, -1), axis=1)
+    maxima = np.column_stack(np.unravel_index(flat_idx, shape)).astype(np.float64)
+    midpoints = np.array([np.fix(axis_size / 2) for axis_size in shape])
+    shifts = maxima.copy()
+    shifts[shifts > midpoints] -= np.broadcast_to(np.array(shape, dtype=np.float64), shifts.shape)[shifts > midpoints]
+
+    index = np.arange(nimages)
+    if upsample_factor == 1:
+        size = np.prod(shape)
+        src_amp = np.sum(np.real(src_freq * src_freq.conj()), axis=(-2, -1)) / size
+        target_amp = np.sum(np.real(target_freq * target_freq.conj()), axis=(-2, -1)) / size
+        CCmax = cross_correlation[index, maxima[:, 0].astype(int), maxima[:, 1].astype(int)]
+    else:
+        # Initial shift estimate in upsampled grid, then a matrix multiply
+        # DFT of the 1.5 pixel neighborhood around each peak
+        upsample_factor = np.array(upsample_factor, dtype=np.float64)
+        shifts = np.round(shifts * upsample_factor) / upsample_factor
+        upsampled_region_size = int(np.ceil(upsample_factor * 1.5))
+        dftshift = np.fix(upsampled_region_size / 2.0)
+        sample_region_offset = dftshift - shifts * upsample_factor
+        cross_correlation = _upsampled_dft_stack(image_product.conj(),
+                                                 upsampled_region_size,
+                                                 upsample_factor,
+                                                 sample_region_offset).conj()
+        flat_idx = np.argmax(np.abs(cross_correlation).reshape(nimages, -1), axis=1)
+        maxima = np.column_stack(np.unravel_index(flat_idx, cross_correlation.shape[1:]))
+        CCmax = cross_correlation[index, maxima[:, 0], maxima[:, 1]]
+        shifts = shifts + (maxima - dftshift) / upsample_factor
+
+        src_amp = np.sum(np.real(src_freq * src_freq.conj()), axis=(-2, -1))
+        target_amp = np.sum(np.real(target_freq * target_freq.conj()), axis=(-2, -1))
+
+    # Zero the shift in any dimension of size 1
+    for dim, axis_size in enumerate(shape):
+        if axis_size == 1:
+            shifts[:, dim] = 0
+
+    errors = np.sqrt(np.abs(1.0 - (CCmax * CCmax.conj()).real / (src_amp * target_amp)))
+    phasediffs = np.arctan2(CCmax.imag, CCmax.real)
+    return shifts, errors, phasediffs
+
+def _as_sequence(obj, n):
+    """
+    Broadcast a single image handle to a list of n handles.
+    """
+    if isinstance(obj, (list, tuple)):
+        if len(obj) != n:
+            raise ValueError(f'Expected {n} images, got {len(obj)}.')
+        return list(obj)
+    return [obj] * n
+
+def subpixel_phase_stack(sx, sy, dx, dy,
+                         s_img, d_img,
+                         image_size=(51, 51),
+                         **kwargs):
+    """
+    Apply the spectral domain matcher to many ROI pairs at once. The ROIs are
+    clipped and stacked, and all pairs whose chips have the requested size are
+    registered with one call to phase_cross_correlation_stack per chip shape.
+    Pairs whose source and destination chips differ in shape (e.g., truncated
+    by the image edge) fall back to subpixel_phase.
+
+    Parameters
+    ----------
+    sx, sy : array-like
+             (N,) x and y positions of the ROI centers in the source image(s)
+
+    dx, dy : array-like
+             (N,) x and y positions of the ROI centers in the destination image(s)
+
+    s_img : object or list
+            A plio geodata object or array, or a list of N of them
+
+    d_img : object or list
+            A plio geodata object or array, or a list of N of them. For
+            example, the cubes of all of the measures of a point.
+
+    image_size : tuple
+                 Size of the ROIs in the form (x,y)
+
+    kwargs : dict
+             Passed to phase_cross_correlation_stack
+
+    Returns
+    -------
+    new_x : ndarray
+            (N,) updated destination x positions; NaN where the match failed
+
+    new_y : ndarray
+            (N,) updated destination y positions; NaN where the match failed
+
+    errors : ndarray
+             (N,) RMS error of each match; NaN where the match failed
+
+    phasediffs : ndarray
+                 (N,) phase difference of each match; NaN where the match failed
+
+    See Also
+    --------
+    subpixel_phase : the single pair implementation
+    """
+    sx = np.atleast_1d(np.asarray(sx, dtype=np.float64))
+    sy = np.atleast_1d(np.asarray(sy, dtype=np.float64))
+    dx = np.atleast_1d(np.asarray(dx, dtype=np.float64))
+    dy = np.atleast_1d(np.asarray(dy, dtype=np.float64))
+    npairs = len(sx)
+    s_imgs = _as_sequence(s_img, npairs)
+    d_imgs = _as_sequence(d_img, npairs)
+    image_size = check_image_size(image_size)
+
+    new_x = np.full(npairs, np.nan)
+    new_y = np.full(npairs, np.nan)
+    errors = np.full(npairs, np.nan)
+    phasediffs = np.full(npairs, np.nan)
+
+    # Group the pairs by chip shape so that every group is a single stack
+    stacks = defaultdict(lambda: ([], [], [], []))
+    for i in range(npairs):
+        s_roi = roi.Roi(s_imgs[i], sx[i], sy[i], size_x=image_size[0], size_y=image_size[1])
+        d_roi = roi.Roi(d_imgs[i], dx[i], dy[i], size_x=image_size[0], size_y=image_size[1])
+        s_image = s_roi.clip()
+        d_template = d_roi.clip()
+        if s_image is None or d_template is None:
+            continue
+        if s_image.shape != d_template.shape:
+            # Truncated at the image edge, shrink the pair on its own
+            phase_kwargs = {k:v for k, v in kwargs.items() if k in ('upsample_factor', 'normalization')}
+            try:
+                x, y, error, _ = subpixel_phase(sx[i], sy[i], dx[i], dy[i],
+                                                s_imgs[i], d_imgs[i],
+                                                image_size=image_size, **phase_kwargs)
+            except ValueError:
+                continue
+            if x is not None:
+                new_x[i], new_y[i], errors[i] = x, y, error
+            continue
+        idx, s_chips, d_chips, d_centers = stacks[s_image.shape]
+        idx.append(i)
+        s_chips.append(s_image)
+        d_chips.append(d_template)
+        d_centers.append((d_roi.x, d_roi.y))
+
+    for idx, s_chips, d_chips, d_centers in stacks.values():
+        shifts, stack_errors, stack_phasediffs = phase_cross_correlation_stack(np.stack(s_chips),
+                                                                               np.stack(d_chips),
+                                                                               **kwargs)
+        d_centers = np.asarray(d_centers)
+        new_x[idx] = d_centers[:, 0] - shifts[:, 1]
+        new_y[idx] = d_centers[:, 1] - shifts[:, 0]
+        errors[idx] = stack_errors
+        phasediffs[idx] = stack_phasediffs
+
+    return new_x, new_y, errors, phasediffs
+
 def subpixel_transformed_template(sx, sy, dx, dy,
                                   s_img, d_img,
                                   transform,
@@ -350,6 +626,7 @@ def subpixel_transformed_template(sx, sy, dx, dy,
     --------
     autocnet.matcher.naive_template.pattern_match : for the kwargs that can be passed to the matcher
     autocnet.matcher.naive_template.pattern_match_autoreg : for the jwargs that can be passed to the autoreg style matcher
+    autocnet.matcher.naive_template.pattern_match_fft : a faster matcher, refining the native resolution peak, that can be passed as func
     """
     image_size = check_image_size(image_size)
     template_size = check_image_size(template_size)
@@ -363,15 +640,9 @@ def subpixel_transformed_template(sx, sy, dx, dy,
     if not s_roi.is_valid or not d_roi.is_valid:
         return [None] * 4
 
-    try:
-        s_image_dtype = isis.isis2np_types[pvl.load(s_img.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
-    except:
-        s_image_dtype = None
-
-    try:
-        d_template_dtype = isis.isis2np_types[pvl.load(d_img.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
-    except:
-        d_template_dtype = None
+    # Arrays do not have a file_name, get_dtype returns None for them
+    s_image_dtype = isis.get_dtype(getattr(s_img, 'file_name', None))
+    d_template_dtype = isis.get_dtype(getattr(d_img, 'file_name', None))
 
     s_image = bytescale(s_roi.clip(dtype=s_image_dtype))
     d_template = bytescale(d_roi.clip(dtype=d_template_dtype))
@@ -611,15 +882,9 @@ def subpixel_template(sx, sy, dx, dy,
     if not s_roi.is_valid or not d_roi.is_valid:
         return [None] * 4
 
-    try:
-        s_image_dtype = isis.isis2np_types[pvl.load(s_img.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
-    except:
-        s_image_dtype = None
-
-    try:
-        d_template_dtype = isis.isis2np_types[pvl.load(d_img.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
-    except:
-        d_template_dtype = None
+    # Arrays do not have a file_name, get_dtype returns None for them
+    s_image_dtype = isis.get_dtype(getattr(s_img, 'file_name', None))
+    d_template_dtype = isis.get_dtype(getattr(d_img, 'file_name', None))
 
     s_image = bytescale(s_roi.clip(dtype=s_image_dtype))
     d_template = bytescale(d_roi.clip(dtype=d_template_dtype))
@@ -771,6 +1036,87 @@ def iterative_phase(sx, sy, dx, dy, s_img, d_img, size=(51, 51), reduction=11, c
 
     return dx, dy, metrics
 
+def iterative_phase_stack(sx, sy, dx, dy, s_img, d_img, size=(51, 51), reduction=11,
+                          convergence_threshold=1.0, max_dist=50, **kwargs):
+    """
+    Apply iterative_phase to many ROI pairs at once. Each iteration registers
+    all of the pairs that have not yet converged with a single call to
+    subpixel_phase_stack, so the edge or point level registration of N
+    measures requires one batched FFT per iteration instead of N.
+
+    Parameters
+    ----------
+    sx, sy : array-like
+             (N,) x and y positions of the template centers
+
+    dx, dy : array-like
+             (N,) x and y positions of the search centers
+
+    s_img : object or list
+            A plio geodata object or array, or a list of N of them
+
+    d_img : object or list
+            A plio geodata object or array, or a list of N of them
+
+    See iterative_phase for the remaining parameters.
+
+    Returns
+    -------
+    dx : ndarray
+         (N,) the new x values for the matches; NaN where a match did not converge
+
+    dy : ndarray
+         (N,) the new y values for the matches; NaN where a match did not converge
+
+    errors : ndarray
+             (N,) the RMS error of the final iteration of each match
+
+    See Also
+    --------
+    iterative_phase : the single pair implementation
+    """
+    sx = np.atleast_1d(np.asarray(sx, dtype=np.float64))
+    sy = np.atleast_1d(np.asarray(sy, dtype=np.float64))
+    dx = np.atleast_1d(np.asarray(dx, dtype=np.float64)).copy()
+    dy = np.atleast_1d(np.asarray(dy, dtype=np.float64)).copy()
+    npairs = len(sx)
+    s_imgs = _as_sequence(s_img, npairs)
+    d_imgs = _as_sequence(d_img, npairs)
+
+    dsample = dx.copy()
+    dline = dy.copy()
+    errors = np.full(npairs, np.nan)
+    converged = np.zeros(npairs, dtype=bool)
+    active = np.arange(npairs)
+
+    while len(active):
+        shifted_dx, shifted_dy, metrics, _ = subpixel_phase_stack(sx[active], sy[active],
+                                                                  dx[active], dy[active],
+                                                                  [s_imgs[i] for i in active],
+                                                                  [d_imgs[i] for i in active],
+                                                                  image_size=size, **kwargs)
+        # Failed matches can not converge
+        failed = np.isnan(shifted_dx)
+        delta_dx = np.abs(shifted_dx - dx[active])
+        delta_dy = np.abs(shifted_dy - dy[active])
+        dx[active] = shifted_dx
+        dy[active] = shifted_dy
+        errors[active] = metrics
+
+        size = (size[0] - reduction, size[1] - reduction)
+        dist = np.hypot(dsample[active] - dx[active], dline[active] - dy[active])
+        if min(size) < 1:
+            break
+
+        done = ~failed & (delta_dx <= convergence_threshold) &\
+               (delta_dy <= convergence_threshold) & (dist <= max_dist)
+        converged[active[done]] = True
+        active = active[~done & ~failed]
+
+    dx[~converged] = np.nan
+    dy[~converged] = np.nan
+    return dx, dy, errors
+
 def estimate_affine_transformation(destination_coordinates, source_coordinates):
     """
     Given a set of destination control points compute the affine transformation
@@ -803,7 +1149,8 @@ def geom_match_simple(base_cube,
                        match_func="classic",
                        match_kwargs={"image_size":(101,101), "template_size":(31,31)},
                        preprocess=None,
-                       verbose=False):
+                       verbose=False,
+                       base_arr=None):
     """
     Propagates a source measure into destination images and then perfroms subpixel registration.
     Measure creation is done by projecting the (lon, lat) associated with the source measure into the
@@ -836,6 +1183,9 @@ def geom_match_simple(base_cube,
                 the source subimage and projected destination subimage, the second subplot contains the registered
                 measure's location in the base subimage and the unprojected destination subimage with the corresponding
                 template metric correlation map.
+    base_arr:   np.ndarray
+                the pixels of the base_cube, if already read (e.g., shared by the measures of a point). If None
+                (default), the base_cube is read.
     Returns
     -------
     sample: int
@@ -888,37 +1238,37 @@ def geom_match_simple(base_cube,
     # specifically not putting this in a try/except, this should never fail
     center_x, center_y = bcenter_x, bcenter_y
 
-    base_corners = [(base_startx,base_starty),
-                    (base_startx,base_stopy),
-                    (base_stopx,base_stopy),
-                    (base_stopx,base_starty),
-                    (bcenter_x, bcenter_y)]
+    base_corners = np.array([(base_startx,base_starty),
+                             (base_startx,base_stopy),
+                             (base_stopx,base_stopy),
+                             (base_stopx,base_starty),
+                             (bcenter_x, bcenter_y)], dtype=np.float64)
 
-    dst_corners = []
-    for x,y in base_corners:
-        try:
-            lon, lat = spatial.isis.image_to_ground(base_cube.file_name, x, y)
-            dst_corners.append(
-                spatial.isis.ground_to_image(input_cube.file_name, lon, lat)
-            )
-        except: pass
-
-    if len(dst_corners) < 3:
+    try:
+        dst_corners = np.column_stack(spatial.isis.image_to_image(base_cube.file_name,
+                                                                  input_cube.file_name,
+                                                                  base_corners[:,0],
+                                                                  base_corners[:,1]))
+    except CalledProcessError:
+        dst_corners = np.full(base_corners.shape, np.nan)
+    valid = np.isfinite(dst_corners).all(axis=1)
+
+    if valid.sum() < 3:
         raise ValueError('Unable to find enough points to compute an affine transformation.')
 
-    base_gcps = np.array([*base_corners])
-
-    dst_gcps = np.array([*dst_corners])
+    base_gcps = base_corners[valid]
+    dst_gcps = dst_corners[valid]
 
-    affine = tf.estimate_transform('affine', np.array([*base_gcps]), np.array([*dst_gcps]))
+    affine = tf.estimate_transform('affine', base_gcps, dst_gcps)
     t2 = time.time()
     print(f'Estimation of the transformation took {t2-t1} seconds.')
     # read_array not getting correct type by default
 
-    base_type = isis.isis2np_types[pvl.load(base_cube.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
-    base_arr = base_cube.read_array(dtype=base_type)
+    if base_arr is None:
+        base_type = isis.get_cube_info(base_cube.file_name).dtype
+        base_arr = base_cube.read_array(dtype=base_type)
 
-    dst_type = isis.isis2np_types[pvl.load(input_cube.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
+    dst_type = isis.get_cube_info(input_cube.file_name).dtype
     dst_arr = input_cube.read_array(dtype=dst_type)
 
     box = (0, 0, max(dst_arr.shape[1], base_arr.shape[1]), max(dst_arr.shape[0], base_arr.shape[0]))
@@ -1078,26 +1428,27 @@ def geom_match_classic(base_cube,
     if base_starty < 0:
         raise Exception(f"Window: {base_starty} < 0, center: {bcenter_x},{bcenter_y}")
 
-    # specifically not putting this in a try/except, this should never fail
-    mlon, mlat = spatial.isis.image_to_ground(base_cube.file_name, bcenter_x, bcenter_y)
-    center_x, center_y = spatial.isis.ground_to_image(input_cube.file_name, mlon, mlat)
-
     base_corners = [(base_startx,base_starty),
                     (base_startx,base_stopy),
                     (base_stopx,base_stopy),
                     (base_stopx,base_starty)]
 
-    dst_corners = []
-    for x,y in base_corners:
-        try:
-            lon, lat = spatial.isis.image_to_ground(base_cube.file_name, x, y)
-            dst_corners.append(
-                spatial.isis.ground_to_image(input_cube.file_name, lon, lat)
-            )
-        except CalledProcessError as e:
-            if 'Requested position does not project in camera model' in e.stderr:
-                print(f'Skip geom_match; Region of interest corner located at ({lon}, {lat}) does not project to image {input_cube.base_name}')
-                return None, None, None, None, None
+    # Transform the center and the corners with a single campt call per cube.
+    base_points = np.array([(bcenter_x, bcenter_y), *base_corners], dtype=np.float64)
+    dst_samples, dst_lines = spatial.isis.image_to_image(base_cube.file_name,
+                                                         input_cube.file_name,
+                                                         base_points[:,0],
+                                                         base_points[:,1])
+    if not np.isfinite(dst_samples[0]) or not np.isfinite(dst_lines[0]):
+        raise ValueError(f'Center ({bcenter_x}, {bcenter_y}) does not project to image {input_cube.base_name}')
+    center_x, center_y = dst_samples[0], dst_lines[0]
+
+    dst_corners = np.column_stack((dst_samples[1:], dst_lines[1:]))
+    missing = ~np.isfinite(dst_corners).all(axis=1)
+    if missing.any():
+        x, y = base_points[1:][missing][0]
+        print(f'Skip geom_match; Region of interest corner located at ({x}, {y}) does not project to image {input_cube.base_name}')
+        return None, None, None, None, None
 
     base_gcps = np.array([*base_corners])
     base_gcps[:,0] -= base_startx
@@ -1114,11 +1465,11 @@ def geom_match_classic(base_cube,
     affine = tf.estimate_transform('affine', np.array([*base_gcps]), np.array([*dst_gcps]))
 
     base_pixels = list(map(int, [base_corners[0][0], base_corners[0][1], size_x*2, size_y*2]))
-    base_type = isis.isis2np_types[pvl.load(base_cube.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
+    base_type = isis.get_cube_info(base_cube.file_name).dtype
     base_arr = base_cube.read_array(pixels=base_pixels, dtype=base_type)
 
     dst_pixels = list(map(int, [start_x, start_y, stop_x-start_x, stop_y-start_y]))
-    dst_type = isis.isis2np_types[pvl.load(input_cube.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
+    dst_type = isis.get_cube_info(input_cube.file_name).dtype
     dst_arr = input_cube.read_array(pixels=dst_pixels, dtype=dst_type)
 
     dst_arr = tf.warp(dst_arr, affine)
@@ -1264,31 +1615,28 @@ def geom_match(destination_cube,
                     (destination_stopx,destination_stopy),
                     (destination_stopx,destination_starty)]
 
-    # specifically not putting this in a try/except, this should never fail
-    # 07/28 - putting it in a try/except because of how we ground points
-    # Transform from the destination center to the source_cube center
-    try:
-        mlon, mlat = spatial.isis.image_to_ground(destination_cube.file_name, bcenter_x, bcenter_y)
-        center_x, center_y = spatial.isis.ground_to_image(source_cube.file_name, mlon, mlat)
-    except CalledProcessError as e:
-            if 'Requested position does not project in camera model' in e.stderr:
-                print(f'Skip geom_match; Region of interest center located at ({mlon}, {mlat}) does not project to image {source_cube.base_name}')
-                print('This should only appear when propagating ground points')
-                return None, None, None, None, None
+    # Transform the destination center and corners into the source_cube with
+    # a single campt call per cube. The center can fail to project when
+    # propagating ground points, so failures are checked rather than raised.
+    destination_points = np.array([(bcenter_x, bcenter_y), *destination_corners], dtype=np.float64)
+    source_samples, source_lines = spatial.isis.image_to_image(destination_cube.file_name,
+                                                               source_cube.file_name,
+                                                               destination_points[:,0],
+                                                               destination_points[:,1])
+    if not np.isfinite(source_samples[0]) or not np.isfinite(source_lines[0]):
+        print(f'Skip geom_match; Region of interest center located at ({bcenter_x}, {bcenter_y}) does not project to image {source_cube.base_name}')
+        print('This should only appear when propagating ground points')
+        return None, None, None, None, None
+    center_x, center_y = source_samples[0], source_lines[0]
 
     # Compute the mapping between the destination corners and the source_cube corners in
     # order to estimate an affine transformation
-    source_corners = []
-    for x,y in destination_corners:
-        try:
-            lon, lat = spatial.isis.image_to_ground(destination_cube.file_name, x, y)
-            source_corners.append(
-                spatial.isis.ground_to_image(source_cube.file_name, lon, lat)
-            )
-        except CalledProcessError as e:
-            if 'Requested position does not project in camera model' in e.stderr:
-                print(f'Skip geom_match; Region of interest corner located at ({lon}, {lat}) does not project to image {source_cube.base_name}')
-                return None, None, None, None, None
+    source_corners = np.column_stack((source_samples[1:], source_lines[1:]))
+    missing = ~np.isfinite(source_corners).all(axis=1)
+    if missing.any():
+        x, y = destination_points[1:][missing][0]
+        print(f'Skip geom_match; Region of interest corner located at ({x}, {y}) does not project to image {source_cube.base_name}')
+        return None, None, None, None, None
 
 
     # Estimate the transformation
@@ -1431,6 +1779,265 @@ def subpixel_register_measure(measureid,
 
     return resultlog
 
+def measure_threads(ncg=None, n_threads=None):
+    """
+    The number of threads used to register the measures of a point
+    concurrently.
+
+    Parameters
+    ----------
+    ncg : obj
+          A network candidate graph, the number of threads is read from the
+          measure_threads key in the cluster section of its config
+
+    n_threads : int
+                If not None, this number of threads is used
+
+    Returns
+    -------
+     : int
+       The number of threads, 1 (the measures are registered one after
+       another) if neither is set
+    """
+    if n_threads is None:
+        try:
+            n_threads = ncg.config['cluster'].get('measure_threads', 1)
+        except (AttributeError, KeyError, TypeError):
+            n_threads = 1
+    return max(int(n_threads or 1), 1)
+
+def _map_measures(func, measures, n_threads=1):
+    """
+    Apply func to each of the measures, with at most n_threads measures
+    registered at once, and return the results in the order of the measures.
+    """
+    if n_threads <= 1 or len(measures) <= 1:
+        return [func(measure) for measure in measures]
+    with ThreadPoolExecutor(max_workers=min(n_threads, len(measures))) as executor:
+        return list(executor.map(func, measures))
+
+_thread_state = threading.local()
+
+def _thread_geodata(node, threaded=True):
+    """
+    The GeoDataset of a node. GDAL datasets must not be read from several
+    threads at once, so in threaded registration each thread opens its own
+    dataset of the image (once per thread).
+    """
+    if not threaded:
+        return node.geodata
+    datasets = getattr(_thread_state, 'datasets', None)
+    if datasets is None:
+        datasets = _thread_state.datasets = {}
+    path = node['image_path']
+    if path not in datasets:
+        datasets[path] = GeoDataset(path)
+    return datasets[path]
+
+def _subpixel_register_measures(source,
+                                source_node,
+                                measures,
+                                reference_index,
+                                nodes,
+                                cost_func=lambda x,y: 1/x**2 * y,
+                                threshold=0.005,
+                                geom_func=None,
+                                match_func=None,
+                                match_kwargs={},
+                                verbose=False,
+                                chooser='subpixel_register_point',
+                                n_threads=1):
+    """
+    Subpixel register the measures of a single point to its reference (source)
+    measure. The measures are updated in place.
+
+    With n_threads > 1 the measures are registered concurrently in a thread
+    pool. Each thread reads the images through its own datasets, and the
+    pixels of the reference image are read once and shared by geom_match_simple.
+    The results are collected in the order of the measures.
+
+    Parameters
+    ----------
+    source : obj
+             The reference Measures object
+
+    source_node : obj
+                  The NetworkNode of the reference image
+
+    measures : list
+               Of the Measures objects of the point, ordered by id
+
+    reference_index : int
+                      The index of the source measure in measures
+
+    nodes : dict
+            Of NetworkNode objects keyed by image id
+
+    geom_func : callable
+                function used to tranform the source and/or destination image before
+                running a matcher.
+
+    match_func : callable
+                 subpixel matching function to use registering measures
+
+    n_threads : int
+                The maximum number of measures registered at once
+
+    See subpixel_register_point for the remaining parameters.
+
+    Returns
+    -------
+    resultlog : list
+                Of dicts with the registration status of each measure
+
+    updated_measures : list
+                       Of the Measures objects that need to be written back
+    """
+    to_register = [measure for i, measure in enumerate(measures) if i != reference_index]
+    threaded = n_threads > 1 and len(to_register) > 1
+    geom_kwargs = {}
+    if geom_func == geom_match_simple and to_register:
+        # Read the reference pixels once, they are shared by all of the measures
+        base_arr = source_node.geodata.read_array(dtype=isis.get_cube_info(source_node.geodata.file_name).dtype)
+        base_arr.setflags(write=False)
+        geom_kwargs['base_arr'] = base_arr
+
+    def register(measure):
+        """
+        Register a single measure and return its log entry and the measure.
+        """
+        currentlog = {'measureid':measure.id,
+                    'status':''}
+        cost = None
+        destinationid = measure.imageid
+
+        destination_node = nodes[measure.imageid]
+
+        print('geom_match image:', destination_node['image_path'])
+        print('geom_func', geom_func)
+        try:
+            base_cube = _thread_geodata(source_node, threaded)
+            input_cube = _thread_geodata(destination_node, threaded)
+            # new geom_match has a incompatible API, until we decide on one, put in if.
+            if (geom_func == geom_match):
+               new_x, new_y, dist, metric,  _ = geom_func(base_cube, input_cube,
+                                                    source.apriorisample, source.aprioriline,
+                                                    template_kwargs=match_kwargs,
+                                                    verbose=verbose)
+            else:
+                new_x, new_y, dist, metric,  _ = geom_func(base_cube, input_cube,
+                                                    source.apriorisample, source.aprioriline,
+                                                    match_func=match_func,
+                                                    match_kwargs=match_kwargs,
+                                                    verbose=verbose,
+                                                    **geom_kwargs)
+        except Exception as e:
+            print(f'geom_match failed on measure {measure.id} with exception -> {e}')
+            currentlog['status'] = f"geom_match failed on measure {measure.id}"
+            if measure.weight is None:
+                measure.ignore = True # Geom match failed and no previous sucesses
+            return currentlog, measure
+
+        if new_x == None or new_y == None:
+            currentlog['status'] = f'Failed to register measure {measure.id}.'
+            if measure.weight is None:
+                measure.ignore = True # Unable to geom match and no previous sucesses
+            return currentlog, measure
+
+        measure.template_metric = metric
+        measure.template_shift = dist
+
+        cost = cost_func(measure.template_shift, measure.template_metric)
+
+        print(f'Current Cost: {cost},  Current Weight: {measure.weight}')
+
+        # Check to see if the cost function requirement has been met
+        if measure.weight and cost <= measure.weight:
+            currentlog['status'] = f'Previous match provided better correlation. {measure.weight} > {cost}.'
+            return currentlog, measure
+
+        if cost <= threshold:
+            currentlog['status'] = f'Cost failed. Distance calculated: {measure.template_shift}. Metric calculated: {measure.template_metric}.'
+            if measure.weight is None:
+                measure.ignore = True # Threshold criteria not met and no previous sucesses
+            return currentlog, measure
+
+        # Update the measure
+        measure.sample = new_x
+        measure.line = new_y
+        measure.weight = cost
+        measure.choosername = chooser
+
+        # In case this is a second run, set the ignore to False if this
+        # measures passed. Also, set the source measure back to ignore=False
+        measure.ignore = False
+        # Maybe source?
+        source.ignore = False
+        currentlog['status'] = f'Success. Distance shifted: {measure.template_shift}. Metric: {measure.template_metric}.'
+        return currentlog, measure
+
+    results = _map_measures(register, to_register, n_threads=n_threads if threaded else 1)
+
+    resultlog = [currentlog for currentlog, _ in results]
+    updated_measures = [measure for _, measure in results]
+    return resultlog, updated_measures
+
+def _reset_reference_measure(source):
+    """
+    Set the registration attributes of a reference measure.
+    """
+    source.template_metric = 1
+    source.template_shift = 0
+    source.phase_error = 0
+    source.phase_diff = 0
+    source.phase_shift = 0
+
+def _write_measures(updated_measures, ncg, use_cache=False):
+    """
+    Write updated Measures objects back, either to the measure update redis queue
+    or with a single bulk UPDATE statement.
+    """
+    if use_cache:
+        t4 = time.time()
+        ncg.redis_queue.rpush(ncg.measure_update_queue,
+                              *[json.dumps(measure.to_dict(_hide=[]), cls=JsonEncoder) for measure in updated_measures])
+        ncg.redis_queue.incr(ncg.measure_update_counter, amount=len(updated_measures))
+        t5 = time.time()
+        print(f'Cache load took {t5-t4} seconds')
+        return
+
+    from sqlalchemy.sql.expression import bindparam
+
+    t4 = time.time()
+    rows = [{'_id':m.id,
+             'sample':m.sample,
+             'line':m.line,
+             'weight':m.weight,
+             'ignore':m.ignore,
+             'template_metric':m.template_metric,
+             'template_shift':m.template_shift,
+             'phase_error':m.phase_error,
+             'phase_diff':m.phase_diff,
+             'phase_shift':m.phase_shift,
+             'choosername':m.choosername} for m in updated_measures]
+    if rows:
+        stmt = Measures.__table__.update().\
+                                where(Measures.__table__.c.id == bindparam('_id')).\
+                                values({'sample':bindparam('sample'),
+                                        'line':bindparam('line'),
+                                        'weight':bindparam('weight'),
+                                        'measureIgnore':bindparam('ignore'),
+                                        'templateMetric':bindparam('template_metric'),
+                                        'templateShift':bindparam('template_shift'),
+                                        'phaseError':bindparam('phase_error'),
+                                        'phaseDiff':bindparam('phase_diff'),
+                                        'phaseShift':bindparam('phase_shift'),
+                                        'ChooserName':bindparam('choosername')})
+        with ncg.engine.begin() as conn:
+            conn.execute(stmt, rows)
+    t5 = time.time()
+    print(f'Database update took {t5-t4} seconds.')
+
 def subpixel_register_point(pointid,
                             cost_func=lambda x,y: 1/x**2 * y,
                             threshold=0.005,
@@ -1441,6 +2048,7 @@ def subpixel_register_point(pointid,
                             use_cache=False,
                             verbose=False,
                             chooser='subpixel_register_point',
+                            n_threads=None,
                             **kwargs):
 
     """
@@ -1477,6 +2085,16 @@ def subpixel_register_point(pointid,
                 and measures directly to the respective tables. If True, this method writes
                 messages to the point_insert (defined in ncg.config) redis queue for
                 asynchronous (higher performance) inserts.
+
+    n_threads : int
+                The number of measures registered at once in a thread pool. If None
+                (default), the measure_threads key in the cluster section of the
+                ncg config is used, see measure_threads. The results do not depend
+                on the number of threads.
+
+    See Also
+    --------
+    subpixel_register_points_batch : register many points with a single query and update
     """
 
     geom_func=geom_func.lower()
@@ -1505,11 +2123,7 @@ def subpixel_register_point(pointid,
 
         print(f'Using measure {source.id} on image {source.imageid}/{source.serial} as the reference.')
         print(f'Measure reference index is: {reference_index}')
-        source.template_metric = 1
-        source.template_shift = 0
-        source.phase_error = 0
-        source.phase_diff = 0
-        source.phase_shift = 0
+        _reset_reference_measure(source)
 
         sourceid = source.imageid
         sourceres = session.query(Images).filter(Images.id == sourceid).one()
@@ -1524,98 +2138,22 @@ def subpixel_register_point(pointid,
             nodes[measure.imageid] = NetworkNode(node_id=measure.imageid, image_path=res.path)
         session.expunge_all()
 
-    resultlog = []
-    updated_measures = []
-    for i, measure in enumerate(measures):
-        if i == reference_index:
-            continue
-
-        currentlog = {'measureid':measure.id,
-                    'status':''}
-        cost = None
-        destinationid = measure.imageid
-
-        destination_node = nodes[measure.imageid]
-
-        print('geom_match image:', destination_node['image_path'])
-        print('geom_func', geom_func)
-        try:
-            # new geom_match has a incompatible API, until we decide on one, put in if.
-            if (geom_func == geom_match):
-               new_x, new_y, dist, metric,  _ = geom_func(source_node.geodata, destination_node.geodata,
-                                                    source.apriorisample, source.aprioriline,
-                                                    template_kwargs=match_kwargs,
-                                                    verbose=verbose)
-            else:
-                new_x, new_y, dist, metric,  _ = geom_func(source_node.geodata, destination_node.geodata,
-                                                    source.apriorisample, source.aprioriline,
-                                                    match_func=match_func,
-                                                    match_kwargs=match_kwargs,
-                                                    verbose=verbose)
-        except Exception as e:
-            print(f'geom_match failed on measure {measure.id} with exception -> {e}')
-            currentlog['status'] = f"geom_match failed on measure {measure.id}"
-            resultlog.append(currentlog)
-            if measure.weight is None:
-                measure.ignore = True # Geom match failed and no previous sucesses
-            updated_measures.append(measure)
-            continue
-
-        if new_x == None or new_y == None:
-            currentlog['status'] = f'Failed to register measure {measure.id}.'
-            resultlog.append(currentlog)
-            if measure.weight is None:
-                measure.ignore = True # Unable to geom match and no previous sucesses
-            updated_measures.append(measure)
-            continue
-
-        measure.template_metric = metric
-        measure.template_shift = dist
-
-        cost = cost_func(measure.template_shift, measure.template_metric)
-
-        print(f'Current Cost: {cost},  Current Weight: {measure.weight}')
-
-        # Check to see if the cost function requirement has been met
-        if measure.weight and cost <= measure.weight:
-            currentlog['status'] = f'Previous match provided better correlation. {measure.weight} > {cost}.'
-            resultlog.append(currentlog)
-            updated_measures.append(measure)
-            continue
-
-        if cost <= threshold:
-            currentlog['status'] = f'Cost failed. Distance calculated: {measure.template_shift}. Metric calculated: {measure.template_metric}.'
-            resultlog.append(currentlog)
-            updated_measures.append(measure)
-            if measure.weight is None:
-                measure.ignore = True # Threshold criteria not met and no previous sucesses
-            continue
-
-        # Update the measure
-        measure.sample = new_x
-        measure.line = new_y
-        measure.weight = cost
-        measure.choosername = chooser
-
-        # In case this is a second run, set the ignore to False if this
-        # measures passed. Also, set the source measure back to ignore=False
-        measure.ignore = False
-        # Maybe source?
-        source.ignore = False
-        updated_measures.append(measure)
-        currentlog['status'] = f'Success. Distance shifted: {measure.template_shift}. Metric: {measure.template_metric}.'
-        resultlog.append(currentlog)
+    resultlog, updated_measures = _subpixel_register_measures(source, source_node, measures,
+                                                              reference_index, nodes,
+                                                              cost_func=cost_func,
+                                                              threshold=threshold,
+                                                              geom_func=geom_func,
+                                                              match_func=match_func,
+                                                              match_kwargs=match_kwargs,
+                                                              verbose=verbose,
+                                                              chooser=chooser,
+                                                              n_threads=measure_threads(ncg, n_threads))
 
     # Once here, update the source measure (possibly back to ignore=False)
     updated_measures.append(source)
 
     if use_cache:
-        t4 = time.time()
-        ncg.redis_queue.rpush(ncg.measure_update_queue,
-                              *[json.dumps(measure.to_dict(_hide=[]), cls=JsonEncoder) for measure in updated_measures])
-        ncg.redis_queue.incr(ncg.measure_update_counter, amount=len(updated_measures))
-        t5 = time.time()
-        print(f'Cache load took {t5-t4} seconds')
+        _write_measures(updated_measures, ncg, use_cache=True)
     else:
         t4 = time.time()
         # Commit the updates back into the DB
@@ -1627,6 +2165,108 @@ def subpixel_register_point(pointid,
         print(f'Database update took {t5-t4} seconds.')
     return resultlog
 
+def subpixel_register_points_batch(pointids,
+                                   cost_func=lambda x,y: 1/x**2 * y,
+                                   threshold=0.005,
+                                   ncg=None,
+                                   geom_func='simple',
+                                   match_func='classic',
+                                   match_kwargs={},
+                                   use_cache=False,
+                                   verbose=False,
+                                   chooser='subpixel_register_point',
+                                   n_threads=None,
+                                   **kwargs):
+    """
+    Subpixel register all of the measures of many points to their reference
+    measures.
+
+    This is the batched version of subpixel_register_point. The measures of all of
+    the points are loaded with a single query, each image is opened once and shared
+    by all of the points, and the results are written back with a single bulk
+    update. The points should be spatially coherent, e.g., all of the points in an
+    overlap, so that the images are shared. NetworkCandidateGraph.apply with
+    on='points' and batch_size set passes lists of point ids to this func.
+
+    Parameters
+    ----------
+    pointids : list
+               Of point identifiers in the DB or Points objects
+
+    See subpixel_register_point for the remaining parameters.
+
+    Returns
+    -------
+    resultlog : dict
+                Of the registration status of each measure (as returned by
+                subpixel_register_point) keyed by point id
+    """
+    geom_func=geom_func.lower()
+    match_func=match_func.lower()
+
+    print(f"Using {geom_func} with the {match_func} matcher.")
+
+    match_func = check_match_func(match_func)
+    geom_func = check_geom_func(geom_func)
+
+    if not ncg.Session:
+        raise BrokenPipeError('This func requires a database session from a NetworkCandidateGraph.')
+
+    pointids = [p.id if isinstance(p, Points) else p for p in pointids]
+
+    t1 = time.time()
+    with ncg.session_scope() as session:
+        points = session.query(Points.id, Points.reference_index).filter(Points.id.in_(pointids)).order_by(Points.id).all()
+        measures = session.query(Measures).filter(Measures.pointid.in_(pointids)).order_by(Measures.pointid, Measures.id).all()
+        imageids = set(m.imageid for m in measures)
+        images = session.query(Images.id, Images.path).filter(Images.id.in_(imageids)).all()
+        session.expunge_all()
+    t2 = time.time()
+    print(f'Query took {t2-t1} seconds to find {len(measures)} measures for {len(points)} points on {len(images)} images.')
+
+    # A single node, and therefore a single open GeoDataset, per image
+    nodes = {}
+    for imageid, path in images:
+        nn = NetworkNode(node_id=imageid, image_path=path)
+        nn.parent = ncg
+        nodes[imageid] = nn
+
+    measures_by_point = defaultdict(list)
+    for measure in measures:
+        measures_by_point[measure.pointid].append(measure)
+
+    n_threads = measure_threads(ncg, n_threads)
+    resultlog = {}
+    updated_measures = []
+    for pointid, reference_index in points:
+        point_measures = measures_by_point[pointid]
+        if reference_index is None or reference_index >= len(point_measures):
+            resultlog[pointid] = [{'measureid':None,
+                                   'status':f'Unable to find the reference measure for point {pointid}.'}]
+            continue
+        source = point_measures[reference_index]
+        _reset_reference_measure(source)
+        print(f'Attempting to subpixel register {len(point_measures)-1} measures for point {pointid}')
+        log, updated = _subpixel_register_measures(source, nodes[source.imageid], point_measures,
+                                                   reference_index, nodes,
+                                                   cost_func=cost_func,
+                                                   threshold=threshold,
+                                                   geom_func=geom_func,
+                                                   match_func=match_func,
+                                                   match_kwargs=match_kwargs,
+                                                   verbose=verbose,
+                                                   chooser=chooser,
+                                                   n_threads=n_threads)
+        resultlog[pointid] = log
+        updated_measures.extend(updated)
+        # Once here, update the source measure (possibly back to ignore=False)
+        updated_measures.append(source)
+
+    t3 = time.time()
+    print(f'Registered {len(points)} points in {t3-t2} seconds.')
+    _write_measures(updated_measures, ncg, use_cache=use_cache)
+    return resultlog
+
 def subpixel_register_points(subpixel_template_kwargs={'image_size':(251,251)},
                              cost_kwargs={},
                              threshold=0.005,
@@ -2016,6 +2656,23 @@ def estimate_affine_transformation(base_cube,
     t1 = time.time()
     if not isinstance(input_cube, GeoDataset):
         raise Exception(f"Input cube must be a geodataset obj, but is type {type(input_cube)}.")
+
+    base_corners = _affine_window_corners(base_cube, bcenter_x, bcenter_y, size_x, size_y)
+
+    dst_corners = np.column_stack(spatial.isis.image_to_image(base_cube.file_name,
+                                                              input_cube.file_name,
+                                                              base_corners[:,0],
+                                                              base_corners[:,1]))
+    affine = _affine_from_corners(base_corners, dst_corners)
+    t2 = time.time()
+    print(f'Estimation of the transformation took {t2-t1} seconds.')
+    return affine
+
+def _affine_window_corners(base_cube, bcenter_x, bcenter_y, size_x, size_y):
+    """
+    Return the (5,2) array of corner and center points of the window in
+    the base_cube used to estimate an affine transformation.
+    """
     if not isinstance(base_cube, GeoDataset):
         raise Exception(f"Match cube must be a geodataset obj, but is type {type(base_cube)}.")
 
@@ -2036,46 +2693,237 @@ def estimate_affine_transformation(base_cube,
     if base_starty < 0:
         raise Exception(f"Window: {base_starty} < 0, center: {bcenter_x},{bcenter_y}")
 
-    base_corners = [(base_startx,base_starty),
-                    (base_startx,base_stopy),
-                    (base_stopx,base_stopy),
-                    (base_stopx,base_starty),
-                    (bcenter_x, bcenter_y)]
-    
-    dst_corners = []
-    passing_base_corners = []
-    for x,y in base_corners:
+    return np.array([(base_startx,base_starty),
+                     (base_startx,base_stopy),
+                     (base_stopx,base_stopy),
+                     (base_stopx,base_starty),
+                     (bcenter_x, bcenter_y)], dtype=np.float64)
+
+def _affine_from_corners(base_corners, dst_corners):
+    """
+    Estimate an affine transformation from the subset of (n,2) base and
+    destination corners that projected, i.e., the destination corners that
+    are not NaN.
+    """
+    valid = np.isfinite(dst_corners).all(axis=1)
+    if valid.sum() < 3:
+        raise ValueError(f'Unable to find enough points to compute an affine transformation. Found {valid.sum()} points, but need at least 3.')
+    return tf.estimate_transform('affine', base_corners[valid], dst_corners[valid])
+
+def estimate_affine_transformations(base_cube,
+                                    input_cubes,
+                                    bcenter_x,
+                                    bcenter_y,
+                                    size_x=60,
+                                    size_y=60):
+    """
+    Estimate the affine transformations from a base_cube into many input_cubes,
+    e.g., all of the measures in a point. The corner and center points are
+    projected to the ground with a single campt call on the base_cube and then
+    with a single campt call per input cube.
+
+    Parameters
+    ----------
+    base_cube:  plio.io.io_gdal.GeoDataset
+                source image
+    input_cubes: list
+                 of plio.io.io_gdal.GeoDataset destination images
+    bcenter_x:  int
+                sample location of source measure in base_cube
+    bcenter_y:  int
+                line location of source measure in base_cube
+    size_x:     int
+                half-height of the subimage used in the affine transformation
+    size_y:     int
+                half-width of the subimage used in affine transformation
+
+    Returns
+    -------
+    affines : list
+              of affine transformation objects in the same order as input_cubes.
+              Entries are None where a transformation could not be estimated.
+    """
+    base_corners = _affine_window_corners(base_cube, bcenter_x, bcenter_y, size_x, size_y)
+
+    projected = spatial.isis.image_to_image(base_cube.file_name,
+                                            [c.file_name for c in input_cubes],
+                                            base_corners[:,0],
+                                            base_corners[:,1])
+    affines = []
+    for input_cube, (samples, lines) in zip(input_cubes, projected):
         try:
-            print('Processing: ', x,y)
-            lon, lat = spatial.isis.image_to_ground(base_cube.file_name, x, y)
-            dst_corners.append(
-                spatial.isis.ground_to_image(input_cube.file_name, lon, lat)
-            )
-            passing_base_corners.append((x, y))
-        except Exception as e: 
-            print(e)
+            affines.append(_affine_from_corners(base_corners, np.column_stack((samples, lines))))
+        except ValueError as e:
+            print(f'{input_cube.base_name}: {e}')
+            affines.append(None)
+    return affines
 
-    if len(dst_corners) < 3:
-        raise ValueError(f'Unable to find enough points to compute an affine transformation. Found {len(dst_corners)} points, but need at least 3.')
+def _warp_padding(order):
+    """
+    The number of input pixels read around the footprint of a warped window:
+    the interpolation kernel plus a margin for the spline prefilter of orders
+    above 1, so that the window is interpolated as in the full image.
+    """
+    return order + 1 + 8 * max(order - 1, 0)
 
-    base_gcps = np.array([*passing_base_corners])
+class ImageWindow(object):
+    """
+    A window of an image in the pixel space of a base image. Only the pixels of
+    the window are read and, if an affine transformation is given, warped from
+    the image into the base image space. read_array accepts base image pixel
+    coordinates, so a window can be used with roi.Roi and the subpixel matchers
+    in place of the full (warped) image array. Extents outside of the loaded
+    window are read (and warped) on demand.
+
+    Attributes
+    ----------
+    cube : GeoDataset
+           The image to read
 
-    dst_gcps = np.array([*dst_corners])
+    raster_size : tuple
+                  The (x, y) size of the image in base image pixels
 
-    affine = tf.estimate_transform('affine', np.array([*base_gcps]), np.array([*dst_gcps]))
-    t2 = time.time()
-    print(f'Estimation of the transformation took {t2-t1} seconds.')
-    return affine
+    affine : object
+             A scikit image transformation from base image pixels to cube
+             pixels or None if the cube is the base image
+
+    order : int
+            The order of the interpolation used to warp the window
 
-def affine_warp_image(base_cube, input_cube, affine, order=3):
+    extent : list
+             The [left_x, right_x, top_y, bottom_y] (inclusive) base image
+             extent of the loaded window
+
+    array : ndarray
+            The pixels of the loaded window
+
+    Notes
+    -----
+    A window may be shared between threads (e.g., the reference window of the
+    measures of a point registered concurrently). Extending the window is
+    serialized, so that the cube is only read from one thread at a time.
+    """
+    def __init__(self, cube, raster_size, affine=None, order=3):
+        self.cube = cube
+        self.raster_size = tuple(raster_size)
+        self.affine = affine
+        self.order = order
+        self.dtype = isis.get_cube_info(cube.file_name).dtype
+        self.extent = None
+        self.array = None
+        self._lock = threading.Lock()
+
+    def _clip_extent(self, extent):
+        left_x, right_x, top_y, bottom_y = map(int, extent)
+        return [max(left_x, 0), min(right_x, self.raster_size[0] - 1),
+                max(top_y, 0), min(bottom_y, self.raster_size[1] - 1)]
+
+    def load(self, extent):
+        """
+        Read (and warp) the [left_x, right_x, top_y, bottom_y] (inclusive)
+        base image extent, clipped to the raster.
+        """
+        left_x, right_x, top_y, bottom_y = self._clip_extent(extent)
+        if self.affine is None:
+            pixels = [left_x, top_y, right_x - left_x + 1, bottom_y - top_y + 1]
+            self.array = self.cube.read_array(pixels=pixels, dtype=self.dtype)
+        else:
+            self.array = self._warp(left_x, right_x, top_y, bottom_y)
+        self.extent = [left_x, right_x, top_y, bottom_y]
+
+    def _warp(self, left_x, right_x, top_y, bottom_y):
+        shape = (bottom_y - top_y + 1, right_x - left_x + 1)
+        # The footprint of the window in the cube, padded for the interpolation
+        corners = np.array([[left_x, top_y], [right_x, top_y],
+                            [left_x, bottom_y], [right_x, bottom_y]], dtype=float)
+        footprint = self.affine(corners)
+        pad = _warp_padding(self.order)
+        size_x, size_y = self.cube.raster_size
+        in_left = max(int(np.floor(footprint[:,0].min())) - pad, 0)
+        in_right = min(int(np.ceil(footprint[:,0].max())) + pad, size_x - 1)
+        in_top = max(int(np.floor(footprint[:,1].min())) - pad, 0)
+        in_bottom = min(int(np.ceil(footprint[:,1].max())) + pad, size_y - 1)
+        if in_left > in_right or in_top > in_bottom:
+            # The window is outside of the cube
+            return np.zeros(shape)
+
+        chip = self.cube.read_array(pixels=[in_left, in_top, in_right - in_left + 1, in_bottom - in_top + 1],
+                                    dtype=self.dtype)
+        # Map window pixels to base image pixels, to cube pixels and then to chip pixels
+        matrix = tf.AffineTransform(translation=(-in_left, -in_top)).params @ \
+                 self.affine.params @ \
+                 tf.AffineTransform(translation=(left_x, top_y)).params
+        return tf.warp(chip, tf.ProjectiveTransform(matrix=matrix), output_shape=shape, order=self.order)
+
+    def read_array(self, pixels=None, dtype=None):
+        """
+        Read the [xstart, ystart, xnumberpixels, ynumberpixels] base image
+        pixels, clipped to the raster like slicing an array. If pixels is
+        None, the full raster is read. The dtype is ignored, the pixels have
+        the type of the cube (or of the warp).
+        """
+        if pixels is None:
+            pixels = [0, 0, self.raster_size[0], self.raster_size[1]]
+        x, y, nx, ny = map(int, pixels)
+        left_x, right_x, top_y, bottom_y = self._clip_extent([x, x + nx - 1, y, y + ny - 1])
+        with self._lock:
+            self._extend([left_x, right_x, top_y, bottom_y])
+            array = self.array
+            l, r, t, b = self.extent
+        return array[top_y-t:bottom_y-t+1, left_x-l:right_x-l+1].copy()
+
+    def extend(self, extent):
+        """
+        Load the [left_x, right_x, top_y, bottom_y] (inclusive) base image
+        extent if it is not inside of the loaded window, growing the window
+        to cover both.
+        """
+        with self._lock:
+            self._extend(self._clip_extent(extent))
+
+    def _extend(self, extent):
+        left_x, right_x, top_y, bottom_y = extent
+        if self.extent is None:
+            self.load(extent)
+            return
+        l, r, t, b = self.extent
+        if left_x < l or right_x > r or top_y < t or bottom_y > b:
+            # Grow the window to cover the requested extent
+            self.load([min(left_x, l), max(right_x, r), min(top_y, t), max(bottom_y, b)])
+
+def parameter_window(parameters):
+    """
+    The largest (size_x, size_y) half window of a list of parameter sets, i.e.,
+    the largest image, template or (phase) size in the match_kwargs.
+    """
+    size_x = size_y = 0
+    for parameter in parameters:
+        for key in ('image_size', 'template_size', 'size'):
+            size = parameter['match_kwargs'].get(key)
+            if size is not None:
+                size_x = max(size_x, size[0])
+                size_y = max(size_y, size[1])
+    return size_x, size_y
+
+def affine_warp_image(base_cube, input_cube, affine, order=3, center=None, size=None):
     """
     Given a base image, an input image, and an affine transformation, return
     the base image and the affine transformed input image.
-    
+
+    If a center and size are given, only the window of the base image around
+    the center and the footprint of that window in the input image (padded for
+    the interpolation) are read, and only that chip is warped. The images are
+    then returned as ImageWindow objects, which are read with the same base
+    image pixel coordinates as the arrays (e.g., by roi.Roi and the subpixel
+    matchers).
+
     Parameters
     ----------
-    base_cube : GeoDataset
-                The base dataset that the affine transformation transforms to
+    base_cube : GeoDataset or ImageWindow
+                The base dataset that the affine transformation transforms to.
+                If a center is given, this may also be an ImageWindow of the
+                base image, e.g., shared by the measures of a point, which is
+                extended to the window and returned.
 
     input_cube : GeoDataset
                  The cube to be transformed using the affine transformation
@@ -2087,21 +2935,46 @@ def affine_warp_image(base_cube, input_cube, affine, order=3):
             The order of the transformation to apply. Default is a 3rd (3) order 
             polynomial.
 
+    center : tuple
+             The (x, y) base image pixel at the center of the window. If None
+             (default), the full images are read and warped.
+
+    size : tuple
+           The (size_x, size_y) half size of the window in pixels, e.g., the
+           largest image size of the parameter sets (see parameter_window)
+
     Returns
     -------
-    base_arr : np.array()
+    base_arr : np.array() or ImageWindow
               Original base image array
 
-    dst_arr : np.array()
+    dst_arr : np.array() or ImageWindow
               The destination array transformed into base image's space
     """
     t1 = time.time()
+    if center is not None:
+        x, y = int(center[0]), int(center[1])
+        extent = [x - size[0], x + size[0], y - size[1], y + size[1]]
+        if isinstance(base_cube, ImageWindow):
+            base_arr = base_cube
+            base_arr.extend(extent)
+        else:
+            base_arr = ImageWindow(base_cube, base_cube.raster_size)
+            base_arr.load(extent)
+        # The warped array covers the larger of the two images
+        raster_size = np.maximum(base_cube.raster_size, input_cube.raster_size)
+        dst_arr = ImageWindow(input_cube, raster_size, affine=affine, order=order)
+        dst_arr.load(extent)
+        t2 = time.time()
+        print(f'Affine warp took {t2-t1} seconds.')
+        return base_arr, dst_arr
+
     # read_array not getting correct type by default
 
-    base_type = isis.isis2np_types[pvl.load(base_cube.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
+    base_type = isis.get_cube_info(base_cube.file_name).dtype
     base_arr = base_cube.read_array(dtype=base_type)
 
-    dst_type = isis.isis2np_types[pvl.load(input_cube.file_name)["IsisCube"]["Core"]["Pixels"]["Type"]]
+    dst_type = isis.get_cube_info(input_cube.file_name).dtype
     dst_arr = input_cube.read_array(dtype=dst_type)
 
     box = (0, 0, max(dst_arr.shape[1], base_arr.shape[1]), max(dst_arr.shape[0], base_arr.shape[0]))
@@ -2113,13 +2986,228 @@ def affine_warp_image(base_cube, input_cube, affine, order=3):
 
     return base_arr, dst_arr
 
+class SubpixelSweep(object):
+    """
+    The search and template chips of one measure for a sweep over parameter
+    sets.
+
+    The chips of the largest parameter set (see parameter_window) are clipped
+    from the search (source) and template (destination) images and converted
+    to float32 once. The ROIs of every parameter set and of the metrics are
+    views into the chips, or are clipped from the images if they extend past a
+    chip. The integral images of both chips are computed once, and the template
+    variance and the normalization of the normalized cross correlation are
+    computed from them for every parameter set.
+
+    Attributes
+    ----------
+    s_img : ndarray or object
+            The search image, e.g., the ImageWindow of the reference image
+
+    d_img : ndarray or object
+            The template image, e.g., the warped ImageWindow of the image of
+            the measure
+
+    sx, sy : float
+             The center of the search ROIs in the search image
+
+    dx, dy : float
+             The center of the template ROIs in the template image
+
+    search : ndarray
+             The float32 search chip
+
+    template : ndarray
+               The float32 template chip
+
+    affine : object
+             The transformation from the template image pixels to the pixels of
+             the image of the measure, if the template image was warped
+
+    reference : tuple
+                The (x, y) of the reference measure, used to validate the
+                registration (see validate_candidate_measure)
+    """
+    def __init__(self, s_img, d_img, sx, sy, dx, dy, parameters, affine=None, reference=None):
+        self.s_img = s_img
+        self.d_img = d_img
+        self.sx = sx
+        self.sy = sy
+        self.dx = dx
+        self.dy = dy
+        self.affine = affine
+        self.reference = reference
+
+        size_x, size_y = parameter_window(parameters)
+        self.search, self._search_origin = self._clip(s_img, sx, sy, size_x, size_y)
+        self.template, self._template_origin = self._clip(d_img, dx, dy, size_x, size_y)
+        self._integrals = {'search':cv2.integral2(self.search.astype(np.float64), sdepth=cv2.CV_64F,
+                                                  sqdepth=cv2.CV_64F),
+                           'template':cv2.integral2(self.template.astype(np.float64), sdepth=cv2.CV_64F,
+                                                    sqdepth=cv2.CV_64F)}
+
+    @staticmethod
+    def _clip(data, x, y, size_x, size_y):
+        r = roi.Roi(data, x, y, size_x=int(size_x), size_y=int(size_y))
+        left_x, _, top_y, _ = r.image_extent
+        return img_as_float32(r.clip()), (left_x, top_y)
+
+    def _data(self, which):
+        if which == 'search':
+            return self.s_img, self.search, self._search_origin
+        return self.d_img, self.template, self._template_origin
+
+    def _locate(self, which, x, y, size_x, size_y):
+        """
+        The (top, bottom, left, right) slice of the ROI in the chip or None if
+        the ROI extends past the chip.
+        """
+        data, chip, (chip_left, chip_top) = self._data(which)
+        r = roi.Roi(data, x, y, size_x=size_x, size_y=size_y)
+        left_x, right_x, top_y, bottom_y = r.image_extent
+        try:
+            raster_size = data.raster_size
+        except AttributeError:
+            raster_size = data.shape[::-1]
+        # The ROI is clipped to the raster when it is read
+        right_x = min(right_x, raster_size[0] - 1)
+        bottom_y = min(bottom_y, raster_size[1] - 1)
+        if left_x < chip_left or top_y < chip_top or \
+           right_x >= chip_left + chip.shape[1] or bottom_y >= chip_top + chip.shape[0]:
+            return None
+        return top_y - chip_top, bottom_y - chip_top + 1, left_x - chip_left, right_x - chip_left + 1
+
+    def roi(self, which, x, y, size_x, size_y):
+        """
+        The float32 ROI of the 'search' or 'template' image at (x, y), as
+        roi.Roi(img, x, y, size_x, size_y).clip(), i.e., a view into the chip if
+        the ROI is inside of it.
+        """
+        loc = self._locate(which, x, y, size_x, size_y)
+        if loc is None:
+            data, _, _ = self._data(which)
+            return img_as_float32(roi.Roi(data, x, y, size_x=size_x, size_y=size_y).clip())
+        top, bottom, left, right = loc
+        return self._data(which)[1][top:bottom, left:right]
+
+    def _box_sums(self, which, top, left, ny, nx, height, width):
+        """
+        The sums and the sums of squares of the height by width windows with
+        their upper left corners at the ny by nx pixels from (top, left) of
+        the chip.
+        """
+        sums = []
+        for integral in self._integrals[which]:
+            sums.append(integral[top+height:top+height+ny, left+width:left+width+nx] -
+                        integral[top:top+ny, left+width:left+width+nx] -
+                        integral[top+height:top+height+ny, left:left+nx] +
+                        integral[top:top+ny, left:left+nx])
+        return sums
+
+    def variance(self, which, x, y, size_x, size_y):
+        """
+        The variance of the ROI of the 'search' or 'template' image at (x, y).
+        """
+        loc = self._locate(which, x, y, size_x, size_y)
+        if loc is None:
+            return np.var(self.roi(which, x, y, size_x, size_y))
+        top, bottom, left, right = loc
+        n = (bottom - top) * (right - left)
+        total, squares = self._box_sums(which, top, left, 1, 1, bottom - top, right - left)
+        return max(squares[0, 0] / n - (total[0, 0] / n) ** 2, 0)
+
+    def ncc(self, image_size, template_size):
+        """
+        The normalized cross correlation (cv2.TM_CCOEFF_NORMED) surface of the
+        template ROI in the search ROI of one parameter set. The template mean,
+        the template norm and the means and norms of the search windows are
+        computed from the integral images of the chips.
+
+        Returns
+        -------
+        result : ndarray
+                 The float32 correlation surface or None if a ROI extends past
+                 its chip
+        """
+        s_loc = self._locate('search', self.sx, self.sy, *image_size)
+        t_loc = self._locate('template', self.dx, self.dy, *template_size)
+        if s_loc is None or t_loc is None:
+            return None
+        s_top, s_bottom, s_left, s_right = s_loc
+        t_top, t_bottom, t_left, t_right = t_loc
+        height, width = t_bottom - t_top, t_right - t_left
+        ny, nx = s_bottom - s_top - height + 1, s_right - s_left - width + 1
+        if ny < 1 or nx < 1:
+            return None
+        n = height * width
+
+        template = self.template[t_top:t_bottom, t_left:t_right]
+        t_sum, t_squares = self._box_sums('template', t_top, t_left, 1, 1, height, width)
+        template = template - np.float32(t_sum[0, 0] / n)
+        t_norm = max(t_squares[0, 0] - t_sum[0, 0] ** 2 / n, 0)
+
+        # The template has a zero mean, so correlating it with the search
+        # windows (instead of the zero mean windows) gives the numerator
+        image = self.search[s_top:s_bottom, s_left:s_right]
+        numerator = cv2.matchTemplate(image, template, method=cv2.TM_CCORR)
+        s_sums, s_squares = self._box_sums('search', s_top, s_left, ny, nx, height, width)
+        denominator = np.sqrt(np.maximum(s_squares - s_sums ** 2 / n, 0) * t_norm)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = np.where(denominator > 0, numerator / denominator, 0)
+        return np.clip(result, -1, 1).astype(np.float32)
+
+    def match(self, match_func, **match_kwargs):
+        """
+        Register the template to the search image with one parameter set.
+
+        subpixel_template_classic is applied to the views of the chips. For
+        func=pattern_match_fft with the default (cv2.TM_CCOEFF_NORMED) metric
+        the correlation surface is computed by ncc. Other matchers are called
+        with the images, i.e., match_func(sx, sy, dx, dy, s_img, d_img,
+        **match_kwargs).
+
+        Returns
+        -------
+        x, y : float
+               The registered template position in the template image
+
+        strength : float
+                   The strength of the match
+
+        corrmap : ndarray
+                  The correlation surface
+        """
+        if match_func is not subpixel_template_classic:
+            return match_func(self.sx, self.sy, self.dx, self.dy, self.s_img, self.d_img, **match_kwargs)
+
+        kwargs = dict(match_kwargs)
+        image_size = check_image_size(kwargs.pop('image_size', (251, 251)))
+        template_size = check_image_size(kwargs.pop('template_size', (51, 51)))
+        func = kwargs.pop('func', pattern_match)
+
+        if self.variance('template', self.dx, self.dy, *template_size) == 0:
+            warnings.warn('Input ROI has no variance.')
+            return [None] * 4
+
+        s_image = self.roi('search', self.sx, self.sy, *image_size)
+        d_template = self.roi('template', self.dx, self.dy, *template_size)
+        if func is pattern_match_fft and kwargs.get('metric', cv2.TM_CCOEFF_NORMED) == cv2.TM_CCOEFF_NORMED:
+            kwargs['result'] = self.ncc(image_size, template_size)
+
+        shift_x, shift_y, metrics, corrmap = func(d_template, s_image, **kwargs)
+        if shift_x is None:
+            return None, None, None, None
+        return self.dx - shift_x, self.dy - shift_y, metrics, corrmap
+
 def subpixel_register_point_smart(pointid,
                             cost_func=lambda x,y: 1/x**2 * y,
                             ncg=None,
                             geom_func='simple',
                             match_func='classic',
                             parameters=[],
-                            chooser='subpixel_register_point_smart'):
+                            chooser='subpixel_register_point_smart',
+                            sweeps=None,
+                            n_threads=None):
 
     """
     Given some point, subpixel register all of the measures in the point to the
@@ -2154,6 +3242,19 @@ def subpixel_register_point_smart(pointid,
                  {'match_kwargs': {'image_size':(121,121), 'template_size':(61,61)}},
                  {'match_kwargs': {'image_size':(151,151), 'template_size':(67,67)}},
                  {'match_kwargs': {'image_size':(181,181), 'template_size':(73,73)}}]
+
+    sweeps : dict
+             If not None, the SubpixelSweep of every registered measure is
+             added to the dict, keyed on the measure id, so that the
+             registration can be validated from the same chips (see
+             validate_candidate_measure)
+
+    n_threads : int
+                The number of measures registered at once in a thread pool,
+                against the shared window of the reference image. If None
+                (default), the measure_threads key in the cluster section of the
+                ncg config is used, see measure_threads. The results are
+                collected in the order of the measures.
     """
     
     geom_func=geom_func.lower()
@@ -2207,14 +3308,32 @@ def subpixel_register_point_smart(pointid,
     source_node = nodes[reference_index_id]
     
     print(f'Source: sample: {source.sample} | line: {source.line}')
-    resultlog = []
-    updated_measures = []
-    for i, measure in enumerate(measures):
-        
-        # If this is the reference node, do not attempt to match it.
-        if i == reference_index:
-            continue
 
+    # Estimate all of the transformations for the point at once so that the
+    # reference window is projected to the ground a single time.
+    try:
+        affines = estimate_affine_transformations(source_node.geodata,
+                                                  [nodes[m.imageid].geodata for m in measures],
+                                                  source.apriorisample,
+                                                  source.aprioriline)
+    except Exception as e:
+        print(e)
+        affines = [None] * len(measures)
+
+    # The window of the reference image is read once and shared by all of the
+    # measures; each measure reads the image through its own dataset
+    to_register = [(i, measure) for i, measure in enumerate(measures) if i != reference_index]
+    n_threads = measure_threads(ncg, n_threads)
+    threaded = n_threads > 1 and len(to_register) > 1
+    source_window = ImageWindow(source_node.geodata, source_node.geodata.raster_size)
+
+    def register(item):
+        """
+        Register a single measure with all of the parameter sets and return
+        the [baseline_mi, baseline_corr, measure] entries of the measure.
+        """
+        i, measure = item
+        entries = []
         print()
         print(f'Measure: {measure}')
         currentlog = {'measureid':measure.id,
@@ -2227,24 +3346,22 @@ def subpixel_register_point_smart(pointid,
         print('geom_func', geom_func)
         
         # Apply the transformation
-        try:
-            affine = estimate_affine_transformation(source_node.geodata, 
-                                                        destination_node.geodata,
-                                                        source.apriorisample, 
-                                                        source.aprioriline)
-        except Exception as e:
-            print(e) 
+        affine = affines[i]
+        if affine is None:
             m = {'id': measure.id,
                  'sample':measure.apriorisample,
                  'line':measure.aprioriline,
                  'status':False,
                  'choosername':chooser}
-            updated_measures.append([None, None, m])
-            continue
+            entries.append([None, None, m])
+            return entries
         
-        base_arr, dst_arr = affine_warp_image(source_node.geodata, 
-                                              destination_node.geodata, 
-                                              affine)
+        # Warp only the window needed by the largest parameter set
+        base_arr, dst_arr = affine_warp_image(source_window,
+                                              _thread_geodata(destination_node, threaded),
+                                              affine,
+                                              center=(source.apriorisample, source.aprioriline),
+                                              size=parameter_window(parameters))
             
         # Compute the baseline metrics using the smallest window
         size_x = np.inf
@@ -2256,27 +3373,33 @@ def subpixel_register_point_smart(pointid,
             if match_kwarg['template_size'][1] < size_y:
                 size_y = match_kwarg['template_size'][1]
         
-        base_roi = roi.Roi(base_arr, source.apriorisample, source.aprioriline, size_x=size_x, size_y=size_y).clip()
-        dst_roi = roi.Roi(dst_arr, source.apriorisample, source.aprioriline, size_x=size_x, size_y=size_y).clip()
+        # Clip the chips of the largest parameter set once, the ROIs of every
+        # parameter set are views into them
+        sweep = SubpixelSweep(base_arr, dst_arr,
+                              source.apriorisample, source.aprioriline,
+                              source.apriorisample, source.aprioriline,
+                              parameters, affine=affine, reference=(source.sample, source.line))
+        if sweeps is not None:
+            sweeps[measure.id] = sweep
+
+        base_roi = sweep.roi('search', source.apriorisample, source.aprioriline, size_x, size_y)
+        dst_roi = sweep.roi('template', source.apriorisample, source.aprioriline, size_x, size_y)
 
         if np.isnan(base_roi).any() or np.isnan(dst_roi).any():
             print('Unable to process due to NaN values in the input data.')
             m = {'id': measure.id,
                     'status': False,
                     'choosername': chooser}
-            updated_measures.append([None, None, m])
-            continue
+            entries.append([None, None, m])
+            return entries
         
         if base_roi.shape != dst_roi.shape:
             print('Unable to process. ROIs are different sizes for MI matcher')
             m = {'id': measure.id,
                  'status': False,
                  'choosername': chooser}
-            updated_measures.append([None, None, m])
-            continue
-
-        base_roi = img_as_float32(base_roi)
-        dst_roi = img_as_float32(dst_roi)
+            entries.append([None, None, m])
+            return entries
 
         baseline_mi = mutual_information(base_roi, dst_roi)
         
@@ -2288,7 +3411,7 @@ def subpixel_register_point_smart(pointid,
         for parameter in parameters:
             match_kwargs = parameter['match_kwargs']
 
-            restemplate = match_func(source.apriorisample, source.aprioriline, source.apriorisample, source.aprioriline, base_arr, dst_arr, **match_kwargs)
+            restemplate = sweep.match(match_func, **match_kwargs)
  
             try: 
                 x,y,maxcorr,temp_corrmap = restemplate
@@ -2302,12 +3425,8 @@ def subpixel_register_point_smart(pointid,
                 print('Unable to match with this parameter set.')
                 continue
                
-            base_roi = roi.Roi(base_arr, source.apriorisample, source.aprioriline, size_x=size_x, size_y=size_y).clip()
-            dst_roi = roi.Roi(dst_arr, x, y, size_x=size_x, size_y=size_y).clip()
-
-            #TODO: When refactored, all this type conversion should happen in the ROI object.
-            base_roi = img_as_float32(base_roi)
-            dst_roi = img_as_float32(dst_roi)
+            # The base ROI is the baseline ROI
+            dst_roi = sweep.roi('template', x, y, size_x, size_y)
 
             mi_metric = mutual_information(base_roi, dst_roi)
 
@@ -2332,7 +3451,13 @@ def subpixel_register_point_smart(pointid,
                     'status': True}
                 print(f'METRIC: {metric}| SAMPLE: {new_x} | LINE: {new_y} | MI: {mi_metric}')
 
-            updated_measures.append([baseline_mi, baseline_corr, m])
+            entries.append([baseline_mi, baseline_corr, m])
+
+        return entries
+
+    updated_measures = []
+    for entries in _map_measures(register, to_register, n_threads=n_threads if threaded else 1):
+        updated_measures.extend(entries)
 
     # Baseline MI, Baseline Correlation, updated measures to select from
     return updated_measures
@@ -2463,6 +3588,7 @@ def validate_candidate_measure(measure_to_register,
                             geom_func='simple',
                             match_func='classic',
                             parameters=[],
+                            sweep=None,
                             **kwargs):
     """
     Compute the matching distances, matching the reference measure to the measure
@@ -2470,6 +3596,17 @@ def validate_candidate_measure(measure_to_register,
     In other words, the first registration registers A->B to find measure_to_register (B-naught).
     This func then matches B->A (B-prime) and computes the distance between B-naught and B-prime.
 
+    If the SubpixelSweep of the registration is passed, the inverse match is
+    computed in the reference image space from the reference and warped
+    windows of the registration, i.e., without estimating a new transformation
+    or reading and warping the images again. This is cheaper, but the check is
+    less independent of the registration: it reuses the transformation and
+    the warp of the registration, so an error in them is not caught here, and
+    the distances can differ slightly from those of the full check when the
+    transformation is not a pure translation. If a ROI of the inverse match
+    extends past its image (i.e., it would be clipped to a different shape
+    than in the full check), the full check is run instead.
+
     Parameters
     ----------
     measure_to_register : dict
@@ -2489,6 +3626,11 @@ def validate_candidate_measure(measure_to_register,
                  a subpixel registration attempt and then set of these results is
                  used ot ientify inliner and outlier parameter sets.
 
+    sweep : SubpixelSweep
+            The sweep of the registration of the measure (see the sweeps
+            argument of subpixel_register_point_smart). If None (default), the
+            images are read from the database and warped again.
+
     Returns
     -------
     dists : list
@@ -2502,6 +3644,11 @@ def validate_candidate_measure(measure_to_register,
     match_func = check_match_func(match_func)
     geom_func = check_geom_func(geom_func)
 
+    if sweep is not None:
+        dists = _validate_from_sweep(measure_to_register, sweep, match_func, parameters)
+        if dists is not None:
+            return dists
+
     if not ncg.Session:
         raise BrokenPipeError('This func requires a database session from a NetworkCandidateGraph.')
     
@@ -2544,7 +3691,9 @@ def validate_candidate_measure(measure_to_register,
             return [np.inf] * len(parameters)
         base_arr, dst_arr = affine_warp_image(source_node.geodata, 
                                                   destination_node.geodata, 
-                                                  affine)
+                                                  affine,
+                                                  center=(sample, line),
+                                                  size=parameter_window(parameters))
 
         dists = []
         for parameter in parameters:
@@ -2571,6 +3720,55 @@ def validate_candidate_measure(measure_to_register,
             dists.append(dist)
         return dists
 
+def _roi_clipped(data, x, y, size_x, size_y):
+    """
+    True if roi.Roi(data, x, y, size_x, size_y) extends past the image, i.e.,
+    if its clip is smaller than requested.
+    """
+    try:
+        raster_size = data.raster_size
+    except AttributeError:
+        raster_size = data.shape[::-1]
+    x, y = floor(x), floor(y)
+    return x - size_x < 0 or y - size_y < 0 or \
+           x + size_x > raster_size[0] or y + size_y > raster_size[1]
+
+def _validate_from_sweep(measure_to_register, sweep, match_func, parameters):
+    """
+    The inverse match of validate_candidate_measure in the reference image
+    space. The measure_to_register is transformed back to the warped window and
+    the reference window is matched to the warped window there, which gives the
+    position of the reference measure directly.
+
+    Returns None if a ROI of the inverse match, or of the full check in the
+    image of the measure, would be clipped.
+    """
+    sample, line = measure_to_register['sample'], measure_to_register['line']
+    x, y = sweep.affine.inverse([sample, line])[0]
+    measure_image = getattr(sweep.d_img, 'cube', sweep.d_img)
+    for parameter in parameters:
+        image_size = check_image_size(parameter['match_kwargs'].get('image_size', (251, 251)))
+        template_size = check_image_size(parameter['match_kwargs'].get('template_size', (51, 51)))
+        if _roi_clipped(sweep.d_img, x, y, *image_size) or \
+           _roi_clipped(sweep.s_img, x, y, *template_size) or \
+           _roi_clipped(measure_image, sample, line, *image_size):
+            print('The validation ROIs extend past the image, validating from the images.')
+            return None
+
+    print(f"Validating measure: {measure_to_register['id']} from the registration windows")
+    inverse = SubpixelSweep(sweep.d_img, sweep.s_img, x, y, x, y, parameters)
+
+    dists = []
+    for parameter in parameters:
+        restemplate = inverse.match(match_func, **parameter['match_kwargs'])
+        new_x, new_y = restemplate[:2]
+        if new_x is None or new_y is None:
+            continue
+        dist = np.sqrt((new_y - sweep.reference[1]) ** 2 + (new_x - sweep.reference[0]) ** 2)
+        print('Reprojection Distance: ', dist)
+        dists.append(dist)
+    return dists
+
 def smart_register_point(pointid, parameters=[], shared_kwargs={}, ncg=None, Session=None):    
     """
     The entry func for the smart subpixel registration code. This is the user 
@@ -2612,7 +3810,8 @@ def smart_register_point(pointid, parameters=[], shared_kwargs={}, ncg=None, Ses
                             building approach
     
     """
-    measure_results = subpixel_register_point_smart(pointid, ncg=ncg, parameters=parameters, **shared_kwargs)
+    sweeps = {}
+    measure_results = subpixel_register_point_smart(pointid, ncg=ncg, parameters=parameters, sweeps=sweeps, **shared_kwargs)
     measures_to_update, measures_to_set_false = decider(measure_results)
 
     print()
@@ -2620,7 +3819,8 @@ def smart_register_point(pointid, parameters=[], shared_kwargs={}, ncg=None, Ses
     # Validate that the new position has consensus
     for measure in measures_to_update:
         print()
-        reprojection_distances = validate_candidate_measure(measure, parameters=parameters, ncg=ncg, **shared_kwargs)
+        reprojection_distances = validate_candidate_measure(measure, parameters=parameters, ncg=ncg,
+                                                            sweep=sweeps.get(measure['id']), **shared_kwargs)
         if np.sum(np.array(reprojection_distances) < 1) < 2:
         #if reprojection_distance > 1:
             print(f"Measure {measure['id']} failed validation. Setting ignore=True for this measure.")
@@ -174,3 +174,63 @@ def test_ciratefi(template, search, cifi_thresh, rafi_thresh, tefi_thresh, alpha
 
     assert len(results) == 3
     assert (np.array(results[1], results[0]) < 1).all()
+
+@pytest.mark.parametrize("radii", [[1, 2], [1, 3, 5, 8]])
+def test_ring_sums(search, radii):
+    sums = ciratefi._ring_sums(search, radii)
+    for y, x in [(0, 0), (10, 10), (21, 21), (42, 30)]:
+        for k, r in enumerate(radii):
+            mask = ciratefi.circ_mask(search.shape, (y, x), r)
+            assert sums[y, x, k] == pytest.approx(np.sum(search[mask]))
+
+@pytest.mark.parametrize("a, b", [([1, 2, 3], [1, 2, 3]),
+                                  ([1, 2, 3], [3, 2, 1]),
+                                  ([1, 2, -math.inf], [1, 2, 3]),
+                                  ([0, 0, 0], [1, 2, 3])])
+def test_normed_ccorr(a, b):
+    import cv2
+    expected = cv2.matchTemplate(np.float32(a)[None], np.float32(b)[None], cv2.TM_CCORR_NORMED)[0, 0]
+    a = np.float64(a)
+    b = np.float64(b)
+    with np.errstate(invalid='ignore'):
+        score = ciratefi._normed_ccorr(np.sum(a * b), np.linalg.norm(a) * np.linalg.norm(b))
+    assert score == expected
+
+@pytest.mark.filterwarnings('ignore::UserWarning')
+def test_tefi_no_upsampling(template, search):
+    tefi_pixels = np.array([(21, 21)])
+    tefi_scales = np.ones(search.shape, dtype=float)
+    tefi_angles = [3.14159265]
+
+    x, y, strength = ciratefi.tefi(template, search, tefi_pixels, tefi_scales, tefi_angles,
+                                   thresh=tefi_thresh, use_percentile=True, alpha=math.pi/2,
+                                   upsampling=1)
+    assert (x, y) == (0.5, 0.5)
+    # The candidate pixels are not modified in place
+    assert (tefi_pixels == [(21, 21)]).all()
+
+@pytest.mark.parametrize("center", [(0, 0), (5, 7), (10, 10), (20, 3)])
+@pytest.mark.parametrize("radius", [1, 3, 5])
+def test_masks_match_polar_grid(center, radius):
+    shape = (21, 21)
+    r2, theta = ciratefi.to_polar_coord(shape, center)
+    np.testing.assert_array_equal(ciratefi.circ_mask(shape, center, radius),
+                                  r2 == radius * radius)
+    for alpha in np.arange(0, 2*math.pi, math.pi/8):
+        expected = (r2 <= radius**2) * np.isclose(theta, [alpha], atol=.01)
+        np.testing.assert_array_equal(ciratefi.radial_line_mask(shape, center, radius, alpha=alpha),
+                                      expected)
+
+def test_kernel_cache_info():
+    ciratefi.clear_kernel_cache()
+    for center in [(5, 5), (6, 6), (7, 7)]:
+        ciratefi.circ_mask((21, 21), center, 3)
+    info = ciratefi.kernel_cache_info()
+    assert info['circle'].misses == 1
+    assert info['circle'].hits == 2
+    assert info['circle'].hit_rate == pytest.approx(2/3)
+
+def test_polar_grid_is_read_only():
+    r2, theta = ciratefi.to_polar_coord((5, 5), (2, 2))
+    with pytest.raises(ValueError):
+        r2[0, 0] = 1
@@ -85,3 +85,138 @@ sys.path.append(os.path.abspath('..'))
 
     def tearDown(self):
         pass"""
+
+
+def test_flann_query_arrays():
+    import numpy as np
+    rng = np.random.default_rng(0)
+    train = rng.random((50, 8), dtype=np.float32)
+    fmatcher = cpu_matcher.FlannMatcher()
+    fmatcher.add(train, 0, index=np.arange(50) + 100)
+    fmatcher.train()
+
+    query = train[:5] + 0.001
+    matched = fmatcher.query_arrays(query, 1, k=2, index=[10, 11, 12, 13, 14])
+    assert set(matched.keys()) == set(cpu_matcher.MATCH_COLUMNS)
+    assert len(matched['distance']) == 10
+    # The train image has the smaller id so it is the source
+    assert (matched['source_image'] == 0).all()
+    assert (matched['destination_image'] == 1).all()
+    np.testing.assert_array_equal(matched['source_idx'][::2], np.arange(5) + 100)
+    np.testing.assert_array_equal(matched['destination_idx'][::2], np.arange(10, 15))
+
+    df = fmatcher.query(query, 1, k=2, index=[10, 11, 12, 13, 14])
+    assert list(df.columns) == cpu_matcher.MATCH_COLUMNS
+    assert (df.dtypes == np.float32).all()
+    np.testing.assert_array_equal(df['source_idx'].values, matched['source_idx'])
+
+def test_flann_query_self_neighbor():
+    import numpy as np
+    descriptors = np.random.default_rng(0).random((10, 8), dtype=np.float32)
+    fmatcher = cpu_matcher.FlannMatcher()
+    fmatcher.add(descriptors, 0)
+    fmatcher.train()
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        df = fmatcher.query(descriptors, 0, k=2)
+    assert df.empty
+    assert w[0].category == UserWarning
+
+class IndexedNode(dict):
+    def __init__(self, node_id, descriptors, keypoint_file=None):
+        self['node_id'] = node_id
+        self.descriptors = descriptors
+        self.keypoint_file = keypoint_file
+
+def clustered_descriptors(seed, n=20):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centers = rng.random((n, 16), dtype=np.float32) * 10
+    return (centers + rng.random((n, 16), dtype=np.float32)).astype(np.float32)
+
+def test_flann_index_cache_reuse():
+    import numpy as np
+    cache = cpu_matcher.FlannIndexCache()
+    a = IndexedNode(0, clustered_descriptors(0))
+    b = IndexedNode(1, a.descriptors[::-1] + 0.01)
+    c = IndexedNode(2, a.descriptors[:10] + 0.01)
+
+    matched = cache.query_arrays(a, b, k=2)
+    cache.query_arrays(a, c, k=2)
+    assert cache.info().misses == 1
+    assert cache.info().hits == 1
+
+    # Same neighbors as a matcher trained for the single query
+    fmatcher = cpu_matcher.FlannMatcher()
+    fmatcher.add(a.descriptors, 0)
+    fmatcher.train()
+    expected = fmatcher.query_arrays(b.descriptors, 1, k=2)
+    for column in cpu_matcher.MATCH_COLUMNS:
+        assert matched[column].shape == (40,)
+        np.testing.assert_allclose(matched[column], expected[column], rtol=1e-5)
+
+    # A subset of the descriptors is a different index
+    subset = cache.query_arrays(a, b, k=1, aidx=np.arange(5, 15))
+    assert cache.info().misses == 2
+    np.testing.assert_array_equal(subset['source_idx'][10:15], np.arange(9, 4, -1))
+
+def test_flann_index_cache_eviction():
+    nodes = [IndexedNode(i, clustered_descriptors(i)) for i in range(3)]
+    cache = cpu_matcher.FlannIndexCache()
+    cache.max_bytes = cache.get(nodes[0]).nbytes * 2
+    for node in nodes[1:]:
+        cache.get(node)
+    info = cache.info()
+    assert info.evictions == 1
+    assert info.currsize == 2
+    assert info.nbytes <= info.max_bytes
+    # The least recently used index was dropped
+    cache.get(nodes[0])
+    assert cache.info().misses == 4
+
+def test_flann_index_cache_persist(tmp_path):
+    import numpy as np
+    node = IndexedNode(0, clustered_descriptors(0), keypoint_file=str(tmp_path / 'image.h5'))
+    query = IndexedNode(1, node.descriptors + 0.01)
+    cache = cpu_matcher.FlannIndexCache(persist=True)
+    expected = cache.query_arrays(node, query, k=2)
+    assert len(list(tmp_path.glob('image_*.flann'))) == 1
+
+    # A new cache (e.g., in another process) reads the index instead of training it
+    cache = cpu_matcher.FlannIndexCache(persist=True)
+    matched = cache.query_arrays(node, query, k=2)
+    assert cache.info().loads == 1
+    np.testing.assert_array_equal(matched['source_idx'], expected['source_idx'])
+
+class OverlapEdge(object):
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+
+    def get_keypoints(self, node, overlap=False):
+        import pandas as pd
+        return pd.DataFrame(index=range(len(node.descriptors)))
+
+def test_match_joint():
+    import numpy as np
+    a = IndexedNode(0, clustered_descriptors(0))
+    b = IndexedNode(1, a.descriptors[::-1] + 0.01)
+    c = IndexedNode(2, a.descriptors[:10] + 0.01)
+    edges = [OverlapEdge(a, b), OverlapEdge(a, c)]
+
+    # Query the descriptors of b and c against both images at once
+    ab, ac = cpu_matcher.match_joint(a, edges, k=1)
+    assert (ab['source_image'] == 0).all() and (ab['destination_image'] == 1).all()
+    assert (ac['source_image'] == 0).all() and (ac['destination_image'] == 2).all()
+    # At most one nearest neighbor per query descriptor and image. Descriptors
+    # without a counterpart in c can have both searched neighbors in b.
+    assert len(ab['source_idx']) == 20
+    assert len(ac['source_idx']) <= 20
+    np.testing.assert_array_equal(ab['destination_idx'], np.arange(19, -1, -1))
+    np.testing.assert_array_equal(ac['destination_idx'][:10], np.arange(10))
+
+    # The node is the source of the edges, so the rows are oriented
+    ba, = cpu_matcher.match_joint(b, [edges[0]], k=2)
+    assert (ba['source_image'] == 0).all()
+    np.testing.assert_array_equal(ba['destination_idx'][::2], np.arange(20))
+    np.testing.assert_array_equal(ba['source_idx'][::2], np.arange(19, -1, -1))
@@ -32,3 +32,28 @@ def test_mutual_information():
     assert max_corr == 2.9755967600033015
     assert corr_map.shape == (51, 51)
     assert np.min(corr_map) >= 0.0
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.float32, np.float64])
+@pytest.mark.parametrize("template_shape, bins", [((11, 11), 10), ((9, 13), 7)])
+def test_mutual_information_map(dtype, template_shape, bins):
+    rng = np.random.default_rng(0)
+    # Few distinct values so that window ranges repeat and values fall on bin edges
+    s_image = rng.integers(0, 40, (31, 29)).astype(dtype)
+    s_image[10:20] = rng.integers(0, 255, (10, 29))
+    d_template = s_image[5:5+template_shape[0], 7:7+template_shape[1]].copy()
+
+    corr_map = mutual_information.mutual_information_map(d_template, s_image, bins=bins)
+    assert corr_map.shape == (31 - template_shape[0] + 1, 29 - template_shape[1] + 1)
+    for i, j in np.ndindex(corr_map.shape):
+        sub_image = s_image[i:i+template_shape[0], j:j+template_shape[1]]
+        assert corr_map[i, j] == mutual_information.mutual_information(sub_image, d_template, bins=bins)
+
+def test_mutual_information_match_func():
+    rng = np.random.default_rng(0)
+    s_image = rng.random((40, 40))
+    d_template = s_image[12:27, 10:25].copy()
+    batched = mutual_information.mutual_information_match(d_template, s_image)
+    looped = mutual_information.mutual_information_match(d_template, s_image,
+                                                         func=mutual_information.mutual_information)
+    assert batched[:3] == looped[:3]
+    np.testing.assert_array_equal(batched[3], looped[3])
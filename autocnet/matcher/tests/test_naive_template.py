@@ -35,7 +35,10 @@ class TestNaiveTemplateAutoReg(unittest.TestCase):
         np.testing.assert_almost_equal(result_x, 0.167124, decimal=5)
         np.testing.assert_almost_equal(result_y, -1.170976, decimal=5)
 
-class TestNaiveTemplate(unittest.TestCase):
+class NaiveTemplateFixtures:
+    """
+    The search image and templates shared by the pattern matcher tests.
+    """
 
     def setUp(self):
         # Center is (5, 6)
@@ -75,6 +78,8 @@ class TestNaiveTemplate(unittest.TestCase):
                                      (0, 1, 0),
                                      (0, 1, 0)), dtype=np.uint8)
 
+class TestNaiveTemplate(NaiveTemplateFixtures, unittest.TestCase):
+
     def test_t_shape(self):
         result_x, result_y, result_strength, _ = naive_template.pattern_match(self._t_shape,
                                                                            self._test_image, upsampling=1)
@@ -114,3 +119,44 @@ class TestNaiveTemplate(unittest.TestCase):
     def tearDown(self):
         pass
 
+
+class TestPatternMatchFFT(NaiveTemplateFixtures, unittest.TestCase):
+
+    def _match(self, template):
+        return naive_template.pattern_match_fft(template, self._test_image, refine=None)
+
+    def test_integer_shifts(self):
+        for template, expected in [(self._t_shape, (-3, -3)),
+                                   (self._rect_shape, (3, 4)),
+                                   (self._square_shape, (-2, 4)),
+                                   (self._vertical_line, (3, -5))]:
+            result_x, result_y, result_strength, _ = self._match(template)
+            self.assertEqual((result_x, result_y), expected)
+            self.assertGreaterEqual(result_strength, 0.8)
+
+@pytest.fixture
+def shifted_pair():
+    from scipy.ndimage import shift
+    from skimage import data
+    image = data.camera().astype(float)
+    # The template content is found at (-1.3, 2.6) from the center of the search image
+    shifted = shift(image, (-2.6, 1.3), order=3)
+    return shifted[231:282, 231:282].astype(np.uint8), image[196:317, 196:317].astype(np.uint8)
+
+@pytest.mark.parametrize("refine", ['quadratic', 'upsample'])
+def test_pattern_match_fft_subpixel(shifted_pair, refine):
+    template, image = shifted_pair
+    x, y, strength, corrmap = naive_template.pattern_match_fft(template, image, refine=refine)
+    ux, uy, ustrength, _ = naive_template.pattern_match(template, image)
+
+    # At least as accurate as the fully upsampled matcher
+    assert abs(x + 1.3) <= max(abs(ux + 1.3), 0.1)
+    assert abs(y - 2.6) <= max(abs(uy - 2.6), 0.1)
+    assert strength == pytest.approx(ustrength, abs=0.01)
+    # The correlation surface is at native resolution
+    assert corrmap.shape == (image.shape[0] - template.shape[0] + 1,
+                             image.shape[1] - template.shape[1] + 1)
+
+def test_pattern_match_fft_refine():
+    with pytest.raises(ValueError):
+        naive_template.pattern_match_fft(np.ones((3,3), dtype=np.uint8), np.ones((9,9), dtype=np.uint8), refine='foo')
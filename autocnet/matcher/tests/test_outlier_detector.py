@@ -33,6 +33,22 @@ class TestOutlierDetector(unittest.TestCase):
         mask = cpu_outlier_detector.distance_ratio(None, df, ratio=0.9)
         self.assertTrue(mask.all() == False)
 
+    def test_distance_ratio_mask(self):
+        source_idx = np.array([0, 0, 1, 1, 2, 2, 2, 3])
+        destination_idx = np.array([3, 4, 5, 6, 7, 8, 9, 10])
+        distance = np.array([1.25, 10.1, 2.3, 2.4, 1.2, 5.5, 5.7, 1.0])
+        mask = cpu_outlier_detector.distance_ratio_mask(source_idx, destination_idx, distance, ratio=0.8)
+        np.testing.assert_array_equal(mask, [True, False, False, False, True, False, False, False])
+        mask = cpu_outlier_detector.distance_ratio_mask(source_idx, destination_idx, distance,
+                                                        ratio=0.8, single=True)
+        self.assertTrue(mask[-1])
+
+    def test_lowe_ratio_mask_row_order(self):
+        # Groups are compared in row order, not sorted by distance
+        mask = cpu_outlier_detector.lowe_ratio_mask(np.array([1, 0, 1, 0]),
+                                                    np.array([5., 1., 1., 5.]), ratio=0.8)
+        np.testing.assert_array_equal(mask, [False, True, False, False])
+
     def test_mirroring_test(self):
         # returned mask should be same length as input df
         df = pd.DataFrame(np.array([[0, 0, 0, 1, 1, 1],
@@ -98,3 +114,11 @@ class testSuppressionRanges(unittest.TestCase):
         with pytest.warns(UserWarning):
             mask, k = cpu_outlier_detector.spatial_suppression(df, (0, 0, 100, 100), k = 15, xkey='x', ykey='y')
         self.assertEqual(len(df[mask]), 17)
+
+
+def test_first_occupants():
+    # Points are ordered best to worst; the 2nd and 4th share cells with better points
+    x = np.array([1, 1.2, 8, 8.5, -1])
+    y = np.array([1, 1.1, 8, 8.2, 1])
+    first = cpu_outlier_detector._first_occupants(x, y, 0, 10, 0, 10, 3, 3)
+    np.testing.assert_array_equal(first, [0, 2, 4])
@@ -1,8 +1,10 @@
 import math
 import os
 import sys
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from skimage import transform as tf
 from skimage.util import img_as_float   
@@ -11,6 +13,7 @@ from skimage import data
 
 import pytest
 
+import cv2
 import numpy as np
 from imageio import imread
 
@@ -189,6 +192,56 @@ def test_iterative_phase(apollo_subsets, convergence_threshold, expected):
         # for i in range(len(strength)):
         assert pytest.approx(strength,6) == expected[2]
 
+@pytest.mark.parametrize("upsample_factor", [1, 10])
+@pytest.mark.parametrize("normalization", ['phase', None])
+def test_phase_cross_correlation_stack(upsample_factor, normalization):
+    from scipy import ndimage
+    from skimage.registration import phase_cross_correlation
+    image = img_as_float(data.camera())
+    references = []
+    moving = []
+    for i, shift in enumerate([(0, 0), (2.5, -1.25), (-3.3, 0.7)]):
+        shifted = ndimage.shift(image, shift, order=3)
+        y = x = 200 + 50 * i
+        references.append(image[y-25:y+26, x-25:x+26])
+        moving.append(shifted[y-25:y+26, x-25:x+26])
+
+    shifts, errors, phasediffs = sp.phase_cross_correlation_stack(np.stack(references),
+                                                                  np.stack(moving),
+                                                                  upsample_factor=upsample_factor,
+                                                                  normalization=normalization)
+    for i, (reference, mov) in enumerate(zip(references, moving)):
+        shift, error, phasediff = phase_cross_correlation(reference, mov,
+                                                          upsample_factor=upsample_factor,
+                                                          normalization=normalization)
+        np.testing.assert_allclose(shifts[i], shift)
+        assert errors[i] == pytest.approx(error)
+        assert phasediffs[i] == pytest.approx(phasediff, abs=1e-12)
+
+def test_phase_cross_correlation_stack_shape_mismatch():
+    with pytest.raises(ValueError):
+        sp.phase_cross_correlation_stack(np.zeros((2, 5, 5)), np.zeros((2, 7, 7)))
+
+def test_iterative_phase_stack(apollo_subsets):
+    a = apollo_subsets[0]
+    b = apollo_subsets[1]
+    sx = [a.shape[1]/2, a.shape[1]/2 + 5]
+    sy = [a.shape[0]/2, a.shape[0]/2 - 5]
+    dx = [b.shape[1]/2, b.shape[1]/2 + 5]
+    dy = [b.shape[1]/2, b.shape[1]/2 - 5]
+    new_x, new_y, errors = sp.iterative_phase_stack(sx, sy, dx, dy, a, b,
+                                                    size=(51,51),
+                                                    convergence_threshold=2.0,
+                                                    upsample_factor=100)
+    for i in range(len(sx)):
+        x, y, error = sp.iterative_phase(sx[i], sy[i], dx[i], dy[i], a, b,
+                                         size=(51,51),
+                                         convergence_threshold=2.0,
+                                         upsample_factor=100)
+        assert new_x[i] == pytest.approx(x)
+        assert new_y[i] == pytest.approx(y)
+        assert errors[i] == pytest.approx(error)
+
 @pytest.mark.parametrize("data, expected", [
     ((21,21), (10, 10)),
     ((20,20), (10,10))
@@ -278,3 +331,227 @@ def test_subpixel_phase_cooked(x, y, x1, y1, image_size, expected):
     assert dy == expected[1]
 
 
+
+def test_subpixel_register_points_batch():
+    from unittest.mock import MagicMock
+    from autocnet.io.db.model import Measures, Points, Images
+
+    # Two points with two measures each, sharing two images
+    measures = [Measures(id=i, pointid=p, imageid=img, sample=10, line=10,
+                         apriorisample=10, aprioriline=10, serial='')
+                for i, (p, img) in enumerate([(1, 1), (1, 2), (2, 1), (2, 2)])]
+    rows = {Points.id:[(1, 0), (2, 1)],
+            Measures:measures,
+            Images.id:[(1, '/foo.cub'), (2, '/bar.cub')]}
+
+    session = MagicMock()
+    def query(*args):
+        q = MagicMock()
+        q.filter.return_value.order_by.return_value.all.return_value = rows[args[0]]
+        q.filter.return_value.all.return_value = rows[args[0]]
+        return q
+    session.query.side_effect = query
+    ncg = MagicMock()
+    ncg.session_scope.return_value.__enter__.return_value = session
+
+    def geom_func(base, dst, x, y, **kwargs):
+        return x + 1, y + 1, 1, 0.9, None
+
+    with patch('autocnet.matcher.subpixel.check_geom_func', return_value=geom_func), \
+         patch('autocnet.matcher.subpixel.NetworkNode') as node, \
+         patch('autocnet.matcher.subpixel._write_measures') as write:
+        res = sp.subpixel_register_points_batch([1, 2], ncg=ncg, threshold=0.1)
+
+    # One query for each of points, measures, and images and one node per image
+    assert session.query.call_count == 3
+    assert node.call_count == 2
+    assert list(res.keys()) == [1, 2]
+    assert 'Success' in res[1][0]['status']
+    assert measures[1].sample == 11
+    assert measures[2].sample == 11
+
+    # All of the measures are written back at once
+    write.assert_called_once()
+    assert len(write.call_args[0][0]) == 4
+
+class ArrayCube(object):
+    def __init__(self, arr):
+        self.arr = arr
+        self.file_name = 'image.cub'
+        self.raster_size = (arr.shape[1], arr.shape[0])
+
+    def read_array(self, pixels=None, dtype=None):
+        if pixels is None:
+            return self.arr.copy()
+        x, y, nx, ny = pixels
+        return self.arr[y:y+ny, x:x+nx].copy()
+
+@pytest.mark.parametrize("center", [(140, 150), (10, 12), (270, 290)])
+def test_affine_warp_image_window(center):
+    rng = np.random.default_rng(0)
+    base = ArrayCube(rng.random((300, 280)).astype(np.float32))
+    dst = ArrayCube(rng.random((260, 320)).astype(np.float32))
+    affine = tf.AffineTransform(rotation=0.1, scale=(1.05, 0.97), translation=(12, -7))
+
+    with patch('autocnet.matcher.subpixel.isis.get_cube_info') as info:
+        info.return_value.dtype = None
+        base_arr, dst_arr = sp.affine_warp_image(base, dst, affine)
+        base_window, dst_window = sp.affine_warp_image(base, dst, affine, center=center, size=(20, 25))
+
+        x, y = center
+        # The loaded window and a larger extent that is read (and warped) on demand
+        for pixels in [[x-20, y-25, 41, 51], [x-40, y-30, 81, 61]]:
+            left, top, nx, ny = pixels
+            expected = dst_arr[max(top, 0):top+ny, max(left, 0):left+nx]
+            np.testing.assert_allclose(dst_window.read_array(pixels=pixels), expected, atol=1e-3)
+            np.testing.assert_array_equal(base_window.read_array(pixels=pixels),
+                                          base_arr[max(top, 0):top+ny, max(left, 0):left+nx])
+
+def test_parameter_window():
+    parameters = [{'match_kwargs': {'image_size': (39, 39), 'template_size': (21, 21)}},
+                  {'match_kwargs': {'image_size': (61, 45), 'template_size': (31, 31)}},
+                  {'match_kwargs': {'size': (71, 11)}}]
+    assert sp.parameter_window(parameters) == (71, 45)
+
+@pytest.fixture
+def sweep_parameters():
+    return [{'match_kwargs': {'image_size': (41, 41), 'template_size': (21, 21)}},
+            {'match_kwargs': {'image_size': (61, 61), 'template_size': (31, 31)}}]
+
+@pytest.mark.parametrize("center", [(256.3, 250.7), (20, 30), (500, 505)])
+def test_subpixel_sweep_views(center, sweep_parameters):
+    image = data.camera()
+    x, y = center
+    sweep = sp.SubpixelSweep(image, image, x, y, x + 4, y - 3, sweep_parameters)
+    for size in [(10, 5), (30, 30), (100, 100)]:
+        expected = sp.img_as_float32(sp.roi.Roi(image, x, y, *size).clip())
+        np.testing.assert_array_equal(sweep.roi('search', x, y, *size), expected)
+        assert sweep.variance('search', x, y, *size) == pytest.approx(np.var(expected.astype(float)))
+
+@pytest.mark.parametrize("center", [(256.3, 250.7), (20, 30)])
+def test_subpixel_sweep_match(center, sweep_parameters):
+    image = data.camera()
+    shifted = np.roll(image, (3, -2), axis=(0, 1))
+    x, y = center
+    sweep = sp.SubpixelSweep(image, shifted, x, y, x, y, sweep_parameters)
+    for parameter in sweep_parameters:
+        kwargs = dict(parameter['match_kwargs'], func=lambda t, s: sp.pattern_match(t, s, upsampling=2))
+        res = sweep.match(sp.subpixel_template_classic, **kwargs)
+        expected = sp.subpixel_template_classic(x, y, x, y, image, shifted, **kwargs)
+        assert res[:3] == expected[:3]
+        np.testing.assert_array_equal(res[3], expected[3])
+
+        # The normalization of the correlation is computed from the integral images
+        image_size = sp.check_image_size(parameter['match_kwargs']['image_size'])
+        template_size = sp.check_image_size(parameter['match_kwargs']['template_size'])
+        expected = cv2.matchTemplate(sweep.roi('search', x, y, *image_size),
+                                     sweep.roi('template', x, y, *template_size),
+                                     method=cv2.TM_CCOEFF_NORMED)
+        np.testing.assert_allclose(sweep.ncc(image_size, template_size), expected, atol=1e-2)
+
+def test_validate_candidate_measure_sweep(sweep_parameters):
+    image = data.camera()
+    shifted = np.roll(image, (3, -2), axis=(0, 1))
+    sweep = sp.SubpixelSweep(image, shifted, 256, 250, 256, 250, sweep_parameters,
+                             affine=tf.AffineTransform(), reference=(256, 250))
+    parameters = [{'match_kwargs': dict(p['match_kwargs'], func=sp.pattern_match_fft)} for p in sweep_parameters]
+    x, y, _, _ = sweep.match(sp.subpixel_template_classic, **parameters[0]['match_kwargs'])
+    assert (x, y) == pytest.approx((254, 253), abs=0.1)
+
+    dists = sp.validate_candidate_measure({'id': 1, 'sample': x, 'line': y}, ncg=None,
+                                          parameters=parameters, sweep=sweep)
+    assert len(dists) == 2
+    assert np.all(np.array(dists) < 0.5)
+
+@pytest.mark.parametrize("reference", [(256, 250),
+                                       # The ROIs extend past the registration windows
+                                       (300, 290),
+                                       # The ROIs extend past the images
+                                       (12, 10), (509, 506)])
+def test_validate_candidate_measure_sweep_parity(reference, sweep_parameters):
+    ref_image = data.camera().astype(np.float32)
+    images = {1: ArrayCube(ref_image), 2: ArrayCube(np.roll(ref_image, (-3, 5), axis=(0, 1)))}
+    affine = tf.AffineTransform(translation=(5, -3))
+    parameters = [{'match_kwargs': dict(p['match_kwargs'], func=sp.pattern_match_fft)} for p in sweep_parameters]
+    apriori = (256, 250) if reference == (300, 290) else reference
+
+    # The candidate is off from the true position by half a pixel
+    sample, line = affine([reference])[0] + [0.4, -0.3]
+    measure_to_register = {'id': 1, 'sample': sample, 'line': line}
+
+    reference_measure = MagicMock(sample=reference[0], line=reference[1], imageid=1)
+    measure = MagicMock(imageid=2)
+    measure.point.reference_index = 0
+    measure.point.measures = [reference_measure]
+    session = MagicMock()
+    session.query.return_value.filter.return_value.order_by.return_value.one.return_value = measure
+    ncg = MagicMock()
+    ncg.session_scope.return_value.__enter__.return_value = session
+
+    with patch('autocnet.matcher.subpixel.isis.get_cube_info') as info, \
+         patch('autocnet.matcher.subpixel.NetworkNode', side_effect=lambda node_id, image_path: MagicMock(geodata=images[node_id])), \
+         patch('autocnet.matcher.subpixel.estimate_affine_transformation', return_value=affine.inverse):
+        info.return_value.dtype = None
+        base_window, dst_window = sp.affine_warp_image(images[1], images[2], affine, center=apriori,
+                                                       size=sp.parameter_window(parameters))
+        sweep = sp.SubpixelSweep(base_window, dst_window, *apriori, *apriori, parameters,
+                                 affine=affine, reference=reference)
+
+        expected = sp.validate_candidate_measure(measure_to_register, ncg=ncg, parameters=parameters)
+        dists = sp.validate_candidate_measure(measure_to_register, ncg=ncg, parameters=parameters, sweep=sweep)
+    assert len(dists) == len(expected) == 2
+    np.testing.assert_allclose(dists, expected, atol=1e-3)
+
+def test_map_measures_order_and_bound():
+    lock = threading.Lock()
+    running = [0, 0]
+    def func(i):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01 * (5 - i % 5))
+        with lock:
+            running[0] -= 1
+        return i * 2
+    res = sp._map_measures(func, list(range(10)), n_threads=3)
+    assert res == [i * 2 for i in range(10)]
+    assert 1 < running[1] <= 3
+
+@pytest.mark.parametrize("config, n_threads, expected", [
+    (None, None, 1),
+    ({'cluster': {}}, None, 1),
+    ({'cluster': {'measure_threads': 4}}, None, 4),
+    ({'cluster': {'measure_threads': 4}}, 2, 2),
+    (None, 0, 1)])
+def test_measure_threads(config, n_threads, expected):
+    ncg = None
+    if config is not None:
+        ncg = unittest.mock.MagicMock(config=config)
+    assert sp.measure_threads(ncg, n_threads) == expected
+
+@pytest.mark.parametrize("n_threads", [1, 3])
+def test_subpixel_register_measures_threaded(n_threads):
+    def geom_func(base_cube, input_cube, x, y, **kwargs):
+        time.sleep(0.01)
+        shift = int(input_cube.split('_')[1])
+        return x + shift, y - shift, shift, 0.9, None
+
+    class Node(dict):
+        @property
+        def geodata(self):
+            return self['image_path']
+
+    nodes = {i: Node(image_path=f'image_{i}') for i in range(6)}
+    measures = [unittest.mock.MagicMock(id=i, imageid=i, weight=None, apriorisample=10, aprioriline=20)
+                for i in range(6)]
+    source = measures[0]
+    with patch('autocnet.matcher.subpixel.GeoDataset', side_effect=lambda path: path):
+        log, updated = sp._subpixel_register_measures(source, nodes[0], measures, 0, nodes,
+                                                      cost_func=lambda x, y: x * y,
+                                                      geom_func=geom_func,
+                                                      n_threads=n_threads)
+    assert [m.id for m in updated] == [1, 2, 3, 4, 5]
+    assert [l['measureid'] for l in log] == [1, 2, 3, 4, 5]
+    for m in updated:
+        assert (m.sample, m.line) == (10 + m.id, 20 - m.id)
+        assert m.weight == pytest.approx(0.9 * m.id)
@@ -11,8 +11,12 @@ coordinates."""
 # SPDX-License-Identifier: CC0-1.0
 
 import os
-from collections import abc
+import threading
+from collections import abc, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from numbers import Number
+from subprocess import CalledProcessError
 
 import numpy as np
 
@@ -116,12 +120,190 @@ def get_nodata_bounds(arr):
     return left_x, right_x, top_y, bottom_y
 
 
+#: Number of threads in the per-process pool used to run ISIS transformations
+#: concurrently. ISIS applications release the GIL while the subprocess runs.
+ISIS_WORKERS = min(8, os.cpu_count() or 1)
+
+_worker_pool = None
+_cube_pool = None
+_worker_thread = threading.local()
+
+
+def _mark_worker_thread():
+    _worker_thread.active = True
+
+
+def _get_worker_pool():
+    """
+    Returns the long-lived, per-process thread pool used to run
+    independent ISIS transformations (e.g., one mappt call per point)
+    concurrently. The pool is created lazily on first use and reused for
+    the life of the process. Tasks on this pool must not wait on other
+    tasks of the pool.
+    """
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = ThreadPoolExecutor(max_workers=ISIS_WORKERS,
+                                          initializer=_mark_worker_thread)
+    return _worker_pool
+
+
+def _get_cube_pool():
+    """
+    Returns the long-lived, per-process thread pool used to transform
+    into several cubes concurrently (one point_info call per cube). This
+    is separate from the worker pool because point_info on a projected
+    cube waits on mappt tasks submitted to the worker pool; sharing one
+    pool would deadlock once every thread waits on queued inner tasks.
+    """
+    global _cube_pool
+    if _cube_pool is None:
+        _cube_pool = ThreadPoolExecutor(max_workers=ISIS_WORKERS)
+    return _cube_pool
+
+
+def _reset_worker_pool():
+    # Threads do not survive a fork, so a child process needs its own pools.
+    global _worker_pool, _cube_pool
+    _worker_pool = None
+    _cube_pool = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_worker_pool)
+
+
+CubeInfo = namedtuple("CubeInfo", ["label", "dtype", "raster_size", "special_pixels"])
+CubeInfo.__doc__ = """
+The information that is read from an ISIS cube label.
+
+label : pvl.PVLModule
+        The parsed label
+
+dtype : str
+        The numpy dtype of the pixels or None if the Pixels Type is unknown
+
+raster_size : tuple
+              (samples, lines, bands) or None if the label has no Dimensions
+
+special_pixels : object
+                 The kalasiris special pixel values (Null, Lrs, Lis, His, Hrs)
+                 for the pixel type or None if they are unavailable
+"""
+
+
+@lru_cache(maxsize=256)
+def _load_cube_info(cube_path, mtime):
+    label = pvl.load(cube_path)
+    core = label.get("IsisCube", {}).get("Core", {})
+
+    isis_type = core.get("Pixels", {}).get("Type")
+    dtype = isis2np_types.get(isis_type)
+
+    dimensions = core.get("Dimensions")
+    raster_size = None
+    if dimensions:
+        raster_size = (dimensions["Samples"], dimensions["Lines"], dimensions["Bands"])
+
+    try:
+        special_pixels = getattr(isis.specialpixels, isis_type)
+    except Exception:
+        special_pixels = None
+
+    return CubeInfo(label, dtype, raster_size, special_pixels)
+
+
+def get_cube_info(cube_path: os.PathLike):
+    """
+    Returns the CubeInfo (parsed label, numpy dtype, raster size and
+    special pixel values) of *cube_path*. The information is cached per
+    process in an LRU cache keyed on the path and modification time of
+    the file, so a cube that is rewritten on disk is parsed again. Use
+    cube_info_cache_info() to get the hit and miss counters.
+
+    Parameters
+    ----------
+    cube_path : os.PathLike
+                Path to the input cube.
+
+    Returns
+    -------
+     : CubeInfo
+       The cached information for the cube
+    """
+    cube_path = os.path.abspath(os.fspath(cube_path))
+    return _load_cube_info(cube_path, os.path.getmtime(cube_path))
+
+
+def cube_info_cache_info():
+    """
+    Returns the (hits, misses, maxsize, currsize) statistics of the
+    process-wide cube label cache.
+    """
+    return _load_cube_info.cache_info()
+
+
+def get_label(cube_path: os.PathLike):
+    """
+    Returns the parsed PVL label of *cube_path* from the cube label
+    cache, see get_cube_info().
+    """
+    return get_cube_info(cube_path).label
+
+
+def get_dtype(cube_path):
+    """
+    Returns the numpy dtype of the pixels in *cube_path* from the cube
+    label cache, see get_cube_info(). Returns None if the label can not
+    be read, e.g., *cube_path* is not an ISIS cube.
+    """
+    try:
+        return get_cube_info(cube_path).dtype
+    except Exception:
+        return None
+
+
+def is_projected(cube_path: os.PathLike):
+    """
+    Returns True if *cube_path* has a Mapping group, i.e., is a map
+    projected cube that must be transformed with mappt instead of campt.
+    The decision is made from the cached label, see get_cube_info().
+    """
+    return bool(get_label(cube_path).get("IsisCube").get("Mapping"))
+
+
+def _mappt(cube_path, x, y, point_type, allowoutside, strict):
+    """
+    Run mappt on a single point and convert the results to PLIO pixels.
+    Returns None if the point fails and *strict* is False.
+    """
+    if point_type == "ground":
+        mappt_args = dict(longitude=x, latitude=y, coordsys="UNIVERSAL")
+    else:
+        # Convert PLIO pixels to ISIS pixels
+        mappt_args = dict(sample=x+0.5, line=y+0.5)
+    mappt_args.update(allowoutside=allowoutside, type=point_type)
+
+    try:
+        mapres = pvl.loads(isis.mappt(cube_path, **mappt_args).stdout)["Results"]
+    except CalledProcessError:
+        if strict:
+            raise
+        return None
+
+    # convert from ISIS pixels to PLIO pixels
+    mapres['Sample'] = mapres['Sample'] - 0.5
+    mapres['Line'] = mapres['Line'] - 0.5
+    return mapres
+
+
 def point_info(
         cube_path: os.PathLike,
         x,
         y,
         point_type: str,
-        allowoutside=False
+        allowoutside=False,
+        strict=True
 ):
     """
     Returns a pvl.collections.MutableMappingSequence object or a
@@ -162,6 +344,12 @@ def point_info(
                   or mappt.  Please read the ISIS documentation to
                   learn more about this parameter.
 
+    strict: bool
+            Defaults to True, in which case any point that ISIS is unable
+            to transform raises.  If False, a None is placed in the
+            returned Sequence for each point that fails so that a batch of
+            points can be transformed in a single call.
+
     """
     point_type = point_type.casefold()
     valid_types = {"image", "ground"}
@@ -200,32 +388,16 @@ def point_info(
         )
 
     results = []
-    if pvl.load(cube_path).get("IsisCube").get("Mapping"):
-        # We have a projected image, and must use mappt
-        mappt_common_args = dict(allowoutside=allowoutside, type=point_type)
-
-        for xx, yy in zip(x_coords, y_coords):
-            mappt_args = {
-                "ground": dict(
-                    longitude=xx,
-                    latitude=yy,
-                    coordsys="UNIVERSAL"
-                ),
-                "image": dict(
-                    # Convert PLIO pixels to ISIS pixels
-                    sample=xx+0.5,
-                    line=yy+0.5
-                )
-            }
-            for k in mappt_args.keys():
-                mappt_args[k].update(mappt_common_args)
-            mapres = pvl.loads(isis.mappt(cube_path, **mappt_args[point_type]).stdout)["Results"]
-            
-            # convert from ISIS pixels to PLIO pixels
-            mapres['Sample'] = mapres['Sample'] - 0.5
-            mapres['Line'] = mapres['Line'] - 0.5
-
-            results.append(mapres)
+    if is_projected(cube_path):
+        # We have a projected image, and must use mappt. mappt transforms one
+        # point per invocation, so the invocations are spread over the
+        # persistent worker pool, unless this already runs on a thread of
+        # that pool, which must not wait on the pool.
+        mapper = map if getattr(_worker_thread, "active", False) else _get_worker_pool().map
+        results = list(mapper(
+            lambda xy: _mappt(cube_path, xy[0], xy[1], point_type, allowoutside, strict),
+            zip(x_coords, y_coords)
+        ))
     else:
         # Not projected, use campt
         if point_type == "ground":
@@ -254,6 +426,8 @@ def point_info(
                 r["Sample"] -= .5
                 r["Line"] -= .5
                 results.append(r)
+            elif not strict:
+                results.append(None)
             else:
                 raise ValueError(
                     f"ISIS campt completed, but reported an error: {r['Error']}"
@@ -368,3 +542,93 @@ def ground_to_image(cube_path, lon, lat):
     return samples, lines
 
 
+
+
+def image_to_image(
+        from_cube: os.PathLike,
+        to_cube,
+        sample,
+        line,
+        lontype="PositiveEast360Longitude",
+        lattype="PlanetocentricLatitude",
+):
+    """
+    Returns a two-tuple of numpy arrays, where the first element of the
+    tuple is the sample(s) and the second element are the line(s) in
+    *to_cube* of the input *sample* and *line* in *from_cube*.
+
+    All of the points are transformed with a single call to point_info()
+    per cube, i.e., one campt (or mappt) invocation into ground space and
+    one back into image space, instead of one pair of calls per point.
+    If *to_cube* is a Sequence of paths, the ground coordinates are computed
+    once and then projected into each cube concurrently on the cube pool,
+    and a list of two-tuples is returned in the same order as *to_cube*.
+    This is useful for projecting a reference window into all of the images
+    in a point.
+
+    Points that fail to project in either cube are returned as NaN so that
+    the caller can decide how many failures are acceptable.
+
+    Raises the same exceptions as point_info() if ISIS fails outright.
+
+    Parameters
+    ----------
+    from_cube : os.PathLike
+                Path to the cube that *sample* and *line* are defined in.
+
+    to_cube : os.PathLike or Sequence of os.PathLike
+              Path(s) to the cube(s) that the points are projected into.
+
+    sample : Number, Sequence of Numbers, or Numpy Array
+        Sample coordinate(s) in *from_cube*.
+
+    line : Number, Sequence of Numbers, or Numpy Array
+        Line coordinate(s) in *from_cube*.
+
+    lontype: str
+        Name of key to query in the campt or mappt return to get the
+        intermediate longitudes. Please see the campt or mappt documentation.
+
+    lattype: str
+        Name of key to query in the campt or mappt return to get the
+        intermediate latitudes. Please see the campt or mappt documentation.
+
+    Returns
+    -------
+    samples : ndarray
+              (n,) array of samples in *to_cube*
+
+    lines : ndarray
+            (n,) array of lines in *to_cube*
+    """
+    sample = np.atleast_1d(np.asarray(sample, dtype=np.float64))
+    line = np.atleast_1d(np.asarray(line, dtype=np.float64))
+
+    lons = np.full(sample.shape, np.nan)
+    lats = np.full(sample.shape, np.nan)
+    res = point_info(from_cube, sample, line, "image", strict=False)
+    for i, r in enumerate(res):
+        if r is None:
+            continue
+        lons[i] = _get_value(r[lontype])
+        lats[i] = _get_value(r[lattype])
+    projected = np.flatnonzero(np.isfinite(lons) & np.isfinite(lats))
+
+    def _to_image(cube):
+        samples = np.full(sample.shape, np.nan)
+        lines = np.full(sample.shape, np.nan)
+        if len(projected):
+            res = point_info(cube, lons[projected], lats[projected], "ground", strict=False)
+            for i, r in zip(projected, res):
+                if r is None:
+                    continue
+                samples[i] = r["Sample"]
+                lines[i] = r["Line"]
+        return samples, lines
+
+    if isinstance(to_cube, (str, os.PathLike)):
+        return _to_image(to_cube)
+
+    # The campt calls into each cube are independent of one another. They
+    # run on the cube pool, mappt calls go to the worker pool.
+    return list(_get_cube_pool().map(_to_image, to_cube))
@@ -9,8 +9,13 @@
 # SPDX-License-Identifier: CC0-1.0
 
 import contextlib
+import os
+import tempfile
+import threading
 import unittest
 from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
 
 import numpy as np
 import numpy.testing as npt
@@ -58,6 +63,153 @@ class TestErrors(unittest.TestCase):
             "image"
         )
 
+class TestImageToImage(unittest.TestCase):
+
+    @staticmethod
+    def fake_point_info(cube_path, x, y, point_type, strict=True):
+        # Ground is image space shifted by 100 in both directions and
+        # the point at x=-1 does not project.
+        res = []
+        for xx, yy in zip(x, y):
+            if xx < 0:
+                res.append(None)
+            elif point_type == "image":
+                res.append({"PositiveEast360Longitude": xx + 100,
+                            "PlanetocentricLatitude": yy + 100})
+            else:
+                res.append({"Sample": xx - 100 + len(cube_path),
+                            "Line": yy - 100 + len(cube_path)})
+        return res
+
+    def test_image_to_image(self):
+        with patch.object(si, "point_info", side_effect=self.fake_point_info) as pi:
+            samples, lines = si.image_to_image(
+                "a.cub", "bb.cub", np.array([1., -1., 3.]), np.array([4., 5., 6.])
+            )
+        # One call per cube, regardless of the number of points.
+        self.assertEqual(2, pi.call_count)
+        npt.assert_array_equal(np.array([7., np.nan, 9.]), samples)
+        npt.assert_array_equal(np.array([10., np.nan, 12.]), lines)
+
+    def test_image_to_many_images(self):
+        with patch.object(si, "point_info", side_effect=self.fake_point_info) as pi:
+            res = si.image_to_image(
+                "a.cub", ["b.cub", "ccc.cub"], [1, 2], [3, 4]
+            )
+        self.assertEqual(3, pi.call_count)
+        self.assertEqual(2, len(res))
+        npt.assert_array_equal(np.array([6., 7.]), res[0][0])
+        npt.assert_array_equal(np.array([10., 11.]), res[1][1])
+
+    def test_image_to_many_projected_images(self):
+        # point_info on a projected cube waits on tasks of the worker pool,
+        # so more cubes than workers must not deadlock.
+        def pooled_point_info(cube_path, x, y, point_type, strict=True):
+            return list(si._get_worker_pool().map(
+                lambda xy: self.fake_point_info(cube_path, [xy[0]], [xy[1]], point_type)[0],
+                zip(x, y)
+            ))
+
+        cubes = ["b.cub"] * (si.ISIS_WORKERS + 2)
+        res = []
+        with patch.object(si, "point_info", side_effect=pooled_point_info):
+            thread = threading.Thread(
+                target=lambda: res.extend(si.image_to_image("a.cub", cubes, [1, 2], [3, 4])),
+                daemon=True
+            )
+            thread.start()
+            thread.join(timeout=30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(cubes), len(res))
+
+    def test_mappt_on_worker_thread_is_serial(self):
+        # A point_info call from a worker pool thread does not wait on the pool
+        threads = set()
+        def mappt(cube_path, x, y, *args):
+            threads.add(threading.get_ident())
+            return {"Sample": x, "Line": y}
+
+        with patch.object(si, "is_projected", return_value=True), \
+                patch.object(si, "_mappt", side_effect=mappt):
+            future = si._get_worker_pool().submit(
+                lambda: (threading.get_ident(), si.point_info("a.cub", [1, 2, 3], [4, 5, 6], "ground"))
+            )
+            ident, res = future.result(timeout=30)
+        self.assertEqual({ident}, threads)
+        self.assertEqual(3, len(res))
+
+class TestLabelCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.NamedTemporaryFile("w", suffix=".cub", delete=False)
+        tmp.write(
+            "Object = IsisCube\n"
+            "  Object = Core\n"
+            "    Group = Dimensions\n"
+            "      Samples = 10\n"
+            "      Lines = 20\n"
+            "      Bands = 1\n"
+            "    End_Group\n"
+            "    Group = Pixels\n"
+            "      Type = SignedWord\n"
+            "    End_Group\n"
+            "  End_Object\n"
+            "  Group = Mapping\n"
+            "    ProjectionName = Sinusoidal\n"
+            "  End_Group\n"
+            "End_Object\n"
+            "End\n"
+        )
+        tmp.close()
+        self.cube = tmp.name
+        si._load_cube_info.cache_clear()
+
+    def tearDown(self):
+        os.unlink(self.cube)
+
+    def test_label_is_cached(self):
+        self.assertTrue(si.is_projected(self.cube))
+        self.assertTrue(si.is_projected(self.cube))
+        info = si.cube_info_cache_info()
+        self.assertEqual(1, info.misses)
+        self.assertEqual(1, info.hits)
+
+    def test_cube_info(self):
+        info = si.get_cube_info(self.cube)
+        self.assertEqual("int16", info.dtype)
+        self.assertEqual((10, 20, 1), info.raster_size)
+        self.assertEqual("int16", si.get_dtype(Path(self.cube)))
+        self.assertEqual(1, si.cube_info_cache_info().hits)
+
+    def test_get_dtype_not_a_cube(self):
+        self.assertIsNone(si.get_dtype(None))
+        self.assertIsNone(si.get_dtype("does_not_exist.cub"))
+
+    def test_modified_label_is_reloaded(self):
+        self.assertTrue(si.is_projected(self.cube))
+        with open(self.cube, "w") as f:
+            f.write("Object = IsisCube\nEnd_Object\nEnd\n")
+        mtime = os.path.getmtime(self.cube) + 10
+        os.utime(self.cube, (mtime, mtime))
+        self.assertFalse(si.is_projected(self.cube))
+
+    def test_mappt_on_worker_pool(self):
+        stdout = (
+            "Group = Results\n"
+            "  Sample = 10.5\n"
+            "  Line = 20.5\n"
+            "End_Group\n"
+            "End\n"
+        )
+        mappt = Mock(return_value=SimpleNamespace(stdout=stdout))
+        with patch.object(si, "isis", SimpleNamespace(mappt=mappt)):
+            res = si.point_info(self.cube, [1, 2, 3], [4, 5, 6], "ground")
+        self.assertEqual(3, mappt.call_count)
+        self.assertEqual(3, len(res))
+        self.assertEqual(10, res[0]["Sample"])
+        self.assertEqual(20, res[2]["Line"])
+
+
 class TestISIS(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -1,6 +1,91 @@
+from collections import namedtuple
 from math import modf, floor
+import threading
+import weakref
+
 import numpy as np
 
+from autocnet.spatial import isis
+
+# The number of pixel blocks kept per image. Sized to hold the template and
+# search windows of the few most recently matched measures.
+MAX_BUFFERS_PER_IMAGE = 8
+
+ReadInfo = namedtuple('ReadInfo', ['reads', 'hits', 'pixels_read'])
+
+# Pixel blocks read from an image, keyed on the (weakly referenced) image
+# object, as lists of (extent, dtype, array) with the most recently used last.
+_buffers = weakref.WeakKeyDictionary()
+_read_counts = {'reads':0, 'hits':0, 'pixels_read':0}
+# Guards the buffers, ROIs may be read from several threads (e.g., the measures
+# of a point registered concurrently)
+_buffers_lock = threading.RLock()
+
+def read_info():
+    """
+    Returns the (reads, hits, pixels_read) statistics of the ROI buffers,
+    where reads is the number of read_array calls made on image objects,
+    hits the number of ROI arrays served from previously read pixels and
+    pixels_read the total number of pixels read.
+    """
+    return ReadInfo(**_read_counts)
+
+def clear_buffers(reset_counts=True):
+    """
+    Drop all of the cached ROI pixels, e.g., after an image has been
+    rewritten on disk.
+
+    Parameters
+    ----------
+    reset_counts : bool
+                   If True (default) also reset the read_info counters
+    """
+    with _buffers_lock:
+        _buffers.clear()
+        if reset_counts:
+            for k in _read_counts:
+                _read_counts[k] = 0
+
+def _read_extent(data, extent, dtype):
+    """
+    Read the [left_x, right_x, top_y, bottom_y] (inclusive) extent from an
+    image object with a read_array method. If a previously read block of the
+    same image and dtype contains the extent the pixels are sliced from that
+    block instead of being read again.
+    """
+    left_x, right_x, top_y, bottom_y = extent
+    with _buffers_lock:
+        try:
+            buffers = _buffers.setdefault(data, [])
+        except TypeError:
+            # Not weak referenceable, read without caching
+            buffers = None
+
+        if buffers:
+            for i in range(len(buffers) - 1, -1, -1):
+                (b_left, b_right, b_top, b_bottom), b_dtype, block = buffers[i]
+                if b_dtype == dtype and b_left <= left_x and right_x <= b_right and \
+                   b_top <= top_y and bottom_y <= b_bottom:
+                    buffers.append(buffers.pop(i))
+                    _read_counts['hits'] += 1
+                    return block[top_y-b_top:bottom_y-b_top+1,
+                                 left_x-b_left:right_x-b_left+1].copy()
+
+    # Have to reformat to [xstart, ystart, xnumberpixels, ynumberpixels]
+    pixels = [left_x, top_y, right_x-left_x+1, bottom_y-top_y+1]
+    block = data.read_array(pixels=pixels, dtype=dtype)
+
+    with _buffers_lock:
+        _read_counts['reads'] += 1
+        _read_counts['pixels_read'] += pixels[2] * pixels[3]
+
+        if buffers is not None and isinstance(block, np.ndarray) and block.shape == (pixels[3], pixels[2]):
+            buffers.append((tuple(extent), dtype, block))
+            del buffers[:-MAX_BUFFERS_PER_IMAGE]
+            # Callers own the returned array, the buffer keeps its own copy
+            block = block.copy()
+    return block
+
 
 class Roi():
     """
@@ -37,6 +122,16 @@ class Roi():
 
     bottom_y : int
                The bottom image coordinate in imge space
+
+    Notes
+    -----
+    When the data is an image object (e.g., a GeoDataset) the pixels are read
+    once per extent and dtype and kept in a small, per image buffer. Any ROI
+    of the same image whose extent falls inside a buffered block, e.g., the
+    shrinking windows of iterative matchers or repeated array, variance and
+    is_valid calls, is sliced from the buffer instead of being read again.
+    Use read_info to get the read and hit counts and clear_buffers to drop
+    the buffered pixels.
     """
     def __init__(self, data, x, y, size_x=200, size_y=200, dtype=None, ndv=None, ndv_threshold=0.5):
         self.data = data
@@ -164,9 +259,11 @@ class Roi():
         if isinstance(self.data, np.ndarray):
             data = self.data[pixels[2]:pixels[3]+1,pixels[0]:pixels[1]+1]
         else:
-            # Have to reformat to [xstart, ystart, xnumberpixels, ynumberpixels]
-            pixels = [pixels[0], pixels[2], pixels[1]-pixels[0]+1, pixels[3]-pixels[2]+1]
-            data = self.data.read_array(pixels=pixels, dtype=self.dtype)
+            dtype = self.dtype
+            if dtype is None:
+                # Fall back to the pixel type in the (cached) ISIS label
+                dtype = isis.get_dtype(getattr(self.data, 'file_name', None))
+            data = _read_extent(self.data, pixels, dtype)
         return data
 
     def clip(self, dtype=None):
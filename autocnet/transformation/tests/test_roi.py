@@ -1,6 +1,9 @@
+from unittest.mock import Mock, MagicMock, patch
+
 import numpy as np
 import pytest
 
+from autocnet.transformation import roi
 from autocnet.transformation.roi import Roi
 
 @pytest.fixture
@@ -17,6 +20,15 @@ def test_geodata_is_valid(geodata_b):
     roi = Roi(geodata_b, 5, 5)
     assert roi.is_valid == True
 
+def test_geodata_dtype_from_label():
+    gd = Mock(raster_size=[10,10], file_name='foo.cub', no_data_value=None)
+    gd.read_array = MagicMock(return_value=np.ones((5,5)))
+    roi = Roi(gd, 5, 5, size_x=2, size_y=2)
+    with patch('autocnet.spatial.isis.get_dtype', return_value='int16') as get_dtype:
+        roi.clip()
+    get_dtype.assert_called_with('foo.cub')
+    assert gd.read_array.call_args[1]['dtype'] == 'int16'
+
 def test_center(array_with_nodata):
     roi = Roi(array_with_nodata, 5, 5)
     assert roi.center == (5,5)
@@ -83,3 +95,43 @@ def test_subpixel_using_roi(x, y, x1, y1, xs, ys, size_arr, size_roi, expected):
 
     assert new_d_x == expected[0]
     assert new_d_y == expected[1]
+
+@pytest.fixture
+def buffered_geodata():
+    roi.clear_buffers()
+    arr = np.arange(100*100).reshape(100, 100)
+    def read_array(pixels=None, dtype=None):
+        return arr[pixels[1]:pixels[1]+pixels[3], pixels[0]:pixels[0]+pixels[2]].astype(dtype)
+    gd = Mock(raster_size=[100,100], file_name='foo.cub', no_data_value=None)
+    gd.read_array = MagicMock(side_effect=read_array)
+    yield gd, arr
+    roi.clear_buffers()
+
+def test_roi_reads_once(buffered_geodata):
+    gd, arr = buffered_geodata
+    r = Roi(gd, 50, 50, size_x=10, size_y=10, dtype='int64')
+    assert r.is_valid
+    r.variance
+    clipped = r.clip(dtype='int64')
+    np.testing.assert_array_equal(clipped, arr[40:61, 40:61])
+    assert gd.read_array.call_count == 1
+    assert roi.read_info() == (1, 2, 21*21)
+
+def test_roi_subwindow_from_buffer(buffered_geodata):
+    gd, arr = buffered_geodata
+    Roi(gd, 50, 50, size_x=10, size_y=10, dtype='int64').clip(dtype='int64')
+    # A smaller window of the same image is sliced from the buffered block
+    small = Roi(gd, 52, 48, size_x=5, size_y=5).clip(dtype='int64')
+    np.testing.assert_array_equal(small, arr[43:54, 47:58])
+    # A different dtype or a window outside the block is read again
+    Roi(gd, 52, 48, size_x=5, size_y=5).clip(dtype='float32')
+    Roi(gd, 70, 70, size_x=5, size_y=5).clip(dtype='int64')
+    assert gd.read_array.call_count == 3
+    assert roi.read_info().hits == 1
+
+def test_roi_buffer_is_not_modified(buffered_geodata):
+    gd, arr = buffered_geodata
+    clipped = Roi(gd, 50, 50, size_x=10, size_y=10).clip(dtype='int64')
+    clipped[:] = -1
+    clipped = Roi(gd, 50, 50, size_x=10, size_y=10).clip(dtype='int64')
+    np.testing.assert_array_equal(clipped, arr[40:61, 40:61])
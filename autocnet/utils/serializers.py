@@ -3,6 +3,7 @@ import datetime
 import json
 
 import dill
+import msgpack
 import numpy as np
 import shapely
 from shapely import wkt  # Not available in shapely.wkt
@@ -45,4 +46,70 @@ def object_hook(dct):
                 except: pass
         # All other obj should be readable
         dct[k] = v
-    return dct
\ No newline at end of file
+    return dct
+
+# msgpack extension type code used for dill serialized callables
+DILL_EXT_TYPE = 1
+
+def _msgpack_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, datetime.datetime):
+        return obj.__str__()
+    if isinstance(obj, set):
+        return sorted(list(obj))
+    if isinstance(obj, shapely.geometry.base.BaseGeometry):
+        return obj.wkt
+    if callable(obj):
+        return msgpack.ExtType(DILL_EXT_TYPE, dill.dumps(obj))
+    raise TypeError(f'Object of type {type(obj).__name__} is not serializable')
+
+def _msgpack_ext_hook(code, data):
+    if code == DILL_EXT_TYPE:
+        return dill.loads(data)
+    return msgpack.ExtType(code, data)
+
+def encode_message(msg):
+    """
+    Encode a message as compact, msgpack serialized bytes.
+
+    Supports the same types as the JsonEncoder. Callables are dill
+    serialized into a msgpack extension type instead of base64 encoded
+    strings.
+
+    Parameters
+    ----------
+    msg : dict
+          The message to encode
+
+    Returns
+    -------
+     : bytes
+       The encoded message
+    """
+    return msgpack.packb(msg, default=_msgpack_default, use_bin_type=True)
+
+def decode_message(raw):
+    """
+    Decode a message created with encode_message. JSON messages (created
+    using the JsonEncoder) are also supported so that messages pushed
+    by older versions can still be processed.
+
+    Parameters
+    ----------
+    raw : bytes / str
+          The encoded message
+
+    Returns
+    -------
+     : dict
+       The decoded message
+    """
+    if isinstance(raw, str) or raw[:1] == b'{':
+        return json.loads(raw, object_hook=object_hook)
+    return msgpack.unpackb(raw, raw=False, ext_hook=_msgpack_ext_hook,
+                           object_hook=object_hook, strict_map_key=False)
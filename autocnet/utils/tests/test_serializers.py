@@ -7,7 +7,7 @@ import json
 
 from shapely.geometry import Point
 
-from autocnet.utils.serializers import JsonEncoder, object_hook
+from autocnet.utils.serializers import JsonEncoder, object_hook, encode_message, decode_message
 
 @pytest.mark.parametrize("data, serialized", [
     ({'foo':np.arange(5)}, {"foo": [0, 1, 2, 3, 4]}),
@@ -43,4 +43,35 @@ def test_json_roundtrip(data):
             args = [True] * nparams
             assert as_dict[k](*args) == v(*args)
             continue
-        assert as_dict[k] == v
\ No newline at end of file
+        assert as_dict[k] == v
+
+@pytest.mark.parametrize("data, serialized", [
+    ({'foo':np.arange(5)}, {"foo": [0, 1, 2, 3, 4]}),
+    ({'foo':np.int64(1)}, {"foo": 1}),
+    ({'foo':np.float32(0.5)}, {"foo": 0.5}),
+    ({'foo':set(['a', 'b', 'c'])}, {"foo": ["a", "b", "c"]}),
+    ({'foo':Point(0,0)}, {"foo": 'POINT (0 0)'}),
+    ({'foo':datetime(1982, 9, 8)}, {"foo": '1982-09-08 00:00:00'}),
+    ({'foo':(0, 1)}, {"foo": [0, 1]})
+])
+def test_message_encoding(data, serialized):
+    res = decode_message(encode_message(data))
+    if isinstance(res['foo'], Point):
+        res['foo'] = res['foo'].wkt
+    assert res == serialized
+
+def test_message_roundtrip_callable():
+    data = {'func':lambda x,y:x+y, 'kwargs':{'f':lambda x:True}}
+    res = decode_message(encode_message(data))
+    assert res['func'](1, 2) == 3
+    assert res['kwargs']['f'](None) == True
+
+def test_decode_json_message():
+    data = {'func':lambda x:True, 'other':1}
+    res = decode_message(json.dumps(data, cls=JsonEncoder).encode())
+    assert res['func'](None) == True
+    assert res['other'] == 1
+
+def test_message_encoding_is_compact():
+    data = {'along':'measures', 'id':123456, 'job_spec':'autocnet:job:da39a3ee5e6b4b0d3255bfef95601890afd80709'}
+    assert len(encode_message(data)) < len(json.dumps(data, cls=JsonEncoder))
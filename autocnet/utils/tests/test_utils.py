@@ -184,3 +184,22 @@ class TestUtils(unittest.TestCase):
         wrapped_func = decorator(func_to_wrap)
 
         self.assertTrue(wrapped_func(1),2)
+
+    def test_sliding_window_view(self):
+        x = np.arange(20).reshape(4, 5)
+        windows = utils.sliding_window_view(x, (2, 3))
+        self.assertEqual(windows.shape, (3, 3, 2, 3))
+        for i in range(3):
+            for j in range(3):
+                np.testing.assert_array_equal(windows[i, j], x[i:i+2, j:j+3])
+        self.assertFalse(windows.flags.writeable)
+
+    def test_sliding_window_view_axis(self):
+        x = np.arange(40).reshape(2, 4, 5)
+        windows = utils.sliding_window_view(x, (2, 3), axis=(1, 2))
+        self.assertEqual(windows.shape, (2, 3, 3, 2, 3))
+        np.testing.assert_array_equal(windows[1, 2, 1], x[1, 2:4, 1:4])
+
+    def test_sliding_window_view_too_large(self):
+        with self.assertRaises(ValueError):
+            utils.sliding_window_view(np.zeros((2, 2)), (3, 1))
@@ -411,6 +411,46 @@ def cartesian(arrays, out=None):
     return out
 
 
+def sliding_window_view(x, window_shape, axis=None):
+    """
+    Create a read-only view of all of the windows of shape window_shape
+    in x. This mirrors numpy.lib.stride_tricks.sliding_window_view, which
+    is only available in numpy >= 1.20.
+
+    Parameters
+    ----------
+    x : array_like
+        The array to create the windows from.
+    window_shape : int or tuple
+        The size of the window over each axis in axis.
+    axis : int or tuple
+        The axes to slide the window over. If None, the window slides
+        over all of the axes and window_shape must have x.ndim entries.
+
+    Returns
+    -------
+    : ndarray
+        A view with shape reduced x.shape + window_shape, where each of the
+        windowed axes has length x.shape[ax] - window_shape[i] + 1.
+    """
+    x = np.asarray(x)
+    window_shape = tuple(np.atleast_1d(window_shape).astype(int))
+    if axis is None:
+        axis = tuple(range(x.ndim))
+    axis = tuple(a % x.ndim for a in np.atleast_1d(axis))
+    if len(window_shape) != len(axis):
+        raise ValueError('window_shape must have one entry per axis.')
+
+    shape = list(x.shape)
+    for ax, size in zip(axis, window_shape):
+        if size < 0 or shape[ax] < size:
+            raise ValueError('window_shape cannot be larger than the input array.')
+        shape[ax] -= size - 1
+    shape = tuple(shape) + window_shape
+    strides = x.strides + tuple(x.strides[ax] for ax in axis)
+    return np.lib.stride_tricks.as_strided(x, shape=shape, strides=strides, writeable=False)
+
+
 def array_to_poly(array):
     """
     Generate a geojson geom
@@ -0,0 +1,80 @@
+"""
+Benchmark the Ciratefi matcher stages on subpixel_ciratefi sized inputs.
+
+The runtimes of the vectorized cifi, rafi and tefi stages are reported along
+with an estimate of the previous per pixel implementation of the cifi search
+sampling, which built a circular mask and summed the search image for every
+pixel and radius. That estimate is extrapolated from a random sample of
+pixels as the full loop takes hours on a 251 pixel search.
+
+Usage: python benchmarks/bench_ciratefi.py [--template-size 25] [--search-size 125] [--nsample 200]
+"""
+import argparse
+import math
+import time
+import warnings
+
+import numpy as np
+from skimage import data
+
+from autocnet.matcher import ciratefi
+
+
+def per_pixel_cifi_search(search_image, radii, pixels):
+    """
+    The previous cifi search sampling, restricted to the given (y, x) pixels.
+    """
+    for y, x in pixels:
+        for r in radii:
+            mask = ciratefi.circ_mask(search_image.shape, (y, x), r)
+            np.sum(search_image[mask]) / (2 * math.pi * r)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    res = func(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--template-size', type=int, default=25,
+                        help='1/2 the template size, as passed to subpixel_ciratefi.')
+    parser.add_argument('--search-size', type=int, default=125,
+                        help='1/2 the search size, as passed to subpixel_ciratefi.')
+    parser.add_argument('--nsample', type=int, default=200,
+                        help='The number of pixels used to estimate the per pixel cifi runtime.')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    image = data.camera().astype(float) / 255
+    cy, cx = np.array(image.shape) // 2
+    template = image[cy-args.template_size:cy+args.template_size+1,
+                     cx-args.template_size:cx+args.template_size+1]
+    search = image[cy-args.search_size:cy+args.search_size+1,
+                   cx-args.search_size:cx+args.search_size+1]
+    radii = list(range(1, 12))
+    print(f'template: {template.shape}, search: {search.shape}')
+
+    (fg_pixels, best_scales), cifi_time = timed(ciratefi.cifi, template, search, thresh=95, radii=radii)
+    (sg_pixels, best_rotation), rafi_time = timed(ciratefi.rafi, template, search, fg_pixels, best_scales,
+                                                  thresh=95, alpha=math.pi/16, radii=radii)
+    _, tefi_time = timed(ciratefi.tefi, template, search, sg_pixels, best_scales, best_rotation,
+                         thresh=100, alpha=math.pi/4, upsampling=1)
+
+    rng = np.random.default_rng(0)
+    pixels = np.column_stack((rng.integers(0, search.shape[0], args.nsample),
+                              rng.integers(0, search.shape[1], args.nsample)))
+    _, sample_time = timed(per_pixel_cifi_search, search, radii, pixels)
+    per_pixel_estimate = sample_time / args.nsample * search.size
+
+    print(f'{"stage":<36}{"candidates":>12}{"seconds":>12}')
+    print(f'{"cifi":<36}{len(fg_pixels):>12}{cifi_time:>12.3f}')
+    print(f'{"rafi":<36}{len(sg_pixels):>12}{rafi_time:>12.3f}')
+    print(f'{"tefi":<36}{"":>12}{tefi_time:>12.3f}')
+    print(f'{"per pixel cifi search (estimated)":<36}{"":>12}{per_pixel_estimate:>12.1f}')
+    print(f'cifi speedup: {per_pixel_estimate / cifi_time:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark the mutual information matcher over a sweep of the image and
+template sizes used by subpixel_register_point_smart.
+
+For every parameter set the template is cut from a shifted copy of a test
+image and matched in a search image around the same center. The runtime of
+mutual_information_match with the batched mutual_information_map is reported
+along with the runtime of the previous per window loop (one
+numpy.histogram2d call per offset), and whether both produce the same
+correlation map and offsets.
+
+Usage: python benchmarks/bench_mutual_information.py [--sizes 121:61 151:67 181:73] [--bins 10 20]
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy.ndimage import shift
+from skimage import data
+
+from autocnet.matcher.mutual_information import mutual_information, mutual_information_match
+
+
+def make_pair(image_size, template_size, seed=0):
+    rng = np.random.default_rng(seed)
+    image = data.camera().astype(float)
+    cy, cx = np.array(image.shape) // 2
+    hi = image_size // 2
+    ht = template_size // 2
+    sx, sy = rng.uniform(-5, 5, 2)
+    shifted = shift(image, (sy, sx), order=3)
+    template = shifted[cy-ht:cy+ht+1, cx-ht:cx+ht+1].astype(np.uint8)
+    search = image[cy-hi:cy+hi+1, cx-hi:cx+hi+1].astype(np.uint8)
+    return template, search
+
+
+def timed(matcher, *args, **kwargs):
+    start = time.perf_counter()
+    res = matcher(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', default=['121:61', '151:67', '181:73'],
+                        help='The image_size:template_size parameter sets to sweep.')
+    parser.add_argument('--bins', type=int, nargs='+', default=[10, 20],
+                        help='The numbers of histogram bins to sweep.')
+    args = parser.parse_args()
+
+    print(f'{"image":>7}{"template":>10}{"bins":>6}{"offsets":>9}{"batched (s)":>13}{"per window (s)":>16}{"speedup":>9}{"same":>6}')
+    for size in args.sizes:
+        image_size, template_size = map(int, size.split(':'))
+        template, search = make_pair(image_size, template_size)
+        for bins in args.bins:
+            batched, t_batched = timed(mutual_information_match, template, search, bins=bins)
+            loop, t_loop = timed(mutual_information_match, template, search,
+                                 func=mutual_information, bins=bins)
+            same = batched[:3] == loop[:3] and np.array_equal(batched[3], loop[3])
+            print(f'{image_size:>7}{template_size:>10}{bins:>6}{batched[3].size:>9}'
+                  f'{t_batched:>13.3f}{t_loop:>16.3f}{t_loop/t_batched:>9.1f}{str(same):>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark the upsampling pattern matcher against the native resolution,
+locally refined pattern matcher.
+
+Random subpixel shifts are applied to a test image and the template is
+matched in a search image around the same center. The mean and max error
+of the recovered shift and the mean runtime per match are reported.
+
+Usage: python benchmarks/bench_pattern_match.py [--n 20] [--image-size 121] [--template-size 51]
+"""
+import argparse
+from functools import partial
+import time
+
+import numpy as np
+from scipy.ndimage import shift
+from skimage import data
+
+from autocnet.matcher.naive_template import pattern_match, pattern_match_fft
+
+
+def make_pairs(n, image_size, template_size, seed=0):
+    rng = np.random.default_rng(seed)
+    image = data.camera().astype(float)
+    cy, cx = np.array(image.shape) // 2
+    hi = image_size // 2
+    ht = template_size // 2
+    pairs = []
+    for sx, sy in rng.uniform(-5, 5, (n, 2)):
+        shifted = shift(image, (sy, sx), order=3)
+        template = shifted[cy-ht:cy+ht+1, cx-ht:cx+ht+1].astype(np.uint8)
+        search = image[cy-hi:cy+hi+1, cx-hi:cx+hi+1].astype(np.uint8)
+        pairs.append((template, search, -sx, -sy))
+    return pairs
+
+
+def run(matcher, pairs):
+    errors = []
+    start = time.perf_counter()
+    for template, search, ex, ey in pairs:
+        x, y, _, _ = matcher(template, search)
+        errors.append(np.hypot(x - ex, y - ey))
+    elapsed = (time.perf_counter() - start) / len(pairs)
+    return np.mean(errors), np.max(errors), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=20, help='The number of random shifts to test.')
+    parser.add_argument('--image-size', type=int, default=121, help='The size of the search image.')
+    parser.add_argument('--template-size', type=int, default=51, help='The size of the template.')
+    args = parser.parse_args()
+
+    pairs = make_pairs(args.n, args.image_size, args.template_size)
+    matchers = {'pattern_match (upsampling=16)': pattern_match,
+                'pattern_match_fft (quadratic)': partial(pattern_match_fft, refine='quadratic'),
+                'pattern_match_fft (upsample)': partial(pattern_match_fft, refine='upsample')}
+
+    print(f'{"matcher":<32}{"mean err (px)":>15}{"max err (px)":>15}{"ms/match":>12}')
+    for name, matcher in matchers.items():
+        mean_err, max_err, elapsed = run(matcher, pairs)
+        print(f'{name:<32}{mean_err:>15.4f}{max_err:>15.4f}{elapsed*1000:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
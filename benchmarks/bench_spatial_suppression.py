@@ -0,0 +1,65 @@
+"""
+Benchmark spatial suppression across match counts.
+
+Uniformly distributed matches with random strengths are suppressed to k
+points over a square domain. The runtime of spatial_suppression is reported
+along with the runtime of the previous per point (iterrows) cell assignment
+for a single cell size, which was run at every step of the binary search.
+
+Usage: python benchmarks/bench_spatial_suppression.py [--counts 1000 10000 100000] [--k 60]
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from autocnet.matcher.cpu_outlier_detector import spatial_suppression
+
+
+def per_point_assignment(df, domain, n_cells):
+    """
+    The previous cell assignment, one point at a time, for a single cell size.
+    """
+    grid = np.zeros((n_cells, n_cells), dtype=bool)
+    edges = np.linspace(0, domain, n_cells)
+    xbins = np.digitize(df['x'], bins=edges)
+    ybins = np.digitize(df['y'], bins=edges)
+    result = []
+    for i, (idx, p) in enumerate(df.iterrows()):
+        if not grid[ybins[i] - 1, xbins[i] - 1]:
+            result.append(idx)
+            grid[ybins[i] - 1, xbins[i] - 1] = True
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='The numbers of matches to suppress.')
+    parser.add_argument('--k', type=int, default=60, help='The desired number of points.')
+    parser.add_argument('--domain', type=float, default=5000, help='The size of the square domain.')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    rng = np.random.default_rng(0)
+    print(f'{"matches":>10}{"kept":>8}{"suppression (s)":>18}{"per point step (s)":>20}')
+    for count in args.counts:
+        df = pd.DataFrame({'x': rng.uniform(0, args.domain, count),
+                           'y': rng.uniform(0, args.domain, count),
+                           'strength': rng.random(count)})
+
+        start = time.perf_counter()
+        mask, k = spatial_suppression(df, (0, 0, args.domain, args.domain), k=args.k)
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        per_point_assignment(df.sort_values('strength').reset_index(drop=True), args.domain, 10)
+        per_point = time.perf_counter() - start
+
+        print(f'{count:>10}{k:>8}{elapsed:>18.4f}{per_point:>20.4f}')
+
+
+if __name__ == '__main__':
+    main()